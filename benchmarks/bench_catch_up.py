@@ -0,0 +1,85 @@
+#
+#   Description: Wall time of a --from/--to catch-up over several missed days, processed one day at a
+#                time (catchUpWorkers=1) against concurrently (catchUpWorkers=N), per day and with
+#                --merge_days. Runs the real script through suite.py with fakes.FakeGmail, so the
+#                Gmail latency that makes the days worth overlapping is simulated.
+#
+#   Usage: python benchmarks/bench_catch_up.py [--days 7] [--rows 2000] [--workers 1 4] [--latency 0.5]
+#
+#   The days' notifications are queued in the outbox and sent at the end of the catch-up by
+#   catchUpWorkers threads (at least [email] workers with --batch), within [email] sendRate.
+#
+
+import os, sys, json, shutil, argparse, datetime, tempfile, subprocess
+from configparser import ConfigParser
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH)
+
+import suite, roster
+
+
+def make_workspace(rosters, dates, workers):
+    work = tempfile.mkdtemp(prefix=f"bench-catch-up-{workers}-")
+    suite.write_config(work)
+    shutil.copytree(os.path.join(suite.ROOT, 'templates'), os.path.join(work, 'templates'),
+                    ignore=shutil.ignore_patterns('.cache'))
+    config_file = os.path.join(work, 'config', 'update-students.ini')
+    config = ConfigParser(interpolation=None)
+    config.optionxform = str
+    config.read(config_file)
+    config.set('general', 'catchUpWorkers', str(workers))
+    with open(config_file, 'w') as f:
+        config.write(f)
+    for date, source in zip(dates, rosters):
+        os.makedirs(os.path.join(work, 'data', date))
+        shutil.copyfile(source, os.path.join(work, 'data', date, 'StudentCreated.csv'))
+    return work
+
+
+def run(work, options, script_args):
+    result_file = os.path.join(work, 'result.json')
+    command = [sys.executable, os.path.join(BENCH, 'suite.py'), '--child', work, '--child-result', result_file,
+               '--latency', str(options.latency), '--'] + script_args
+    with open(os.path.join(work, 'output.log'), 'w') as log:
+        subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, cwd=work, check=True)
+    with open(result_file) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=int, default=7, help='Missed days to catch up on')
+    parser.add_argument('--rows', type=int, default=2000, help='Students in each day\'s export')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4], help='catchUpWorkers values to compare')
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds each fake Gmail send takes')
+    options = parser.parse_args()
+
+    last = datetime.date.today() - datetime.timedelta(days=1)
+    dates = [(last - datetime.timedelta(days=offset)).strftime("%m-%d-%Y") for offset in reversed(range(options.days))]
+    catch_up = ['--from', dates[0], '--to', dates[-1]]
+
+    print(f"{options.days} day(s) of {options.rows} students, Gmail sends take {options.latency * 1000:.0f} ms")
+    print(f"{'mode':>10} {'workers':>8} {'wall s':>8} {'export s':>9} {'send s':>8} {'emails':>7} {'speedup':>8}")
+    with tempfile.TemporaryDirectory(prefix='bench-rosters-') as folder:
+        rosters = [roster.write_roster(os.path.join(folder, f"{date}.csv"), options.rows, seed=index)
+                   for index, date in enumerate(dates)]
+        for mode, script_args in (('per day', catch_up), ('batch', catch_up + ['--batch']),
+                                  ('merge_days', catch_up + ['--merge_days'])):
+            serial = None
+            for workers in options.workers:
+                work = make_workspace(rosters, dates, workers)
+                try:
+                    result = run(work, options, script_args)
+                finally:
+                    shutil.rmtree(work, ignore_errors=True)
+                wall = result['wall_seconds']
+                serial = serial or wall
+                stages = result['stages']
+                print(f"{mode:>10} {workers:>8} {wall:>8.2f} {stages.get('export.partition', {}).get('seconds', 0):>9.2f} "
+                      f"{stages.get('email.send', {}).get('seconds', 0):>8.2f} {result['gmail']['sent']:>7} "
+                      f"{serial / wall:>7.1f}x", flush=True)
+
+
+if __name__ == "__main__":
+    main()
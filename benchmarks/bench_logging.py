@@ -0,0 +1,110 @@
+#
+#   Description: Per record cost of logging at DEBUG for the code that logs, and the time until
+#                everything is on disk:
+#                  sync        - logging.basicConfig with a FileHandler and a StreamHandler, as before
+#                  queue       - lib/log_pipeline.py: QueueHandler to a listener thread, rotating file
+#                  queue-json  - the same with the JSON lines file format
+#                Records are logged by several threads, like the catch-up and sending workers, with
+#                a date, building and stage context. The console is a file whose writes can be slowed
+#                down with --console-delay (a Windows console takes tens of microseconds per line).
+#
+#   Usage: python benchmarks/bench_logging.py [--records 200000] [--threads 4] [--console-delay 0.00005]
+#
+#   Each mode runs in its own process so the logging setup is not shared between them. log MB counts
+#   the log file and its gzipped rotations.
+#
+
+import os, sys, time, argparse, tempfile, threading, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class SlowConsole(object):
+    """A console stand-in: writes go to os.devnull after delay seconds, without holding the GIL like real I/O."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.file = open(os.devnull, 'w')
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+
+def run(mode, folder, records, threads, console_delay):
+    """
+    Configure logging for mode, log records from threads and return (seconds the slowest thread spent
+    logging, seconds until every record was written, records logged).
+    """
+    import logging
+    from lib import log_pipeline, metrics
+
+    log_file = os.path.join(folder, f"{mode}.log")
+    console = logging.StreamHandler(SlowConsole(console_delay))
+    text_formatter = logging.Formatter(log_pipeline.TEXT_FORMAT, style="{", datefmt=log_pipeline.DATE_FORMAT)
+    listener = None
+    if mode == 'sync':
+        logging.basicConfig(level=logging.DEBUG, format=log_pipeline.TEXT_FORMAT, style="{", datefmt=log_pipeline.DATE_FORMAT,
+                            handlers=[logging.FileHandler(filename=log_file, mode='a+', encoding='utf-8'), console])
+    else:
+        file_handler = log_pipeline.file_handler(log_file, max_bytes=10 * 2 ** 20, backup_count=10)
+        file_handler.setFormatter(log_pipeline.JsonFormatter() if mode == 'queue-json' else text_formatter)
+        console.setFormatter(text_formatter)
+        listener = log_pipeline.setup(logging.DEBUG, [file_handler, console])
+
+    logger = logging.getLogger('bench')
+    per_thread = records // threads
+    caller_seconds = [0.0] * threads
+
+    def work(index):
+        start = time.perf_counter()
+        with log_pipeline.context(date='10-03-2026', building=f"Building {index}"), metrics.span('email.send'):
+            for i in range(per_thread):
+                logger.debug(f"Row {i}: sent notification to secretary{i % 7}@ohlsd.org with 1 attachment(s)")
+        caller_seconds[index] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=work, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if listener is not None:
+        listener.stop()
+    total = time.perf_counter() - start
+    return max(caller_seconds), total, per_thread * threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--console-delay', type=float, default=0.00005, help='Seconds each console write takes')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--folder', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(*run(args.child, args.folder, args.records, args.threads, args.console_delay))
+        return
+
+    print(f"{'mode':>11} {'records':>9} {'caller us/record':>17} {'caller s':>9} {'on disk s':>10} {'log MB':>8}")
+    with tempfile.TemporaryDirectory() as folder:
+        for mode in ('sync', 'queue', 'queue-json'):
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, '--folder', folder,
+                                  '--records', str(args.records), '--threads', str(args.threads),
+                                  '--console-delay', str(args.console_delay)],
+                                 check=True, capture_output=True, text=True, cwd=ROOT).stdout.split()
+            caller, total, count = float(out[0]), float(out[1]), int(out[2])
+            size = sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder) if name.startswith(f"{mode}.log"))
+            print(f"{mode:>11} {count:>9} {caller / (count / args.threads) * 1e6:>17.1f} {caller:>9.2f} {total:>10.2f} "
+                  f"{size / 2 ** 20:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
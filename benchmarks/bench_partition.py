@@ -0,0 +1,68 @@
+#
+#   Description: Compare peak memory and time of the streaming partitioner against the old
+#                read-everything-then-group approach on synthetic StudentCreated.csv files.
+#
+#   Usage: python benchmarks/bench_partition.py [--rows 100000 1000000]
+#
+#   Each measurement runs in its own process so peak RSS is not shared between runs.
+#   Peak RSS comes from resource.getrusage and is only available on Linux/macOS.
+#
+
+import os, sys, csv, argparse, tempfile, subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from roster import HEADERS, write_roster
+
+
+def legacy(path, out_dir):
+    # The approach get_new_student_data used before the streaming partitioner
+    with open(path, 'r', encoding='utf-8') as csv_file:
+        data = [row for row in csv.DictReader(csv_file)]
+    students_building = {}
+    for student in data:
+        students_building.setdefault(student['School Name'].strip(), []).append(student)
+    for building_name, students in students_building.items():
+        with open(os.path.join(out_dir, f"{abs(hash(building_name))}.csv"), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=HEADERS)
+            writer.writeheader()
+            for student in students:
+                writer.writerow(student)
+
+
+def streaming(path, out_dir):
+    from lib import partition
+    partition.partition_rows(partition.read_rows(path), out_dir, HEADERS)
+
+
+def measure(mode, path):
+    """Run one mode in a child process and return (seconds, peak RSS in MB)."""
+    code = (f"import sys, time, resource, tempfile; sys.argv = ['']; sys.path.insert(0, {os.path.dirname(__file__)!r}); "
+            f"import bench_partition as b; t = time.perf_counter(); "
+            f"b.{mode}({path!r}, tempfile.mkdtemp()); "
+            f"print(time.perf_counter() - t, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.split()
+    seconds, rss = float(out[0]), int(out[1])
+    # ru_maxrss is KB on Linux and bytes on macOS
+    return seconds, rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'rows':>10} {'mode':>10} {'seconds':>10} {'peak MB':>10}")
+        for rows in args.rows:
+            path = os.path.join(tmp, f"StudentCreated_{rows}.csv")
+            write_roster(path, rows)
+            for mode in ('legacy', 'streaming'):
+                seconds, rss = measure(mode, path)
+                print(f"{rows:>10} {mode:>10} {seconds:>10.2f} {rss:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
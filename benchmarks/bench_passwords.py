@@ -0,0 +1,70 @@
+#
+#   Description: Password generation throughput from a large word list:
+#                  read-all - what wordlistPassword in reset_password.ps1 does per password
+#                             (Get-Content the whole file, pick one line)
+#                  indexed  - lib/passwords.py: mmap plus the cached line offset index
+#                The index build (cold) and the load of the cached index (warm) are timed too.
+#
+#   Usage: python benchmarks/bench_passwords.py [--words 1000000] [--passwords 100000]
+#
+
+import os, sys, time, random, string, argparse, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import passwords
+
+
+def write_word_list(path, words):
+    rng = random.Random(words)
+    with open(path, 'w', encoding='utf-8', newline='\r\n') as f:
+        for _ in range(words):
+            f.write(''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 12))) + '\n')
+
+
+def read_all(path, count):
+    rng = random.SystemRandom()
+    for _ in range(count):
+        with open(path, encoding='utf-8') as f:
+            words = f.read().splitlines()
+        f"{rng.choice(words)}{rng.randint(100, 999)}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--words', type=int, default=1000000)
+    parser.add_argument('--passwords', type=int, default=100000)
+    parser.add_argument('--read-all', type=int, default=20, help='Passwords generated the read-all way')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'WL.txt')
+        write_word_list(path, args.words)
+        print(f"word list: {args.words} words, {os.path.getsize(path) / 2 ** 20:.1f} MB")
+
+        start = time.perf_counter()
+        read_all(path, args.read_all)
+        per_password = (time.perf_counter() - start) / args.read_all
+        print(f"{'read-all':>10}: {1 / per_password:>12,.0f} passwords/s ({per_password * 1000:.1f} ms each)")
+
+        start = time.perf_counter()
+        word_list = passwords.WordList(path)
+        print(f"{'cold':>10}: index of {len(word_list)} words built and saved in {time.perf_counter() - start:.3f}s")
+        word_list.close()
+
+        start = time.perf_counter()
+        word_list = passwords.WordList(path)
+        print(f"{'warm':>10}: cached index loaded in {time.perf_counter() - start:.3f}s")
+
+        generator = passwords.PasswordGenerator(word_list, passwords.PasswordPolicy())
+        start = time.perf_counter()
+        for _ in range(args.passwords):
+            generator.generate()
+        elapsed = time.perf_counter() - start
+        print(f"{'indexed':>10}: {args.passwords / elapsed:>12,.0f} passwords/s ({elapsed / args.passwords * 1e6:.1f} us each)")
+        print(f"   example: {', '.join(generator.generate() for _ in range(3))}")
+        generator.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#
+#   Description: Speed and memory footprint of the export rows as csv.DictReader dicts against
+#                lib/records.py StudentRecords, read alone and read plus validated:
+#                  dicts     - csv.DictReader rows, what get_new_student_data used before
+#                  records   - read_records
+#                  validated - read_records through RecordValidator (normalization, duplicate
+#                              Student IDs, emails, buildings)
+#
+#   Usage: python benchmarks/bench_records.py [--rows 1000000]
+#
+#   Throughput streams the whole file. Footprint keeps every row in a list and measures the
+#   memory they hold with tracemalloc, in a child process per mode.
+#
+
+import os, sys, csv, time, argparse, tempfile, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from roster import CONFIG_FILE, write_roster
+from lib import records, buildings
+
+
+def read(mode, path, rejects_path):
+    if mode == 'dicts':
+        csv_file = open(path, 'r', encoding='utf-8', newline='')
+        return csv.DictReader(csv_file)
+    rows = records.read_records(path)
+    if mode == 'validated':
+        validator = records.RecordValidator(buildings.BuildingDirectory.load(CONFIG_FILE))
+        rows = validator.validate(rows, records.RejectReport(rejects_path, records.HEADERS))
+    return rows
+
+
+def throughput(mode, path, rejects_path):
+    start = time.perf_counter()
+    count = sum(1 for _ in read(mode, path, rejects_path))
+    return count, time.perf_counter() - start
+
+
+def footprint(mode, path, rejects_path):
+    import tracemalloc
+    tracemalloc.start()
+    rows = list(read(mode, path, rejects_path))
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return len(rows), size
+
+
+def measure(function, mode, path):
+    code = (f"import sys; sys.argv = ['']; sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r}); "
+            f"import bench_records as b; print(*b.{function}({mode!r}, {path!r}, {path + '.' + mode + '.rejects'!r}))")
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True, cwd=ROOT).stdout.split()
+    return int(out[0]), float(out[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'rows':>10} {'mode':>10} {'rows/s':>12} {'seconds':>9} {'kept':>9} {'MB kept':>9} {'bytes/row':>10}")
+        for rows in args.rows:
+            path = os.path.join(tmp, f"StudentCreated_{rows}.csv")
+            write_roster(path, rows)
+            for mode in ('dicts', 'records', 'validated'):
+                count, seconds = measure('throughput', mode, path)
+                kept, size = measure('footprint', mode, path)
+                print(f"{rows:>10} {mode:>10} {count / seconds:>12,.0f} {seconds:>9.2f} {kept:>9} "
+                      f"{size / 2 ** 20:>9.1f} {size / max(kept, 1):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
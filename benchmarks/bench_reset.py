@@ -0,0 +1,55 @@
+#
+#   Description: Resets per second of the persistent session pool against one process per reset,
+#                using benchmarks/stub_reset_password.py in place of PowerShell and Active Directory.
+#
+#   Usage: python benchmarks/bench_reset.py [--students 50] [--sessions 1 2 4] [--startup-delay 0.5]
+#
+
+import os, sys, time, argparse, subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import reset_session
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_reset_password.py')
+
+
+def one_per_process(usernames, startup_delay, reset_delay):
+    # The path reset_student_password takes: a new process per student
+    for username in usernames:
+        result = subprocess.Popen([sys.executable, STUB, '-username', username, '--startup-delay', str(startup_delay),
+                                   '--reset-delay', str(reset_delay)], stdout=subprocess.PIPE)
+        status, *update = str(result.communicate()[0][:-2], 'utf-8').split('\r\n')
+
+
+def pooled(usernames, sessions, startup_delay, reset_delay):
+    command = [sys.executable, STUB, '-serve', '--startup-delay', str(startup_delay), '--reset-delay', str(reset_delay)]
+    with reset_session.SessionPool(size=sessions, command=command) as pool:
+        results = pool.reset_many([(username, 'Test Dummy School') for username in usernames])
+    assert all(result.ok for result in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--students', type=int, default=50)
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--startup-delay', type=float, default=0.5, help='Simulated Import-Module ActiveDirectory cost')
+    parser.add_argument('--reset-delay', type=float, default=0.02, help='Simulated Get-ADUser/Set-ADAccountPassword cost')
+    args = parser.parse_args()
+
+    usernames = [f"36student{i}" for i in range(args.students)]
+
+    start = time.perf_counter()
+    one_per_process(usernames, args.startup_delay, args.reset_delay)
+    elapsed = time.perf_counter() - start
+    print(f"{'one process per reset':<24} {elapsed:8.2f}s {len(usernames) / elapsed:8.1f} resets/s")
+
+    for sessions in args.sessions:
+        start = time.perf_counter()
+        pooled(usernames, sessions, args.startup_delay, args.reset_delay)
+        elapsed = time.perf_counter() - start
+        print(f"{f'pool of {sessions} session(s)':<24} {elapsed:8.2f}s {len(usernames) / elapsed:8.1f} resets/s")
+
+
+if __name__ == "__main__":
+    main()
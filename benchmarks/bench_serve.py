@@ -0,0 +1,140 @@
+#
+#   Description: Requests per second and latency of help-desk password resets:
+#                  cli   - one "update-students.py -rp -u <user> -b <building>" process per reset
+#                  serve - POST /resets to one "update-students.py --serve" process
+#                Both run the real script through suite.py with fakes.FakeGmail and the stub reset
+#                backend (benchmarks/stub_reset_password.py), so it runs on Linux without AD or Gmail.
+#                A duplicate request for a student being reset is checked to return the same job.
+#
+#   Usage: python benchmarks/bench_serve.py [--requests 50] [--clients 1 4] [--cli-requests 8]
+#
+
+import os, sys, json, time, shutil, signal, socket, argparse, tempfile, subprocess, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH)
+
+import suite
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_workspace(port, workers):
+    work = tempfile.mkdtemp(prefix='bench-serve-')
+    suite.write_config(work)
+    shutil.copytree(os.path.join(suite.ROOT, 'templates'), os.path.join(work, 'templates'),
+                    ignore=shutil.ignore_patterns('.cache'))
+    config_file = os.path.join(work, 'config', 'update-students.ini')
+    config = ConfigParser(interpolation=None)
+    config.optionxform = str
+    config.read(config_file)
+    if not config.has_section('serve'):
+        config.add_section('serve')
+    config.set('serve', 'port', str(port))
+    config.set('serve', 'workers', str(workers))
+    with open(config_file, 'w') as f:
+        config.write(f)
+    return work
+
+
+def child_command(work, options, script_args):
+    return [sys.executable, os.path.join(BENCH, 'suite.py'), '--child', work,
+            '--child-result', os.path.join(work, f"result-{time.perf_counter_ns()}.json"),
+            '--latency', str(options.latency), '--stub-startup', str(options.stub_startup),
+            '--stub-reset', str(options.stub_reset), '--'] + script_args
+
+
+def post(port, username, building='TDS'):
+    request = urllib.request.Request(f"http://127.0.0.1:{port}/resets", method='POST',
+                                     data=json.dumps({'username': username, 'building': building}).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=120) as response:
+        return json.loads(response.read())
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def report(mode, clients, latencies, wall):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{mode:>6} {clients:>8} {len(latencies):>9} {len(latencies) / wall:>10.2f} {p50 * 1000:>9.0f} {p95 * 1000:>9.0f}")
+
+
+def bench_cli(work, options, clients):
+    def reset(i):
+        return subprocess.run(child_command(work, options, ['-rp', '-u', f"36cli{i}", '-b', 'TDS']), cwd=work,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        latencies = [seconds for seconds, _ in pool.map(lambda i: timed(reset, i), range(options.cli_requests))]
+    report('cli', clients, latencies, time.perf_counter() - start)
+
+
+def bench_serve(work, port, options, clients, offset):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(lambda i: timed(post, port, f"36serve{offset + i}"), range(options.requests)))
+    wall = time.perf_counter() - start
+    failed = [answer for _, answer in results if answer['status'] != 'success']
+    if failed:
+        print(f"  {len(failed)} reset(s) failed, e.g. {failed[0]}")
+    report('serve', clients, [seconds for seconds, _ in results], wall)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=50, help='Resets sent to the service per client count')
+    parser.add_argument('--cli-requests', type=int, default=8, help='Resets run as one process each per client count')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4], help='Concurrent help-desk callers')
+    parser.add_argument('--workers', type=int, default=2, help='PowerShell sessions of the service')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds each fake Gmail send takes')
+    parser.add_argument('--stub-startup', type=float, default=0.5, help='Simulated Import-Module ActiveDirectory cost')
+    parser.add_argument('--stub-reset', type=float, default=0.02, help='Simulated cost of one AD password reset')
+    options = parser.parse_args()
+
+    port = free_port()
+    work = make_workspace(port, options.workers)
+    server = subprocess.Popen(child_command(work, options, ['--serve']), cwd=work,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1).read()
+                break
+            except OSError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError(f"The reset service did not start, see {work}")
+                time.sleep(0.1)
+
+        print(f"{'mode':>6} {'clients':>8} {'requests':>9} {'req/s':>10} {'p50 ms':>9} {'p95 ms':>9}")
+        for clients in options.clients:
+            bench_cli(work, options, clients)
+            bench_serve(work, port, options, clients, offset=clients * options.requests)
+
+        with ThreadPoolExecutor(2) as pool:
+            first, second = pool.map(lambda _: post(port, '36duplicate'), range(2))
+        print(f"duplicate request answered with the same job: {first['id'] == second['id']}")
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
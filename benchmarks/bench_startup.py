@@ -0,0 +1,88 @@
+#
+#   Description: Cold start time of update-students.py for the three kinds of scheduled run:
+#                  no-op   - no StudentCreated.csv for today
+#                  export  - today's file is exported but no building has recipients configured
+#                  send    - today's file is exported and notifications are built and sent
+#                            (there are no Gmail credentials here, so sending stops at auth)
+#
+#   Usage: python benchmarks/bench_startup.py [--runs 10]
+#
+#   Each run is a fresh interpreter started with -X importtime, which is also used to check
+#   whether the Google client libraries and Jinja2 were imported.
+#
+
+import os, sys, time, argparse, tempfile, subprocess, statistics, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from roster import write_roster
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG = '''
+[admin]
+sysadmin = sysadmin@example.org
+serviceAccEmail = Automation <automation@example.org>
+adminEmail = {admin}
+
+[general]
+dataFolder = {data}
+csvFileHeaders = Student ID,First Name,Middle Name,Last Name,Email,School Name,Current Grade,Status,UserName,Password
+ledgerFile = {work}/ledger.db
+studentIndexFile = {work}/students.db
+
+[BuildingSecretariesEmails]
+{secretaries}
+
+[logs]
+LogLevel = INFO
+LogFile = {work}/update-students.log
+'''
+
+
+def workspace(mode, rows):
+    work = tempfile.mkdtemp(prefix=f"startup-{mode}-")
+    data = os.path.join(work, 'data')
+    os.makedirs(os.path.join(work, 'config'))
+    os.makedirs(data)
+    os.symlink(os.path.join(ROOT, 'templates'), os.path.join(work, 'templates'))
+    if mode != 'noop':
+        today = os.path.join(data, datetime.datetime.now().strftime("%m-%d-%Y"))
+        os.makedirs(today)
+        write_roster(os.path.join(today, 'StudentCreated.csv'), rows)
+    secretaries = '' if mode != 'send' else 'Oak Hills High School = Secretary <secretary@example.org>'
+    with open(os.path.join(work, 'config', 'update-students.ini'), 'w') as f:
+        f.write(CONFIG.format(admin='' if mode != 'send' else 'admin@example.org', data=data, work=work,
+                              secretaries=secretaries))
+    return work
+
+
+def run(work):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', os.path.join(ROOT, 'update-students.py'), '--force'],
+                            cwd=work, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    imported = {line.rsplit('|', 1)[-1].strip() for line in result.stderr.splitlines() if line.startswith('import time:')}
+    return elapsed, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--rows', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'path':>8} {'median ms':>10} {'min ms':>8}  google  jinja2")
+    for mode in ('noop', 'export', 'send'):
+        work = workspace(mode, args.rows)
+        times = []
+        for _ in range(args.runs):
+            elapsed, imported = run(work)
+            times.append(elapsed * 1000)
+        google = any(name.startswith('googleapiclient') or name.startswith('google_auth') for name in imported)
+        jinja = any(name.startswith('jinja2') for name in imported)
+        print(f"{mode:>8} {statistics.median(times):>10.1f} {min(times):>8.1f}  {str(google):>6}  {str(jinja):>6}")
+
+
+if __name__ == "__main__":
+    main()
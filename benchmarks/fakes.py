@@ -0,0 +1,110 @@
+#
+#   Description: In-process stand-ins used by the benchmarks so nothing reaches Gmail or Active Directory:
+#                  FakeGmail         - replaces lib/send_email.sendMessage (and the shared client) with
+#                                      configurable latency, 503 errors and lost responses
+#                  stub_powershell   - runs benchmarks/stub_reset_password.py wherever update-students
+#                                      would start powershell.exe with lib/reset_password.ps1
+#
+
+import os, sys, time, random, threading, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib import send_email, metrics
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_reset_password.py')
+
+class FakeResponse(object):
+    def __init__(self, status):
+        self.status = status
+
+
+class FakeHttpError(Exception):
+    """Looks like googleapiclient.errors.HttpError to dispatch.is_retryable and the outbox."""
+
+    def __init__(self, status, reason='Service unavailable'):
+        super().__init__(f"<HttpError {status} \"{reason}\">")
+        self.resp = FakeResponse(status)
+
+
+class FakeGmail(object):
+    """Fake GmailClient: sends take latency seconds (plus up to jitter), a share of them fail.
+
+    Args:
+      latency: Seconds each send takes.
+      jitter: Extra random seconds added to each send.
+      error_rate: Share of sends answered with a retryable 503.
+      lost_rate: Share of sends delivered but whose answer is lost (raised as a timeout).
+      seed: Seed of the error draws, so runs are reproducible.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, lost_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.lost_rate = lost_rate
+        self.random = random.Random(seed)
+        self.sent = 0
+        self.failed = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def install(self):
+        """Route send_email.sendMessage and send_email.getClient() to this fake."""
+        send_email._client = self
+        send_email.sendMessage = lambda user_id, message, client=None: self.send(user_id, message)
+        return self
+
+    def _draw(self):
+        with self._lock:
+            return self.random.random(), self.random.random() * self.jitter
+
+    def send(self, user_id, message):
+        start = time.perf_counter()
+        draw, jitter = self._draw()
+        if isinstance(message, send_email.MessageFile):
+            size = message.size
+        else:
+            size = len(message.get('raw', ''))
+        time.sleep(self.latency + jitter)
+        metrics.metrics.observe('gmail.send', time.perf_counter() - start)
+
+        if draw < self.error_rate:
+            with self._lock:
+                self.failed += 1
+            metrics.incr('emails_failed')
+            return ('failed', FakeHttpError(503))
+
+        with self._lock:
+            self.sent += 1
+            self.bytes += size
+        metrics.incr('emails_sent')
+        if draw < self.error_rate + self.lost_rate:
+            return ('failed', "Email notification failed, timed out")
+        return ('success', {'id': f"fake{self.sent}"})
+
+    def timing_report(self):
+        return f"{self.sent} message(s) sent, {self.failed} failed (fake Gmail)"
+
+    def stats(self):
+        with self._lock:
+            return {'sent': self.sent, 'failed': self.failed, 'bytes': self.bytes}
+
+
+def stub_powershell(startup_delay=0.5, reset_delay=0.02):
+    """
+    Make subprocess.Popen run the stub reset script whenever it is asked for powershell.exe, keeping
+    the script's arguments (-username, -serve) and simulating the ActiveDirectory module import.
+    """
+    popen = subprocess.Popen
+
+    class StubPopen(popen):
+        def __init__(self, args, *more, **kwargs):
+            if isinstance(args, (list, tuple)) and args and os.path.basename(str(args[0])).lower().startswith('powershell'):
+                script_args = list(args[list(args).index('-File') + 2:]) if '-File' in args else []
+                args = [sys.executable, STUB] + script_args + ['--startup-delay', str(startup_delay),
+                                                               '--reset-delay', str(reset_delay)]
+            super().__init__(args, *more, **kwargs)
+
+    subprocess.Popen = StubPopen
@@ -0,0 +1,124 @@
+#
+#   Description: Synthetic StudentCreated.csv rosters following the csvFileHeaders schema, spread
+#                over the buildings configured in the INI file the way a real district export is:
+#                the high school largest, elementaries smallest, grades and graduation year prefixes
+#                matching the building, and a few rows naming a building that is not configured.
+#
+#   Usage: python benchmarks/roster.py --rows 10000 StudentCreated.csv [--config config/update-students.ini]
+#
+#   The same rows and seed always give the same file.
+#
+
+import os, sys, csv, random, argparse
+from configparser import ConfigParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib import buildings
+
+CONFIG_FILE = os.path.join(ROOT, 'config', 'update-students.ini')
+
+HEADERS = ['Student ID', 'First Name', 'Middle Name', 'Last Name', 'Email', 'School Name',
+           'Current Grade', 'Status', 'UserName', 'Password']
+
+# Relative enrollment and grades by kind of building
+KINDS = [('high school', 4.0, list(range(9, 13))),
+         ('middle school', 2.5, list(range(6, 9))),
+         ('elementary', 1.5, list(range(0, 6))),
+         ('early learning', 0.5, [-1]),
+         ('', 0.05, [None])]
+
+# Last grade of the current school year's graduating class, e.g. 26 for 2025-2026
+GRADUATION_YEAR = 26
+
+FIRST_NAMES = ['LIAM', 'OLIVIA', 'NOAH', 'EMMA', 'OLIVER', 'AVA', 'ELIJAH', 'SOPHIA', 'LUCAS', 'MIA', 'MASON', 'AMELIA',
+               'LOGAN', 'HARPER', 'ETHAN', 'EVELYN', 'AIDEN', 'ABIGAIL', 'JACKSON', 'EMILY', 'LUI', 'LYDIA', 'KATHERINE',
+               'ASHLEY', "D'ANDRE", 'MARY-KATE', 'JOSÉ', 'ZOË']
+LAST_NAMES = ['SMITH', 'JOHNSON', 'WILLIAMS', 'BROWN', 'JONES', 'GARCIA', 'MILLER', 'DAVIS', 'RODRIGUEZ', 'MARTINEZ',
+              'HERNANDEZ', 'LOPEZ', 'GONZALES', 'WILSON', 'ANDERSON', 'THOMAS', 'TAYLOR', 'MOORE', 'CROOKS', 'KIRK',
+              "O'BRIEN", 'VAN DYKE', 'NGUYEN', 'SCHMIDT-WEBER']
+
+UNCONFIGURED_BUILDINGS = ['Oak Hills Online Academy', 'Diamond Oaks Career Campus']
+
+
+def configured_buildings(config_file=CONFIG_FILE):
+    """Return (building names, csv headers) from an update-students INI file."""
+    config = ConfigParser()
+    config.optionxform = str
+    config.read(config_file)
+    headers = config.get('general', 'csvFileHeaders', fallback=','.join(HEADERS)).split(',')
+    directory = buildings.BuildingDirectory.from_config(config)
+    return [building.name for building in directory.buildings], headers
+
+
+def building_profile(name):
+    lowered = name.lower()
+    for kind, weight, grades in KINDS:
+        if kind in lowered:
+            return weight, grades
+    return KINDS[-1][1], KINDS[-1][2]
+
+
+def iter_students(rows, building_names, seed=None, unconfigured=0.001):
+    """Yield rows (dicts keyed by HEADERS) for rows synthetic students."""
+    rng = random.Random(rows if seed is None else seed)
+    profiles = [building_profile(name) for name in building_names]
+    weights = [weight for weight, _ in profiles]
+    student_ids = rng.sample(range(100000, 1000000), rows) if rows <= 900000 else range(100000, 100000 + rows)
+
+    for i, student_id in enumerate(student_ids):
+        if rng.random() < unconfigured:
+            building, grades = rng.choice(UNCONFIGURED_BUILDINGS), list(range(9, 13))
+        else:
+            index = rng.choices(range(len(building_names)), weights)[0]
+            building, grades = building_names[index], profiles[index][1]
+        grade = rng.choice(grades)
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        year = GRADUATION_YEAR + 12 - (grade if grade is not None else 12)
+        # Usernames are unique in AD, the row number keeps them unique here too
+        username = f"{year}{''.join(c for c in (first + last).lower() if c.isascii() and c.isalnum())}{i}"
+        yield {'Student ID': str(student_id), 'First Name': first,
+               'Middle Name': rng.choice(FIRST_NAMES)[0] if rng.random() < 0.4 else ' ',
+               'Last Name': last, 'Email': f"{username}@ohlsd.org", 'School Name': building,
+               'Current Grade': '' if grade is None else ('PK' if grade < 0 else str(grade)),
+               'Status': 'A' if rng.random() < 0.95 else 'J', 'UserName': username,
+               'Password': f"password{rng.randint(1000, 9999)}"}
+
+
+def write_roster(path, rows, config_file=CONFIG_FILE, seed=None):
+    """Write a StudentCreated.csv with rows students, quoted like the real export."""
+    building_names, headers = configured_buildings(config_file)
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=headers, quoting=csv.QUOTE_ALL, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(iter_students(rows, building_names, seed))
+    return path
+
+
+def write_reset_file(path, rows, config_file=CONFIG_FILE, seed=None):
+    """Write a bulk password reset file (username, building) for rows students."""
+    building_names, _ = configured_buildings(config_file)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['username', 'building'])
+        for student in iter_students(rows, building_names, seed, unconfigured=0):
+            writer.writerow([student['UserName'], student['School Name']])
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic StudentCreated.csv')
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--config', default=CONFIG_FILE)
+    args = parser.parse_args()
+    write_roster(args.path, args.rows, args.config, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#
+#   Description: Stand-in for lib\reset_password.ps1 that needs neither PowerShell nor Active Directory.
+#                It speaks the same protocols: the one-shot "-username" output and the "-serve"
+#                line-delimited JSON protocol. --startup-delay simulates the ActiveDirectory module import.
+#
+
+import sys, json, time, random, argparse
+
+
+def reset(username):
+    if username.startswith('missing'):
+        return ("Failed", f"User {username} not found in Active Directory.")
+    # AD display names are often "Last, First"
+    return ("success", f"Student, {username.title()}", f"Word{random.randint(100, 999)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prefix_chars='-')
+    parser.add_argument('-username')
+    parser.add_argument('-serve', action='store_true')
+    parser.add_argument('--startup-delay', type=float, default=0.5)
+    parser.add_argument('--reset-delay', type=float, default=0.0)
+    args, _ = parser.parse_known_args()
+
+    time.sleep(args.startup_delay)
+
+    if not args.serve:
+        result = reset(args.username or '')
+        time.sleep(args.reset_delay)
+        sys.stdout.write(''.join(f"{value}\r\n" for value in result))
+        return
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        time.sleep(args.reset_delay)
+        status, *update = reset(request['username'])
+        response = {'id': request['id'], 'status': status}
+        if status == 'success':
+            response['displayName'], response['password'] = update
+            if request.get('password'):
+                response['password'] = request['password']
+        else:
+            response['error'] = update[0]
+        sys.stdout.write(json.dumps(response) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#
+#   Description: End to end benchmark suite of update-students.py. Every scenario runs the real
+#                script in a fresh process against a temporary workspace holding a synthetic roster,
+#                with Gmail replaced by fakes.FakeGmail and PowerShell/AD by stub_reset_password.py.
+#                The time and peak memory (RSS) of each stage is recorded from lib/metrics spans and
+#                saved to benchmarks/results so runs of different commits can be compared.
+#
+#   Usage: python benchmarks/suite.py [--sizes 100 10000 100000 1000000] [--scenarios export delta ...]
+#                                     [--latency 0.05] [--error-rate 0] [--repeat 1]
+#                                     [--compare latest|FILE] [--threshold 0.2]
+#
+#   The exit code is 1 when --compare finds a stage that got slower or bigger than the threshold.
+#   Per stage peak RSS is sampled from /proc/self/statm (Linux) or psutil when it is installed.
+#
+
+import os, sys, json, time, glob, shutil, argparse, datetime, platform, subprocess, tempfile, threading
+from configparser import ConfigParser
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, BENCH)
+
+import roster
+
+SCRIPT = os.path.join(ROOT, 'update-students.py')
+RESULTS = os.path.join(BENCH, 'results')
+
+# name: (export days, update-students arguments); bulk-reset builds its own reset file
+SCENARIOS = {
+    'noop': (0, ['--force']),
+    'export': (1, ['--force']),
+    'export-batch': (1, ['--force', '--batch']),
+    'delta': (1, ['--delta']),
+    'catch-up': (3, ['--force', '--merge_days']),
+    'bulk-reset': (0, []),
+}
+
+
+class MemorySampler(threading.Thread):
+    """Samples the process RSS and charges it to the lib/metrics spans active at that moment."""
+
+    def __init__(self, interval=0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self.stages = {}
+        self._done = threading.Event()
+        self._read = self._reader()
+
+    @staticmethod
+    def _reader():
+        if os.path.exists('/proc/self/statm'):
+            page = os.sysconf('SC_PAGE_SIZE')
+
+            def read():
+                with open('/proc/self/statm') as f:
+                    return int(f.read().split()[1]) * page
+            return read
+        try:
+            import psutil
+            process = psutil.Process()
+            return lambda: process.memory_info().rss
+        except ImportError:
+            return None
+
+    def run(self):
+        from lib import metrics
+        while self._read is not None and not self._done.is_set():
+            rss = self._read()
+            self.peak = max(self.peak, rss)
+            for name in metrics.metrics.active_spans():
+                self.stages[name] = max(self.stages.get(name, 0), rss)
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # ru_maxrss is KB on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def run_child(options):
+    """Run update-students.py in this process with the fakes installed and write the measurements."""
+    import runpy
+    sys.path.insert(0, ROOT)
+    import fakes
+    from lib import metrics
+
+    os.chdir(options.workspace)
+    gmail = fakes.FakeGmail(latency=options.latency, jitter=options.jitter, error_rate=options.error_rate).install()
+    fakes.stub_powershell(options.stub_startup, options.stub_reset)
+
+    sampler = MemorySampler()
+    sampler.start()
+    sys.argv = [SCRIPT] + options.script_args
+    exit_code = 0
+    start = time.perf_counter()
+    try:
+        runpy.run_path(SCRIPT, run_name='__main__')
+    except SystemExit as e:
+        exit_code = e.code or 0
+    wall = time.perf_counter() - start
+    sampler.stop()
+
+    snapshot = metrics.metrics.snapshot()
+    stages = {name: {'count': span['count'], 'seconds': round(span['seconds'], 6),
+                     'peak_rss_mb': round(sampler.stages[name] / 2 ** 20, 1) if name in sampler.stages else None}
+              for name, span in snapshot['spans'].items()}
+    result = {'exit_code': exit_code, 'wall_seconds': round(wall, 6),
+              'peak_rss_mb': round(max(sampler.peak, peak_rss()) / 2 ** 20, 1),
+              'stages': stages, 'counters': snapshot['counters'], 'gmail': gmail.stats()}
+    with open(options.child_result, 'w') as f:
+        json.dump(result, f)
+
+
+def write_config(workspace):
+    """Copy the real INI into the workspace with every file and folder pointing inside it."""
+    config = ConfigParser(interpolation=None)
+    config.optionxform = str
+    config.read(os.path.join(ROOT, 'config', 'update-students.ini'))
+    for section, key, value in [('general', 'dataFolder', 'data'), ('general', 'ledgerFile', 'logs/ledger.db'),
+                                ('general', 'studentIndexFile', 'logs/students.db'),
+                                ('general', 'buildingCacheFile', 'logs/buildings.cache'),
+                                ('logs', 'LogFile', 'logs/update-students.log'), ('logs', 'metricsFile', 'logs/metrics.json'),
+                                ('logs', 'prometheusFile', ''), ('email', 'outboxFile', 'logs/outbox.db'),
+                                ('email', 'outboxFolder', 'logs/outbox'), ('watch', 'heartbeatFile', '')]:
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, key, os.path.join(workspace, value) if value else '')
+    os.makedirs(os.path.join(workspace, 'config'))
+    os.makedirs(os.path.join(workspace, 'logs'))
+    with open(os.path.join(workspace, 'config', 'update-students.ini'), 'w') as f:
+        config.write(f)
+
+
+def workspace(scenario, rows, rosters, max_resets):
+    work = tempfile.mkdtemp(prefix=f"bench-{scenario}-{rows}-")
+    write_config(work)
+    shutil.copytree(os.path.join(ROOT, 'templates'), os.path.join(work, 'templates'),
+                    ignore=shutil.ignore_patterns('.cache'))
+    days, args = SCENARIOS[scenario]
+    today = datetime.date.today()
+    dates = [(today - datetime.timedelta(days=offset)).strftime("%m-%d-%Y") for offset in reversed(range(days))]
+    for date in dates:
+        source = rosters.get((rows, len(dates)))
+        if source is None:
+            source = rosters[(rows, len(dates))] = roster.write_roster(
+                os.path.join(rosters['folder'], f"roster_{rows}_{len(dates)}.csv"), max(1, rows // len(dates)))
+        os.makedirs(os.path.join(work, 'data', date))
+        shutil.copyfile(source, os.path.join(work, 'data', date, 'StudentCreated.csv'))
+    os.makedirs(os.path.join(work, 'data'), exist_ok=True)
+
+    if scenario == 'catch-up':
+        args = args + ['--from', dates[0], '--to', dates[-1]]
+    elif scenario == 'bulk-reset':
+        args = ['--bulk_reset', roster.write_reset_file(os.path.join(work, 'resets.csv'), min(rows, max_resets))]
+    return work, args
+
+
+def measure(scenario, rows, options, rosters):
+    runs = []
+    for _ in range(options.repeat):
+        work, args = workspace(scenario, rows, rosters, options.max_resets)
+        result_file = os.path.join(work, 'result.json')
+        command = [sys.executable, os.path.abspath(__file__), '--child', work, '--child-result', result_file,
+                   '--latency', str(options.latency), '--jitter', str(options.jitter),
+                   '--error-rate', str(options.error_rate), '--stub-startup', str(options.stub_startup),
+                   '--stub-reset', str(options.stub_reset), '--'] + args
+        with open(os.path.join(work, 'output.log'), 'w') as log:
+            subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, cwd=work)
+        with open(result_file) as f:
+            runs.append(json.load(f))
+        if not options.keep:
+            shutil.rmtree(work, ignore_errors=True)
+    # Keep the run with the median wall time
+    runs.sort(key=lambda run: run['wall_seconds'])
+    result = runs[len(runs) // 2]
+    result.update(scenario=scenario, rows=rows if scenario != 'bulk-reset' else min(rows, options.max_resets))
+    return result
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit or 'unknown', dirty
+    except OSError:
+        return 'unknown', False
+
+
+def compare(previous, current, threshold, min_seconds=0.05, min_mb=5.0):
+    """Return (lines, regressions) comparing two result files, scenario by scenario."""
+    old = {(result['scenario'], result['rows']): result for result in previous['results']}
+    lines, regressions = [], []
+    for result in current['results']:
+        before = old.get((result['scenario'], result['rows']))
+        if before is None:
+            continue
+        metrics = [('wall', before['wall_seconds'], result['wall_seconds'], min_seconds, 's'),
+                   ('peak', before['peak_rss_mb'], result['peak_rss_mb'], min_mb, 'MB')]
+        for name, stage in result['stages'].items():
+            if name in before['stages']:
+                metrics.append((name, before['stages'][name]['seconds'], stage['seconds'], min_seconds, 's'))
+        for name, was, now, minimum, unit in metrics:
+            change = (now - was) / was if was else 0.0
+            flag = ''
+            if change > threshold and now - was > minimum:
+                flag = '  REGRESSION'
+                regressions.append(f"{result['scenario']}/{result['rows']} {name}")
+            lines.append(f"{result['scenario']:>12} {result['rows']:>8} {name:>18} {was:>10.3f}{unit:<2} -> "
+                         f"{now:>10.3f}{unit:<2} {change:>+8.1%}{flag}")
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End to end benchmarks of update-students.py')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10000, 100000])
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds each fake Gmail send takes')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random seconds per fake send')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of fake sends answered with a 503')
+    parser.add_argument('--stub-startup', type=float, default=0.5, help='Simulated Import-Module ActiveDirectory cost')
+    parser.add_argument('--stub-reset', type=float, default=0.02, help='Simulated cost of one AD password reset')
+    parser.add_argument('--max-resets', type=int, default=500, help='Students reset by bulk-reset at most')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per scenario, the median is kept')
+    parser.add_argument('--compare', metavar='latest|FILE', help='Result file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Slowdown (0.2 = 20%%) reported as a regression')
+    parser.add_argument('--keep', action='store_true', help='Keep the workspaces for inspection')
+    parser.add_argument('--output', help='Result file, defaults to benchmarks/results/<time>-<commit>.json')
+    parser.add_argument('--child', dest='workspace', help=argparse.SUPPRESS)
+    parser.add_argument('--child-result', help=argparse.SUPPRESS)
+    parser.add_argument('script_args', nargs='*', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.workspace:
+        run_child(options)
+        return
+
+    previous_files = sorted(glob.glob(os.path.join(RESULTS, '*.json')))
+    commit, dirty = git_revision()
+    report = {'commit': commit, 'dirty': dirty, 'created': datetime.datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'options': {key: value for key, value in vars(options).items()
+                          if key not in ('workspace', 'child_result', 'script_args', 'compare', 'output', 'keep')},
+              'results': []}
+
+    print(f"{'scenario':>12} {'rows':>8} {'wall s':>9} {'peak MB':>8}  slowest stages")
+    with tempfile.TemporaryDirectory(prefix='bench-rosters-') as folder:
+        rosters = {'folder': folder}
+        for rows in options.sizes:
+            for scenario in options.scenarios:
+                result = measure(scenario, rows, options, rosters)
+                report['results'].append(result)
+                slowest = sorted(result['stages'].items(), key=lambda item: -item[1]['seconds'])[:3]
+                stages = ', '.join(f"{name} {stage['seconds']:.2f}s" + (f"/{stage['peak_rss_mb']:.0f}MB" if stage['peak_rss_mb'] else '')
+                                   for name, stage in slowest)
+                failed = '' if result['exit_code'] == 0 else f"  (exit code {result['exit_code']})"
+                print(f"{scenario:>12} {result['rows']:>8} {result['wall_seconds']:>9.2f} {result['peak_rss_mb']:>8.1f}  "
+                      f"{stages}{failed}", flush=True)
+
+    os.makedirs(RESULTS, exist_ok=True)
+    output = options.output or os.path.join(
+        RESULTS, f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}{'-dirty' if dirty else ''}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if options.compare:
+        baseline = previous_files[-1] if options.compare == 'latest' and previous_files else options.compare
+        if baseline == 'latest':
+            print("No earlier results to compare with")
+            return
+        with open(baseline) as f:
+            lines, regressions = compare(json.load(f), report, options.threshold)
+        print(f"\nCompared with {baseline}:")
+        print("\n".join(lines))
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#
+#   Description: Building directory built once at startup from the configuration file, resolving
+#                short codes and (loosely written) building names to validated recipient lists
+#
+
+import os, re, pickle, logging
+from configparser import ConfigParser
+from email.utils import getaddresses, formataddr
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the cached layout changes so old caches are rebuilt
+CACHE_VERSION = 1
+
+_ADDRESS = re.compile(r'^[^@\s<>,;]+@[^@\s<>,;]+\.[A-Za-z]{2,}$')
+
+
+def normalize_name(name: str) -> str:
+    """Normalize a building name for lookups: case, punctuation and whitespace are ignored."""
+    return " ".join(re.sub(r'[^a-z0-9]+', ' ', (name or '').lower()).split())
+
+
+def parse_recipients(value: str):
+    """
+    Split a comma separated recipient list, e.g. "Jane Doe <doe_j@ohlsd.org>, smith_a@ohlsd.org".
+    Returns (recipients, errors) where recipients are formatted addresses and errors the entries
+    that are not valid email addresses.
+    """
+    recipients, errors = [], []
+    for entry in [entry.strip() for entry in (value or '').split(',')]:
+        if not entry:
+            continue
+        parsed = getaddresses([entry])
+        name, address = parsed[0] if len(parsed) == 1 else ('', '')
+        if not _ADDRESS.match(address) or entry.count('<') != entry.count('>'):
+            errors.append(entry)
+            continue
+        recipients.append(formataddr((name, address)))
+    return recipients, errors
+
+
+def address_of(recipient: str) -> str:
+    """Return the bare, lowercased address of a recipient such as "Jane Doe <Doe_J@ohlsd.org>"."""
+    return getaddresses([recipient])[0][1].lower()
+
+
+class Building(object):
+    """One building: its full name, optional short code and parsed recipients."""
+
+    __slots__ = ('name', 'short_code', 'recipients', 'errors')
+
+    def __init__(self, name, short_code=None, recipients=None, errors=None):
+        self.name = name
+        self.short_code = short_code
+        self.recipients = recipients or []
+        self.errors = errors or []
+
+    @property
+    def recipient(self):
+        """Recipients joined with a comma, as used in the To header."""
+        return ','.join(self.recipients)
+
+    def __repr__(self):
+        return f"Building({self.name!r}, {self.short_code!r}, {len(self.recipients)} recipient(s))"
+
+
+class BuildingDirectory(object):
+    """All configured buildings with an O(1) index on short code, full name and normalized name.
+
+    Buildings come from the [BuildingSecretariesEmails] section (name = recipients) and
+    short codes from [BuildingShortNames] (code = name). Malformed recipients are reported
+    when the directory is built rather than when an email is sent.
+    """
+
+    def __init__(self, buildings):
+        self.buildings = list(buildings)
+        self.index = {}
+        for building in self.buildings:
+            keys = [building.name.lower(), normalize_name(building.name)]
+            if building.short_code:
+                keys.append(building.short_code.lower())
+            for key in keys:
+                self.index.setdefault(key, building)
+
+    @classmethod
+    def from_config(cls, config: ConfigParser):
+        """Build the directory from a ConfigParser that keeps key case (optionxform = str)."""
+        short_codes = {}
+        if config.has_section('BuildingShortNames'):
+            short_codes = {normalize_name(name): (code.upper(), name)
+                           for code, name in config.items('BuildingShortNames', raw=True)}
+
+        buildings = []
+        if config.has_section('BuildingSecretariesEmails'):
+            for name, value in config.items('BuildingSecretariesEmails', raw=True):
+                recipients, errors = parse_recipients(value)
+                code = short_codes.pop(normalize_name(name), (None, None))[0]
+                buildings.append(Building(name, code, recipients, errors))
+
+        # Buildings with a short code but no secretaries configured
+        for code, name in short_codes.values():
+            buildings.append(Building(name, code))
+        return cls(buildings)
+
+    @classmethod
+    def load(cls, ini_file: str, cache_file: str = None):
+        """
+        Build the directory from ini_file, reusing cache_file when it was built from the same
+        version of the INI file (same modification time and size).
+        """
+        stat = os.stat(ini_file)
+        stamp = (CACHE_VERSION, os.path.abspath(ini_file), stat.st_mtime_ns, stat.st_size)
+
+        if cache_file and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'rb') as f:
+                    cached_stamp, buildings = pickle.load(f)
+                if cached_stamp == stamp:
+                    return cls(buildings)
+            except Exception as e:
+                logger.debug(f"Ignoring unreadable building cache {cache_file}: {e}")
+
+        config = ConfigParser()
+        # Keep building names as written, ConfigParser lowercases keys by default
+        config.optionxform = str
+        config.read(ini_file)
+        directory = cls.from_config(config)
+
+        if cache_file:
+            try:
+                with open(cache_file, 'wb') as f:
+                    pickle.dump((stamp, directory.buildings), f)
+            except OSError as e:
+                logger.debug(f"Could not write building cache {cache_file}: {e}")
+        return directory
+
+    def get(self, key: str):
+        """Return the Building for a short code, full name or loosely written name, or None."""
+        if not key:
+            return None
+        key = key.strip().lower()
+        return self.index.get(key) or self.index.get(normalize_name(key))
+
+    def recipients(self, key: str, fallback: str = None) -> str:
+        """Return the comma separated recipients of a building, or fallback if it has none."""
+        building = self.get(key)
+        if building is None or not building.recipients:
+            return fallback
+        return building.recipient
+
+    @property
+    def short_codes(self):
+        return sorted(building.short_code for building in self.buildings if building.short_code)
+
+    def validate(self):
+        """Return a list of problems found in the configuration, e.g. malformed addresses."""
+        problems = []
+        for building in self.buildings:
+            for entry in building.errors:
+                problems.append(f"{building.name}: invalid recipient '{entry}'")
+        return problems
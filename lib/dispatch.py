@@ -0,0 +1,112 @@
+#
+#   Description: Concurrent dispatch of prepared Gmail messages with rate limiting and retries
+#
+
+import time, threading, random
+from concurrent.futures import ThreadPoolExecutor
+
+from lib import send_email
+
+
+# HTTP status codes worth retrying: rate limited or a server side error
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter shared by all sending threads.
+
+    Args:
+      rate: Tokens added per second. A rate of 0 or less disables limiting.
+      capacity: Maximum burst size, defaults to the rate (one second worth of tokens).
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_retryable(result):
+    """Return True if a failed send result is worth retrying."""
+    status, error = result
+    if status == 'success':
+        return False
+    resp = getattr(error, 'resp', None)
+    return resp is not None and getattr(resp, 'status', None) in RETRY_STATUSES
+
+
+def send_with_retry(message, user_id='me', client=None, limiter=None, retries=3, backoff=1.0, sleep=time.sleep):
+    """Send one message, retrying with exponential backoff on 429 and 5xx responses.
+
+    Returns:
+      (status, response or error, attempts)
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        if limiter is not None:
+            limiter.acquire()
+        result = send_email.sendMessage(user_id, message, client=client)
+        if attempt > retries or not is_retryable(result):
+            return result + (attempt,)
+        # Exponential backoff with jitter so workers don't retry in lockstep
+        sleep(backoff * (2 ** (attempt - 1)) * (1 + random.random() / 2))
+
+
+def send_batch(messages, user_id='me', client=None, workers=4, rate=5.0, retries=3, backoff=1.0):
+    """Send prepared messages concurrently.
+
+    Args:
+      messages: Mapping of key (e.g. building name) to a message created by
+        send_email.CreateMessageWithAttachment.
+      workers: Size of the thread pool.
+      rate: Maximum sends per second across all workers.
+      retries: Retries per message for 429 and 5xx responses.
+      backoff: Initial backoff in seconds, doubled on every retry.
+
+    Returns:
+      Dict of key to (status, response or error, attempts) in the order of messages.
+    """
+    client = client or send_email.getClient()
+    limiter = TokenBucket(rate)
+    results = {}
+    if not messages:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(messages)))) as pool:
+        futures = {key: pool.submit(send_with_retry, message, user_id, client, limiter, retries, backoff)
+                   for key, message in messages.items()}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                results[key] = ('failed', f"Email notification failed, {str(e)}", 1)
+    return results
+
+
+def summarize(results):
+    """Return summary lines, one per message, for a send_batch result."""
+    lines = []
+    for key, (status, detail, attempts) in results.items():
+        if status == 'success':
+            lines.append(f"{key}: sent ({attempts} attempt(s))")
+        else:
+            lines.append(f"{key}: FAILED after {attempts} attempt(s) - {detail}")
+    return lines
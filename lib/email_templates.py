@@ -0,0 +1,52 @@
+#
+#   Description: Email templates compiled once at startup, with a bytecode cache on disk
+#
+
+import os, time, logging
+
+from lib import lazy_import
+
+# Only imported once the first template is loaded, so runs that never send an email don't load Jinja2
+jinja2 = lazy_import.module('jinja2')
+
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateCache(object):
+    """Loads and compiles every template in a folder once and renders them on demand.
+
+    Compiled templates are also written to a Jinja2 bytecode cache so later runs skip
+    parsing and compiling the HTML.
+
+    Args:
+      folder: Folder holding the templates.
+      cache_folder: Folder for the bytecode cache, defaults to <folder>/.cache
+    """
+
+    def __init__(self, folder='templates', cache_folder=None):
+        cache_folder = cache_folder or os.path.join(folder, '.cache')
+        os.makedirs(cache_folder, exist_ok=True)
+        self.env = jinja2.Environment(loader=jinja2.FileSystemLoader(folder),
+                                      bytecode_cache=jinja2.FileSystemBytecodeCache(cache_folder))
+        self.templates = {}
+
+        start = time.perf_counter()
+        for name in self.env.list_templates(filter_func=lambda name: name.endswith('.html')):
+            self.templates[name] = self.env.get_template(name)
+        self.load_seconds = time.perf_counter() - start
+        logger.debug(f"Loaded {len(self.templates)} email template(s) in {self.load_seconds * 1000:.1f}ms")
+
+    def get(self, name):
+        template = self.templates.get(name)
+        if template is None:
+            # A template added after startup
+            template = self.templates[name] = self.env.get_template(name)
+        return template
+
+    def render(self, name, data=None):
+        """Render a template with data."""
+        start = time.perf_counter()
+        rendered = self.get(name).render(data or {})
+        logger.debug(f"Rendered {name} in {(time.perf_counter() - start) * 1000:.2f}ms")
+        return rendered
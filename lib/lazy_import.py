@@ -0,0 +1,58 @@
+#
+#   Description: Deferred imports, so runs that never send an email don't pay for loading
+#                the Google client libraries, Jinja2 or the MIME classes
+#
+
+import importlib, sys, threading, time
+
+
+# Seconds spent importing each deferred module, in the order they were loaded
+import_times = {}
+_lock = threading.RLock()
+
+
+class LazyModule(object):
+    """Stands in for a module and imports it the first time one of its attributes is used."""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            with _lock:
+                module = self.__dict__['_module']
+                if module is None:
+                    name = self.__dict__['_name']
+                    start = time.perf_counter()
+                    module = importlib.import_module(name)
+                    import_times.setdefault(name, time.perf_counter() - start)
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self._load(), attribute, value)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<lazy module '{self.__dict__['_name']}' ({state})>"
+
+
+def module(name):
+    """Return the module if it is already imported, otherwise a LazyModule for it."""
+    return sys.modules.get(name) or LazyModule(name)
+
+
+def is_loaded(name):
+    return name in sys.modules
+
+
+def report():
+    """Return an -X importtime style summary of the deferred imports that were actually loaded."""
+    if not import_times:
+        return "no deferred imports loaded"
+    return ", ".join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in import_times.items())
@@ -0,0 +1,87 @@
+#
+#   Description: On-disk run ledger (SQLite) recording which exports were processed and which
+#                building notifications were delivered, so reruns only redo what changed or failed
+#
+
+import hashlib, sqlite3, datetime, os, threading
+
+
+def file_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RunLedger(object):
+    """Records source file hashes and per building delivery status for each export date.
+
+    Args:
+      path: SQLite database file, created with its tables on first use.
+    """
+
+    def __init__(self, path: str):
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.path = path
+        # One connection shared by the worker threads of a run, writes are serialized by the lock
+        self._lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS source_files (
+                date TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                processed_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS notifications (
+                date TEXT NOT NULL,
+                building TEXT NOT NULL,
+                file_hash TEXT NOT NULL,
+                status TEXT NOT NULL,
+                detail TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (date, building)
+            );
+        ''')
+        self.db.commit()
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def source_unchanged(self, date: str, source_hash: str) -> bool:
+        """True if this date's export was already processed with the same content and every
+        building notification for it was delivered."""
+        with self._lock:
+            row = self.db.execute('SELECT hash FROM source_files WHERE date = ?', (date,)).fetchone()
+            if row is None or row[0] != source_hash:
+                return False
+            pending = self.db.execute("SELECT COUNT(*) FROM notifications WHERE date = ? AND status != 'sent'",
+                                      (date,)).fetchone()[0]
+        return pending == 0
+
+    def record_source(self, date: str, path: str, source_hash: str):
+        with self._lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO source_files (date, path, hash, processed_at) VALUES (?, ?, ?, ?)',
+                            (date, path, source_hash, self._now()))
+
+    def already_sent(self, date: str, building: str, building_hash: str) -> bool:
+        """True if this building's file, with identical content, was already delivered for this date."""
+        with self._lock:
+            row = self.db.execute('SELECT file_hash, status FROM notifications WHERE date = ? AND building = ?',
+                                  (date, building)).fetchone()
+        return row is not None and row[0] == building_hash and row[1] == 'sent'
+
+    def record_notification(self, date: str, building: str, building_hash: str, status: str, detail: str = None):
+        """Record the delivery status ('sent' or 'failed') of a building notification."""
+        with self._lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO notifications (date, building, file_hash, status, detail, updated_at) '
+                            'VALUES (?, ?, ?, ?, ?, ?)',
+                            (date, building, building_hash, status, None if detail is None else str(detail), self._now()))
+
+    def close(self):
+        self.db.close()
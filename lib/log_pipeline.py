@@ -0,0 +1,144 @@
+#
+#   Description: Logging pipeline of the script. Records are put on a queue by the thread that logs
+#                them and formatted and written by a background listener, so exporting, sending and
+#                resetting never wait on the log file or the console. The log file is rotated by
+#                size or time and rotated files are gzipped. The optional JSON lines format carries
+#                the run id and the date, building and stage each record was logged from.
+#
+
+import os, gzip, json, queue, shutil, atexit, logging, datetime, contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+from lib import metrics
+
+
+TEXT_FORMAT = "{asctime} - {levelname} - {message}"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Identifies the records of one run of the script in a shared log file
+RUN_ID = os.urandom(6).hex()
+
+_context = contextvars.ContextVar('log_context', default={})
+
+
+@contextmanager
+def context(**fields):
+    """Add fields (date, building, username ...) to the records logged inside the block by this thread."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Stamps each record with the run id, the context fields and the current metrics span (stage).
+
+    It runs in the thread that logs, before the record is queued, where the context is known.
+    """
+
+    def filter(self, record):
+        record.run_id = RUN_ID
+        record.context = _context.get()
+        record.stage = metrics.current_stage.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, run_id, stage, the context fields and message."""
+
+    def format(self, record):
+        entry = {'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                 'level': record.levelname, 'logger': record.name, 'run_id': getattr(record, 'run_id', RUN_ID)}
+        stage = getattr(record, 'stage', None)
+        if stage:
+            entry['stage'] = stage
+        entry.update(getattr(record, 'context', None) or {})
+        entry['message'] = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_traceback_formatter = logging.Formatter()
+
+
+class _QueueHandler(QueueHandler):
+    """Queues records with their message merged and the traceback kept apart (exc_text) for the formatters.
+
+    It is the root logger's only handler, so records are not copied before they are changed.
+    """
+
+    def prepare(self, record):
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _QueueListener(QueueListener):
+    """QueueListener whose stop can be called again, e.g. by a caller and then at exit."""
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+def _gzip_name(name):
+    return f"{name}.gz"
+
+
+def _gzip_rotate(source, dest):
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def file_handler(path, max_bytes=10 * 2 ** 20, when=None, backup_count=10, compress=True):
+    """
+    Return a handler writing to path, rotated every max_bytes or, when 'when' is set
+    (e.g. 'midnight', 'W0'), on that schedule. Rotated files are gzipped when compress is set.
+    """
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    if when:
+        handler = TimedRotatingFileHandler(path, when=when, backupCount=backup_count, encoding='utf-8', delay=True)
+    else:
+        handler = RotatingFileHandler(path, maxBytes=max_bytes or 0, backupCount=backup_count, encoding='utf-8', delay=True)
+    if compress:
+        handler.namer = _gzip_name
+        handler.rotator = _gzip_rotate
+    return handler
+
+
+def setup(level, handlers):
+    """
+    Make the root logger hand every record to a queue drained by a QueueListener thread writing to
+    handlers. Logging never blocks the caller: the queue is unbounded, the caller only merges the
+    message and the listener does the formatting and all the I/O. The listener is stopped, and the queue flushed, at exit.
+    Returns the QueueListener.
+    """
+    # None of the formats show the source file, line or process: skip looking them up for every record
+    logging._srcfile = None
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = _QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,108 @@
+#
+#   Description: Lightweight per-stage timers and counters for a run, written out as JSON and
+#                as a Prometheus textfile-collector file
+#
+
+import os, re, json, time, threading, datetime, contextvars
+from contextlib import contextmanager
+
+
+# Innermost span of the running thread, e.g. for the stage field of the logs
+current_stage = contextvars.ContextVar('stage', default=None)
+
+
+class Metrics(object):
+    """Collects stage timings (spans) and counters. Safe to use from several threads."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.spans = {}
+        self.counters = {}
+        # Number of threads currently inside each span, e.g. for a memory sampler
+        self.active = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        """Time a stage: with metrics.span('export.partition'): ..."""
+        with self._lock:
+            self.active[name] = self.active.get(name, 0) + 1
+        token = current_stage.set(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+            current_stage.reset(token)
+            with self._lock:
+                self.active[name] -= 1
+                if not self.active[name]:
+                    del self.active[name]
+
+    def active_spans(self):
+        with self._lock:
+            return list(self.active)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            span = self.spans.get(name)
+            if span is None:
+                span = self.spans[name] = {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+            span['count'] += 1
+            span['seconds'] += seconds
+            span['max_seconds'] = max(span['max_seconds'], seconds)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {'started': datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                    'duration_seconds': round(time.time() - self.started, 6),
+                    'spans': {name: dict(span) for name, span in sorted(self.spans.items())},
+                    'counters': dict(sorted(self.counters.items()))}
+
+    def write_json(self, path, **extra):
+        data = self.snapshot()
+        data.update(extra)
+        _write_atomic(path, json.dumps(data, indent=2) + '\n')
+
+    def write_prometheus(self, path, prefix='update_students', **labels):
+        """Write the metrics in the Prometheus text format for node_exporter's textfile collector."""
+        data = self.snapshot()
+        label_text = ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+        def line(metric, value, extra=None):
+            all_labels = ','.join(filter(None, [label_text, extra]))
+            return f"{prefix}_{metric}{{{all_labels}}} {value}" if all_labels else f"{prefix}_{metric} {value}"
+
+        lines = [f"# TYPE {prefix}_run_duration_seconds gauge",
+                 line('run_duration_seconds', data['duration_seconds']),
+                 f"# TYPE {prefix}_run_timestamp_seconds gauge",
+                 line('run_timestamp_seconds', int(self.started))]
+        lines.append(f"# TYPE {prefix}_stage_seconds gauge")
+        lines += [line('stage_seconds', span['seconds'], f'stage="{name}"') for name, span in data['spans'].items()]
+        lines.append(f"# TYPE {prefix}_stage_calls gauge")
+        lines += [line('stage_calls', span['count'], f'stage="{name}"') for name, span in data['spans'].items()]
+        for name, value in data['counters'].items():
+            metric = re.sub(r'[^a-zA-Z0-9_]', '_', name)
+            lines += [f"# TYPE {prefix}_{metric} gauge", line(metric, value)]
+        _write_atomic(path, '\n'.join(lines) + '\n')
+
+
+def _write_atomic(path, text):
+    # Write to a temporary file and rename it so readers never see a half written file
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+# Metrics of the current run, shared by the script and the lib modules
+metrics = Metrics()
+span = metrics.span
+incr = metrics.incr
@@ -0,0 +1,234 @@
+#
+#   Description: Durable on-disk outbox (SQLite + spooled .eml files). Exports queue fully built
+#                messages and a sender drains the queue with retries, so an outage or a crash
+#                never loses or duplicates an email
+#
+
+import os, json, time, uuid, base64, random, shutil, sqlite3, hashlib, datetime, logging, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from lib import send_email, dispatch
+
+
+logger = logging.getLogger(__name__)
+
+# pending:     waiting to be sent
+# sending:     claimed by a sender; found on open it means the process stopped mid-send
+# unconfirmed: the last send ended without a clear answer; resent with the same Message-ID, so a
+#              copy that did arrive is recognized as a duplicate by the recipients' mailboxes
+# sent:        delivered, its spooled file is removed
+# dead:        rejected or out of attempts; its spooled file is removed too and only the row
+#              (key, attempts, last error, meta) is kept for inspection
+PENDING, SENDING, UNCONFIRMED, SENT, DEAD = 'pending', 'sending', 'unconfirmed', 'sent', 'dead'
+
+
+class Outbox(object):
+    """Queue of messages waiting to be delivered, keyed by an idempotency key.
+
+    Every message is written to its own .eml file with a Message-ID header, and its
+    state is kept in SQLite. A key that was already sent is not queued again, so the
+    same building notification is only ever delivered once per key.
+
+    The .eml files hold the building files, passwords included, until the message is
+    sent or given up. The folder and the files are only readable by the account
+    running the script.
+
+    Args:
+      path: SQLite database file, created with its table on first use.
+      folder: Folder holding the queued messages, defaults to <path without extension>/
+    """
+
+    def __init__(self, path: str, folder: str = None):
+        self.path = path
+        self.folder = folder or os.path.splitext(path)[0]
+        os.makedirs(self.folder, mode=0o700, exist_ok=True)
+        os.chmod(self.folder, 0o700)
+        self._lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                key TEXT PRIMARY KEY,
+                message_id TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                meta TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                gmail_id TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt);
+        ''')
+        with self.db:
+            # Sends interrupted by a crash may or may not have reached Gmail
+            self.db.execute('UPDATE outbox SET status = ? WHERE status = ?', (UNCONFIRMED, SENDING))
+        # Files of messages given up by older versions, which kept them
+        for (path,) in self.db.execute('SELECT path FROM outbox WHERE status IN (?, ?)', (SENT, DEAD)).fetchall():
+            self._remove(path)
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def put(self, key: str, message, meta: dict = None, replace: bool = False):
+        """
+        Queue a message built by send_email (a MessageFile or a {'raw': ...} body).
+        Returns None once it is queued, or the status of the key (pending, unconfirmed,
+        sent, dead ...) if it is already in the outbox, unless replace is set.
+        """
+        with self._lock:
+            row = self.db.execute('SELECT status FROM outbox WHERE key = ?', (key,)).fetchone()
+        if row is not None and not replace:
+            logger.debug(f"{key} is already in the outbox ({row[0]}), not queued again")
+            return row[0]
+
+        message_id = f"<{uuid.uuid4().hex}@update-students>"
+        path = os.path.join(self.folder, f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.eml")
+        temp_path = f"{path}.tmp"
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+        with open(os.open(temp_path, flags, 0o600), 'wb') as f:
+            f.write(f"Message-ID: {message_id}\r\n".encode())
+            if isinstance(message, send_email.MessageFile):
+                message.file.seek(0)
+                shutil.copyfileobj(message.file, f)
+            else:
+                f.write(base64.urlsafe_b64decode(message['raw']))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+        with self._lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO outbox (key, message_id, path, size, meta, status, attempts, '
+                            'next_attempt, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, 0, 0, ?, ?)',
+                            (key, message_id, path, os.path.getsize(path), json.dumps(meta or {}), PENDING,
+                             self._now(), self._now()))
+        return None
+
+    def entry(self, key: str):
+        """Return the status, attempts and last error of a key, or None if it was never queued."""
+        with self._lock:
+            row = self.db.execute('SELECT status, attempts, last_error FROM outbox WHERE key = ?', (key,)).fetchone()
+        return None if row is None else {'status': row[0], 'attempts': row[1], 'last_error': row[2]}
+
+    def counts(self) -> dict:
+        """Number of messages in each state."""
+        with self._lock:
+            return dict(self.db.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+
+    def due(self, now: float = None) -> int:
+        """Number of messages waiting to be sent whose next attempt is due."""
+        with self._lock:
+            return self.db.execute('SELECT COUNT(*) FROM outbox WHERE status IN (?, ?) AND next_attempt <= ?',
+                                   (PENDING, UNCONFIRMED, time.time() if now is None else now)).fetchone()[0]
+
+    def _claim(self, now):
+        with self._lock, self.db:
+            rows = self.db.execute('SELECT key, message_id, path, meta, status, attempts FROM outbox '
+                                   'WHERE status IN (?, ?) AND next_attempt <= ? ORDER BY created_at',
+                                   (PENDING, UNCONFIRMED, now)).fetchall()
+            self.db.executemany('UPDATE outbox SET status = ?, attempts = attempts + 1, updated_at = ? WHERE key = ?',
+                                [(SENDING, self._now(), row[0]) for row in rows])
+        return [{'key': key, 'message_id': message_id, 'path': path, 'meta': json.loads(meta or '{}'),
+                 'status': status, 'attempts': attempts + 1}
+                for key, message_id, path, meta, status, attempts in rows]
+
+    def _update(self, key, status, error=None, next_attempt=0, gmail_id=None):
+        with self._lock, self.db:
+            self.db.execute('UPDATE outbox SET status = ?, last_error = ?, next_attempt = ?, gmail_id = ?, updated_at = ? '
+                            'WHERE key = ?', (status, None if error is None else str(error), next_attempt, gmail_id,
+                                              self._now(), key))
+
+    def drain(self, user_id='me', client=None, workers=1, rate=5.0, retries=3, backoff=1.0, max_attempts=8,
+              retry_delay=60.0, upload_threshold=send_email.UPLOAD_THRESHOLD, clock=time.time):
+        """Send every due message.
+
+        Rate limited (429) and server errors are first retried in place with
+        dispatch.send_with_retry (retries, backoff). A message that still fails is
+        rescheduled retry_delay * 2^(attempts - 1) seconds later, up to max_attempts
+        drains, and then marked dead. Rejected messages (other 4xx) are dead at once.
+        Sends that ended without an answer (timeouts, dropped connections, a crash) are
+        unconfirmed and count against max_attempts the same way.
+
+        Returns:
+          Dict of key to (status, response or error, attempts, meta) for every message
+          attempted, status being 'success' or 'failed'.
+        """
+        entries = self._claim(clock())
+        results = {}
+        if not entries:
+            return results
+
+        client = client or send_email.getClient()
+        limiter = dispatch.TokenBucket(rate)
+
+        def deliver(entry):
+            try:
+                return self._deliver(entry, user_id, client, limiter, retries, backoff, max_attempts,
+                                     retry_delay, upload_threshold, clock)
+            except Exception as e:
+                # Never leave a claimed message in the sending state
+                self._retry_later(entry, UNCONFIRMED, e, max_attempts, retry_delay, clock)
+                return ('failed', f"Email notification failed, {str(e)}")
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(entries)))) as pool:
+            for entry, result in zip(entries, pool.map(deliver, entries)):
+                results[entry['key']] = result + (entry['attempts'], entry['meta'])
+        return results
+
+    def _deliver(self, entry, user_id, client, limiter, retries, backoff, max_attempts, retry_delay, upload_threshold, clock):
+        key = entry['key']
+        if entry['status'] == UNCONFIRMED:
+            # Gmail cannot be asked whether the previous attempt arrived with the gmail.send scope;
+            # the message is sent again with its original Message-ID
+            logger.info(f"Resending {key}, its previous attempt ended without an answer")
+
+        message = send_email.MessageFile.load(entry['path'], upload_threshold)
+        try:
+            status, detail, attempts = dispatch.send_with_retry(message, user_id, client, limiter, retries, backoff)
+        finally:
+            message.close()
+
+        if status == 'success':
+            self._sent(entry, detail.get('id') if isinstance(detail, dict) else None)
+            return (status, detail)
+
+        resp = getattr(detail, 'resp', None)
+        if resp is not None and getattr(resp, 'status', None) not in dispatch.RETRY_STATUSES:
+            logger.error(f"{key} was rejected by Gmail, giving up: {detail}")
+            self._dead(entry, detail)
+        else:
+            # An HTTP error response means Gmail did not take the message; anything else may have reached it
+            self._retry_later(entry, PENDING if resp is not None else UNCONFIRMED, detail, max_attempts, retry_delay, clock)
+        return (status, detail)
+
+    def _retry_later(self, entry, status, error, max_attempts, retry_delay, clock):
+        """Reschedule a failed message with an exponential delay, or mark it dead after max_attempts."""
+        key = entry['key']
+        if entry['attempts'] >= max_attempts:
+            logger.error(f"{key} failed {entry['attempts']} times, giving up: {error}")
+            self._dead(entry, error)
+            return
+        delay = retry_delay * (2 ** (entry['attempts'] - 1)) * (1 + random.random() / 2)
+        self._update(key, status, error, clock() + delay)
+        logger.warning(f"{key} failed, retrying in {delay:.0f}s: {error}")
+
+    def _sent(self, entry, gmail_id=None):
+        self._update(entry['key'], SENT, gmail_id=gmail_id)
+        self._remove(entry['path'])
+
+    def _dead(self, entry, error):
+        self._update(entry['key'], DEAD, error)
+        self._remove(entry['path'])
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,108 @@
+#
+#   Description: Streaming partitioner that splits the StudentCreated.csv export into per building files
+#
+
+import csv, os, re
+from collections import OrderedDict
+
+
+def output_file_name(building_name: str) -> str:
+    """Return the export file name for a building, e.g. OakHillsHighSchool_students.csv"""
+    building_formatted_name = "".join(re.split('[^a-zA-Z0-9]+', building_name))
+    return f"{building_formatted_name}_students.csv"
+
+
+def read_rows(path: str):
+    """Lazily yield the rows of a CSV file as dicts."""
+    with open(path, 'r', encoding='utf-8', newline='') as csv_file:
+        for row in csv.DictReader(csv_file):
+            yield row
+
+
+class BuildingPartition(object):
+    """Export details of one building: output file, row count and any write error."""
+
+    __slots__ = ('building_name', 'file_name', 'path', 'count', 'error', 'failed_rows')
+
+    def __init__(self, building_name, file_name, path):
+        self.building_name = building_name
+        self.file_name = file_name
+        self.path = path
+        self.count = 0
+        self.error = None
+        # Rows that could not be written, kept only for buildings that failed
+        self.failed_rows = []
+
+
+class _WriterCache(object):
+    """Keeps at most max_open building files open, closing the least recently used one."""
+
+    def __init__(self, headers, max_open):
+        self.headers = headers
+        self.max_open = max(1, max_open)
+        self.open_files = OrderedDict()
+
+    def writer(self, partition):
+        entry = self.open_files.get(partition.building_name)
+        if entry is not None:
+            self.open_files.move_to_end(partition.building_name)
+            return entry[1]
+
+        if len(self.open_files) >= self.max_open:
+            _, (old_file, _) = self.open_files.popitem(last=False)
+            old_file.close()
+
+        # The header is only written the first time; a file evicted earlier is reopened for append
+        first_open = partition.count == 0
+        csv_file = open(partition.path, 'w' if first_open else 'a', newline='', encoding='utf-8')
+        writer = csv.DictWriter(csv_file, fieldnames=self.headers)
+        if first_open:
+            writer.writeheader()
+        self.open_files[partition.building_name] = (csv_file, writer)
+        return writer
+
+    def discard(self, building_name):
+        entry = self.open_files.pop(building_name, None)
+        if entry is not None:
+            entry[0].close()
+
+    def close(self):
+        while self.open_files:
+            _, (csv_file, _) = self.open_files.popitem(last=False)
+            csv_file.close()
+
+
+def partition_rows(rows, output_dir: str, headers: list, key: str = 'School Name', max_open: int = 32):
+    """
+    Route each row straight to its building's export file in a single pass.
+
+    Rows are consumed lazily and never collected, so memory stays flat however large
+    the export is. At most max_open files are open at once.
+
+    Returns:
+      OrderedDict of building name to BuildingPartition, in order of first appearance.
+    """
+    partitions = OrderedDict()
+    writers = _WriterCache(headers, max_open)
+    try:
+        for row in rows:
+            building_name = (row.get(key) or '').strip()
+            partition = partitions.get(building_name)
+            if partition is None:
+                file_name = output_file_name(building_name)
+                partition = BuildingPartition(building_name, file_name, os.path.join(output_dir, file_name))
+                partitions[building_name] = partition
+
+            if partition.error is not None:
+                partition.failed_rows.append(row)
+                continue
+            try:
+                writers.writer(partition).writerow(row)
+                partition.count += 1
+            except Exception as e:
+                partition.error = e
+                partition.failed_rows.append(row)
+                writers.discard(building_name)
+    finally:
+        writers.close()
+    return partitions
@@ -0,0 +1,185 @@
+#
+#   Description: Student password generation from a word list. The list is memory mapped and a
+#                line offset index is built once and cached next to it, so picking a word is O(1)
+#                and never reads the whole file. Randomness comes from the secrets module.
+#
+
+import os, re, mmap, array, secrets, string, logging, threading
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the index layout changes so old index files are rebuilt
+INDEX_VERSION = 1
+_INDEX_MAGIC = b'WLIX'
+_WORD = re.compile(rb'[^\r\n]+')
+
+# Characters of the random fallback password, as generatePassword in reset_password.ps1
+FALLBACK_CHARACTERS = string.ascii_letters + string.digits + '@#$-'
+
+
+class PasswordPolicy(object):
+    """Rules a generated password follows: <word><digits>, e.g. 'maple482'.
+
+    Args:
+      digits: Number of digits appended to the word (the first one is never 0).
+      min_word_length: Shortest word used.
+      max_word_length: Longest word used.
+      banned: Words (or parts of words) never used, compared case insensitively.
+      capitalize: Capitalize the word, for domains that require upper case letters.
+      fallback_length: Length of the random password used when there is no word list.
+    """
+
+    def __init__(self, digits=3, min_word_length=3, max_word_length=10, banned=(), capitalize=False, fallback_length=12):
+        self.digits = digits
+        self.min_word_length = min_word_length
+        self.max_word_length = max_word_length
+        self.banned = [word.lower() for word in banned if word]
+        self.capitalize = capitalize
+        self.fallback_length = fallback_length
+
+    def accepts(self, word: str) -> bool:
+        if not self.min_word_length <= len(word) <= self.max_word_length:
+            return False
+        if not word.isalpha():
+            return False
+        lowered = word.lower()
+        return not any(banned in lowered for banned in self.banned)
+
+
+class WordList(object):
+    """A word list file (one word per line, UTF-8) read through mmap and a line offset index.
+
+    The index holds the offset of every non-empty line. It is written to index_file
+    (<path>.idx by default) and reused while the word list keeps the same modification
+    time and size; an index that can't be written is just kept in memory.
+
+    Args:
+      path: The word list.
+      index_file: Where the index is cached, None for <path>.idx, False to never cache it.
+    """
+
+    def __init__(self, path: str, index_file=None):
+        self.path = path
+        self.index_file = f"{path}.idx" if index_file is None else index_file
+        self._file = open(path, 'rb')
+        stat = os.fstat(self._file.fileno())
+        if stat.st_size == 0:
+            self._file.close()
+            raise ValueError(f"Word list {path} is empty")
+        self.stamp = (INDEX_VERSION, stat.st_mtime_ns, stat.st_size)
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:2] in (b'\xff\xfe', b'\xfe\xff'):
+            self.close()
+            raise ValueError(f"Word list {path} is UTF-16, save it as UTF-8")
+        self.offsets = self._load_index()
+        if not self.offsets:
+            self.close()
+            raise ValueError(f"Word list {path} has no words")
+
+    def _load_index(self):
+        if self.index_file:
+            try:
+                with open(self.index_file, 'rb') as f:
+                    if f.read(len(_INDEX_MAGIC)) == _INDEX_MAGIC:
+                        header = array.array('Q')
+                        header.fromfile(f, 4)
+                        if tuple(header[:3]) == self.stamp:
+                            offsets = array.array('Q')
+                            offsets.fromfile(f, header[3])
+                            return offsets
+            except (OSError, EOFError, ValueError):
+                pass
+
+        offsets = self.build_index()
+        if self.index_file:
+            try:
+                temp_path = f"{self.index_file}.tmp"
+                with open(temp_path, 'wb') as f:
+                    f.write(_INDEX_MAGIC)
+                    array.array('Q', list(self.stamp) + [len(offsets)]).tofile(f)
+                    offsets.tofile(f)
+                os.replace(temp_path, self.index_file)
+            except OSError as e:
+                logger.debug(f"Could not write word list index {self.index_file}: {e}")
+        return offsets
+
+    def build_index(self):
+        """Scan the word list once and return the offset of every non-empty line."""
+        start = 3 if self._map[:3] == b'\xef\xbb\xbf' else 0
+        return array.array('Q', (match.start() for match in _WORD.finditer(self._map, start)))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def word(self, index: int) -> str:
+        start = self.offsets[index]
+        end = self._map.find(b'\n', start)
+        return self._map[start:end if end >= 0 else len(self._map)].decode('utf-8', 'replace').strip()
+
+    def random_word(self) -> str:
+        return self.word(secrets.randbelow(len(self.offsets)))
+
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+class PasswordGenerator(object):
+    """Generates passwords following a PasswordPolicy from a WordList (or random characters without one)."""
+
+    # Words drawn before giving up on finding one the policy accepts
+    MAX_DRAWS = 1000
+
+    def __init__(self, word_list: WordList = None, policy: PasswordPolicy = None):
+        self.word_list = word_list
+        self.policy = policy or PasswordPolicy()
+
+    def generate(self) -> str:
+        if self.word_list is None:
+            return ''.join(secrets.choice(FALLBACK_CHARACTERS) for _ in range(self.policy.fallback_length))
+
+        for _ in range(self.MAX_DRAWS):
+            word = self.word_list.random_word()
+            if self.policy.accepts(word):
+                break
+        else:
+            raise ValueError(f"No word in {self.word_list.path} matches the password policy")
+
+        word = word.capitalize() if self.policy.capitalize else word
+        digits = self.policy.digits
+        number = str(10 ** (digits - 1) + secrets.randbelow(9 * 10 ** (digits - 1))) if digits > 0 else ''
+        return f"{word}{number}"
+
+    def close(self):
+        if self.word_list is not None:
+            self.word_list.close()
+
+
+_generators = {}
+_lock = threading.Lock()
+
+
+def get_generator(word_list_file: str = None, policy: PasswordPolicy = None, index_file=None):
+    """
+    Return a PasswordGenerator for word_list_file, opened once per process. Without a usable word
+    list the generator falls back to random characters, like reset_password.ps1 does.
+    """
+    key = (word_list_file, index_file)
+    with _lock:
+        generator = _generators.get(key)
+        if generator is None:
+            word_list = None
+            if word_list_file and os.path.exists(word_list_file):
+                try:
+                    word_list = WordList(word_list_file, index_file)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Can't use word list {word_list_file}, generating random passwords: {e}")
+            else:
+                logger.warning(f"Word list {word_list_file} not found, generating random passwords")
+            generator = _generators[key] = PasswordGenerator(word_list, policy)
+        elif policy is not None:
+            generator.policy = policy
+    return generator
@@ -0,0 +1,268 @@
+#
+#   Description: Typed student records read from the StudentCreated.csv export, and the validation
+#                stage that normalizes them and sets aside the rows that must not reach a building
+#
+
+import csv, os, re, sys
+from collections import Counter
+from itertools import islice
+
+
+# Export column of each record attribute, in the order of the district export
+FIELDS = (('Student ID', 'student_id'), ('First Name', 'first_name'), ('Middle Name', 'middle_name'),
+          ('Last Name', 'last_name'), ('Email', 'email'), ('School Name', 'school'), ('Current Grade', 'grade'),
+          ('Status', 'status'), ('UserName', 'username'), ('Password', 'password'))
+HEADERS = [header for header, _ in FIELDS]
+ATTRIBUTE = dict(FIELDS)
+
+_EMAIL = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s.]+')
+
+
+class StudentRecord(object):
+    """One student of the export, held in slots instead of a dict.
+
+    Records can be read like the csv.DictReader rows they replace (get, [], keys), so the
+    partitioner, the student index and csv.DictWriter take either. Columns that are not
+    one of FIELDS (e.g. the delta Change column) and extra values of a malformed row (key None,
+    as DictReader does) go to the extra dict.
+
+    Args:
+      values: The FIELDS values, in order.
+      line: Line of the row in the export file.
+      columns: The columns the row was read with, a set-like keys view shared by every record of a file.
+      extra: Other columns, or None.
+    """
+
+    __slots__ = tuple(ATTRIBUTE.values()) + ('line', 'columns', 'extra')
+
+    def __init__(self, values, line=None, columns=dict.fromkeys(HEADERS).keys(), extra=None):
+        (self.student_id, self.first_name, self.middle_name, self.last_name, self.email,
+         self.school, self.grade, self.status, self.username, self.password) = values
+        self.line = line
+        self.columns = columns
+        self.extra = extra
+
+    def get(self, header, default=None):
+        attribute = ATTRIBUTE.get(header)
+        if attribute is not None:
+            return getattr(self, attribute)
+        return self.extra.get(header, default) if self.extra else default
+
+    def __getitem__(self, header):
+        value = self.get(header, KeyError)
+        if value is KeyError:
+            raise KeyError(header)
+        return value
+
+    def __setitem__(self, header, value):
+        attribute = ATTRIBUTE.get(header)
+        if attribute is not None:
+            setattr(self, attribute, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[header] = value
+
+    def keys(self):
+        return {**dict.fromkeys(self.columns), **self.extra}.keys() if self.extra else self.columns
+
+    def values(self):
+        """The FIELDS values, in order."""
+        return [getattr(self, attribute) for attribute in ATTRIBUTE.values()]
+
+    def as_dict(self) -> dict:
+        row = {header: self.get(header) for header in self.columns}
+        row.update(self.extra or {})
+        return row
+
+    def __repr__(self):
+        return f"StudentRecord(line={self.line}, {self.as_dict()!r})"
+
+
+def read_records(path: str):
+    """Lazily yield the rows of an export file as StudentRecords.
+
+    Names, school, grade and status are interned, so the values repeated across rows (the
+    same few buildings, grades and common first and last names) are stored once. Blank lines are skipped like csv.DictReader does.
+    """
+    intern = sys.intern
+    with open(path, 'r', encoding='utf-8', newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = dict.fromkeys(header).keys()
+        size = len(header)
+        aligned = header == HEADERS
+        positions = [header.index(name) if name in header else None for name in HEADERS]
+        others = [(index, name) for index, name in enumerate(header) if name not in ATTRIBUTE]
+
+        for row in reader:
+            if not row:
+                continue
+            extra = None
+            if len(row) != size:
+                if len(row) > size:
+                    extra = {None: row[size:]}
+                row = (row + [''] * size)[:size]
+            if aligned:
+                values = row
+            else:
+                values = ['' if index is None else row[index] for index in positions]
+                if others:
+                    extra = extra or {}
+                    extra.update((name, row[index]) for index, name in others)
+
+            record = StudentRecord(values, reader.line_num, columns, extra)
+            record.first_name = intern(record.first_name)
+            record.middle_name = intern(record.middle_name)
+            record.last_name = intern(record.last_name)
+            record.school = intern(record.school)
+            record.grade = intern(record.grade)
+            record.status = intern(record.status)
+            yield record
+
+
+class RecordValidator(object):
+    """Normalizes export records and sets aside the ones that must not reach a building file.
+
+    Every field but the password is stripped, runs of whitespace in names are collapsed (so a
+    blank middle name " " becomes ''), emails are lowercased, grades and statuses uppercased and
+    the School Name is replaced by the name of the configured building it matches.
+
+    Rows are rejected for: extra fields, no Student ID, a Student ID already kept from the file
+    (the first valid row is kept, a rejected row doesn't hold its ID), a missing or malformed email, an email that is not the UserName's
+    (match_email_username), no grade (require_grade) and a School Name that matches no configured
+    building (reject_unknown_buildings).
+
+    Args:
+      directory: BuildingDirectory the School Name is matched against, None to keep it as written.
+      require_grade: Reject rows without a Current Grade.
+      reject_unknown_buildings: Reject rows of buildings that are not configured.
+      match_email_username: Reject rows whose email is not <UserName>@<domain>.
+      batch_size: Rows validated together; the rejects of a batch are written at once.
+    """
+
+    def __init__(self, directory=None, require_grade=False, reject_unknown_buildings=True,
+                 match_email_username=True, batch_size=1000):
+        self.directory = directory
+        self.require_grade = require_grade
+        self.reject_unknown_buildings = reject_unknown_buildings and directory is not None
+        self.match_email_username = match_email_username
+        self.batch_size = batch_size
+        # Student ID -> (line, hash of the row) of the first valid row of each student
+        self.seen = {}
+        # School Name as written -> configured building name, or None when it matches none
+        self.schools = {}
+
+    def school(self, value: str):
+        name = self.schools.get(value, KeyError)
+        if name is KeyError:
+            stripped = ' '.join(value.split())
+            building = self.directory.get(stripped) if self.directory is not None and stripped else None
+            name = sys.intern(building.name) if building is not None else None
+            if name is None and not self.reject_unknown_buildings:
+                name = sys.intern(stripped)
+            self.schools[value] = name
+        return name
+
+    def check(self, record: StudentRecord):
+        """Normalize a record in place. Returns None if it is valid, else (reason, detail)."""
+        if record.extra and None in record.extra:
+            return "extra fields", f"{len(record.extra[None])} value(s) after the last column"
+
+        intern = sys.intern
+        record.student_id = record.student_id.strip()
+        record.first_name = intern(' '.join(record.first_name.split()))
+        record.middle_name = intern(' '.join(record.middle_name.split()))
+        record.last_name = intern(' '.join(record.last_name.split()))
+        record.email = record.email.strip().lower()
+        record.username = record.username.strip()
+        record.grade = intern(record.grade.strip().upper())
+        record.status = intern(record.status.strip().upper())
+        school = record.school
+        record.school = self.school(school) or school.strip()
+
+        if not record.student_id:
+            return "missing Student ID", ""
+        row_hash = hash((record.first_name, record.middle_name, record.last_name, record.email,
+                         record.school, record.grade, record.status, record.username, record.password))
+        first = self.seen.get(record.student_id)
+        if first is not None and first[0] != record.line:
+            same = "same row" if first[1] == row_hash else "different data"
+            return "duplicate Student ID", f"{record.student_id} first on line {first[0]}, {same}"
+
+        if 'Email' in record.columns:
+            if not _EMAIL.fullmatch(record.email):
+                return "invalid email", record.email
+            if self.match_email_username and record.username and \
+                    record.email.split('@', 1)[0] != record.username.lower():
+                return "email does not match UserName", f"{record.email} / {record.username}"
+        if self.require_grade and 'Current Grade' in record.columns and not record.grade:
+            return "missing grade", ""
+        if self.reject_unknown_buildings and self.school(school) is None:
+            return "unknown building", record.school
+        # Only a row that is kept claims its Student ID
+        self.seen[record.student_id] = (record.line, row_hash)
+        return None
+
+    def validate(self, records, rejects=None):
+        """Yield the valid records, normalized, and pass the rejected ones to rejects (a RejectReport)."""
+        records = iter(records)
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                return
+            rejected = []
+            for record in batch:
+                problem = self.check(record)
+                if problem is None:
+                    yield record
+                else:
+                    rejected.append((record, problem))
+            if rejected and rejects is not None:
+                rejects.extend(rejected)
+
+
+class RejectReport(object):
+    """CSV file of the rejected rows (line, reason, detail and the row), created on the first reject.
+
+    Args:
+      path: The report file.
+      headers: Columns of the rows written after Line, Reason and Detail.
+      max_examples: Rejects kept as text for the error notification.
+    """
+
+    def __init__(self, path: str, headers: list, max_examples: int = 20):
+        self.path = path
+        self.headers = headers
+        self.max_examples = max_examples
+        self.count = 0
+        self.reasons = Counter()
+        self.examples = []
+        self._file = None
+        self._writer = None
+
+    def extend(self, rejected):
+        if self._file is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._file = open(self.path, 'w', newline='', encoding='utf-8')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(['Line', 'Reason', 'Detail'] + self.headers)
+
+        for record, (reason, detail) in rejected:
+            self._writer.writerow([record.line, reason, detail] + [record.get(header, '') for header in self.headers])
+            self.count += 1
+            self.reasons[reason] += 1
+            if len(self.examples) < self.max_examples:
+                self.examples.append(f"line {record.line}: {reason}{f' ({detail})' if detail else ''}")
+
+    def summary(self) -> str:
+        return ', '.join(f"{count} {reason}" for reason, count in self.reasons.most_common())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
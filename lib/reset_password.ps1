@@ -1,6 +1,11 @@
 # Script to reset a user's password in Active Directory
 param (
-    [string]$username
+    [string]$username,
+    # New password, normally generated by lib\passwords.py; a word list password is made up when it is empty
+    [string]$password,
+    # Keep the session open and reset every username received on stdin (one JSON request per line)
+    [switch]$serve,
+    [string]$wordListFile = "config\WL.txt"
 )
 
 # Import the Active Directory module
@@ -27,8 +32,11 @@ function wordlistPassword {
         Write-Log "Wordlist file not found at $wordlistFile generatePassword function will be use" -ForegroundColor Red
         return $false
         }
-    $wordlist = get-content -Path $wordlistFile
-    $randomword = $wordlist | Get-Random -Count 1 
+    # Read the word list once per session, not for every password
+    if ($null -eq $script:wordlist) {
+        $script:wordlist = Get-Content -Path $wordlistFile
+    }
+    $randomword = $script:wordlist | Get-Random -Count 1 
     $randomnumber = Get-Random -Minimum 100 -Maximum 999
     $password = "$randomword$randomnumber"
     return $password
@@ -45,27 +53,70 @@ function Write-Log {
 }
 
 
-try {
-    $NewPassword = wordlistPassword 
+function Reset-StudentPassword {
+    param (
+        [string]$username,
+        [string]$NewPassword
+    )
+    if (-not $NewPassword) {
+        $NewPassword = wordlistPassword -wordlistfile $wordListFile
+    }
     # if the wordlistPassword function returns false, generate a new password
     if (-not $NewPassword) {
         Write-Log "Wordlist password generation failed, generating a random password." -ForegroundColor Yellow
         $NewPassword = generatePassword
     }
     # Check if the user exists in Active Directory
-    $user = Get-ADUser -Filter {samAccountName -eq $username } | Select -ExpandProperty samAccountName
+    $user = Get-ADUser -Filter {samAccountName -eq $username } -Properties DisplayName
     if ($null -eq $user) {
         Write-Log "User $username not found in Active Directory." -ForegroundColor Red
         return ("Failed", "User $username not found in Active Directory.")
-        exit 1
     }
 
     # Reset the user's password
-    Set-ADAccountPassword -Identity $user -Reset -NewPassword (ConvertTo-SecureString -AsPlainText $NewPassword -Force)
-    $displayName = Get-ADUser -Filter {samAccountName -eq $username } -Properties DisplayName | Select-Object -ExpandProperty DisplayName
+    Set-ADAccountPassword -Identity $user.samAccountName -Reset -NewPassword (ConvertTo-SecureString -AsPlainText $NewPassword -Force)
+    $displayName = $user.DisplayName
     Write-Log "Password for user $username has been reset successfully." -ForegroundColor Green
-    return ("success", "$displayName,$NewPassword")
+    # Display name and password are kept apart, display names like "Doe, John" contain commas
+    return ("success", $displayName, $NewPassword)
+}
+
+
+if ($serve) {
+    # Bulk mode: the module is loaded once and every request reuses it. Passwords normally come
+    # with the request; the word list is only read if a request has none.
+    # Request:  {"id": 1, "username": "jdoe", "password": "..."}
+    # Response: {"id": 1, "status": "success", "displayName": "John Doe", "password": "..."}
+    #           {"id": 1, "status": "Failed", "error": "..."}
+    while ($null -ne ($line = [Console]::In.ReadLine())) {
+        if (-not $line.Trim()) { continue }
+        $response = @{ id = $null; status = "Failed" }
+        try {
+            $request = $line | ConvertFrom-Json
+            $response.id = $request.id
+            $status, $update, $password = Reset-StudentPassword -username $request.username -NewPassword $request.password
+            $response.status = $status
+            if ($status -eq "success") {
+                $response.displayName = $update
+                $response.password = $password
+            } else {
+                $response.error = $update
+            }
+        } catch {
+            Write-Log "An error occurred: $_" -ForegroundColor Red
+            $response.error = "An error occurred:  $_"
+        }
+        [Console]::Out.WriteLine(($response | ConvertTo-Json -Compress))
+        [Console]::Out.Flush()
+    }
+    exit 0
+}
+
+
+try {
+    # Success: status, display name and password; failure: status and error
+    return (Reset-StudentPassword -username $username -NewPassword $password)
 } catch {
     Write-Log "An error occurred: $_" -ForegroundColor Red
     return ("Failed", "An error occurred:  $_")
-}
\ No newline at end of file
+}
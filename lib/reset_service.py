@@ -0,0 +1,234 @@
+#
+#   Description: Local HTTP/JSON service for help-desk password resets (update-students.py --serve).
+#                One long running process keeps a warm pool of PowerShell sessions and the Gmail
+#                client, so a reset no longer pays for interpreter startup, Gmail authentication
+#                and Import-Module ActiveDirectory, and requests are queued instead of several
+#                processes fighting over config\token.pickle.
+#
+#   API (JSON bodies and answers):
+#     POST /resets       {"username": "36luicrooks", "building": "TDS", "wait": true}
+#                        200 with the finished job, or 202 with the job still queued or running
+#                        (after waitSeconds, or straight away with "wait": false)
+#     GET  /resets/<id>  the job: id, username, building, status (queued, running, success, failed), error
+#     GET  /health       workers, queued jobs and job counts
+#
+#   Passwords are never returned, they are emailed to the building secretaries as before.
+#
+
+import re, hmac, json, time, uuid, queue, logging, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCESS, FAILED = 'queued', 'running', 'success', 'failed'
+
+_USERNAME = re.compile(r'[A-Za-z0-9._\-]{1,64}')
+
+
+class ResetJob(object):
+    """One requested password reset."""
+
+    __slots__ = ('id', 'username', 'building', 'status', 'display_name', 'error', 'created', 'finished', 'done')
+
+    def __init__(self, username, building, clock):
+        self.id = uuid.uuid4().hex
+        self.username = username
+        self.building = building
+        self.status = QUEUED
+        self.display_name = None
+        self.error = None
+        self.created = clock()
+        self.finished = None
+        self.done = threading.Event()
+
+    def as_dict(self) -> dict:
+        return {'id': self.id, 'username': self.username, 'building': self.building, 'status': self.status,
+                'display_name': self.display_name, 'error': self.error}
+
+
+class ResetQueue(object):
+    """Reset jobs run one at a time per worker thread, with duplicate requests merged.
+
+    A request for a student that already has a job queued, running or successful less than
+    dedupe_window seconds ago gets that job back instead of a second reset (and a second email).
+    A failed job is never handed back, so the help desk can retry straight away.
+
+    Args:
+      handle: Called by a worker as handle(username, building); returns a ResetResult.
+      workers: Worker threads, one per PowerShell session.
+      dedupe_window: Seconds a successful job still answers requests for the same student.
+      keep_seconds: Seconds finished jobs can still be looked up by id.
+    """
+
+    def __init__(self, handle, workers=2, dedupe_window=60.0, keep_seconds=3600.0, clock=time.monotonic):
+        self.handle = handle
+        self.dedupe_window = dedupe_window
+        self.keep_seconds = keep_seconds
+        self.clock = clock
+        self.jobs = {}
+        self._latest = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work, name=f"reset-worker-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+        return self
+
+    def submit(self, username: str, building: str):
+        """Queue a reset and return (job, duplicate)."""
+        key = username.lower()
+        with self._lock:
+            self._forget()
+            job = self._latest.get(key)
+            if job is not None and (job.status in (QUEUED, RUNNING) or
+                                    (job.status == SUCCESS and self.clock() - job.finished < self.dedupe_window)):
+                return job, True
+            job = ResetJob(username, building, self.clock)
+            self.jobs[job.id] = job
+            self._latest[key] = job
+        self._queue.put(job)
+        return job, False
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def counts(self) -> dict:
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, SUCCESS: 0, FAILED: 0}
+            for job in self.jobs.values():
+                counts[job.status] += 1
+        return counts
+
+    @property
+    def workers(self):
+        return len(self._workers)
+
+    def _forget(self):
+        now = self.clock()
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job.finished is not None and now - job.finished > self.keep_seconds]:
+            job = self.jobs.pop(job_id)
+            if self._latest.get(job.username.lower()) is job:
+                del self._latest[job.username.lower()]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            job.status = RUNNING
+            try:
+                result = self.handle(job.username, job.building)
+                job.display_name = result.display_name or None
+                job.error = result.error
+                status = SUCCESS if result.ok else FAILED
+            except Exception as e:
+                logger.exception(f"Password reset of {job.username} failed: {e}")
+                job.error = str(e)
+                status = FAILED
+            # finished is set before the status, submit reads it for a successful job
+            job.finished = self.clock()
+            job.status = status
+            job.done.set()
+
+    def stop(self, timeout=None):
+        """Let the workers finish the queued jobs and stop."""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'update-students'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _answer(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        token = self.server.token
+        if token and not hmac.compare_digest(self.headers.get('X-Reset-Token', ''), token):
+            self._answer(401, {'error': 'missing or wrong X-Reset-Token'})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == '/health':
+            reset_queue = self.server.reset_queue
+            self._answer(200, {'status': 'ok', 'workers': reset_queue.workers, 'jobs': reset_queue.counts()})
+        elif self.path.startswith('/resets/'):
+            job = self.server.reset_queue.get(self.path[len('/resets/'):])
+            if job is None:
+                self._answer(404, {'error': 'unknown job'})
+            else:
+                self._answer(200, job.as_dict())
+        else:
+            self._answer(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if self.path != '/resets':
+            self._answer(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length) or b'{}')
+            username = str(request.get('username') or '').strip()
+            building = str(request.get('building') or '').strip()
+        except (ValueError, AttributeError):
+            self._answer(400, {'error': 'expected a JSON object with username and building'})
+            return
+
+        if not _USERNAME.fullmatch(username):
+            self._answer(400, {'error': f"invalid username '{username}'"})
+            return
+        building_name = self.server.resolve_building(building)
+        if building_name is None:
+            self._answer(400, {'error': f"unknown building '{building}'"})
+            return
+
+        job, duplicate = self.server.reset_queue.submit(username, building_name)
+        if duplicate:
+            logger.info(f"Duplicate reset request for {username}, answering with job {job.id}")
+        if request.get('wait', True):
+            job.done.wait(self.server.wait_seconds)
+        body = dict(job.as_dict(), duplicate=duplicate)
+        self._answer(200 if job.done.is_set() else 202, body)
+
+
+class ResetServer(ThreadingHTTPServer):
+    """HTTP front end of a ResetQueue.
+
+    Args:
+      address: (host, port) to listen on; keep the host on 127.0.0.1 unless the help desk is remote.
+      reset_queue: The ResetQueue requests are submitted to.
+      resolve_building: Returns the configured building name of a short code or name, or None.
+      token: Shared secret expected in the X-Reset-Token header, None to accept any caller.
+      wait_seconds: How long a request waits for its reset before answering 202.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, reset_queue, resolve_building, token=None, wait_seconds=30.0):
+        super().__init__(address, _Handler)
+        self.reset_queue = reset_queue
+        self.resolve_building = resolve_building
+        self.token = token or None
+        self.wait_seconds = wait_seconds
@@ -0,0 +1,160 @@
+#
+#   Description: Persistent PowerShell sessions used to reset many student passwords
+#                without starting a new powershell.exe (and importing ActiveDirectory) per student
+#
+
+import json, queue, subprocess, threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# lib\reset_password.ps1 in serve mode reads one JSON request per line on stdin
+# and answers with one JSON response per line on stdout.
+DEFAULT_COMMAND = ['powershell.exe', '-NoProfile', '-ExecutionPolicy', 'Bypass',
+                   '-File', r'lib\reset_password.ps1', '-serve']
+
+
+class ResetResult(object):
+    """Outcome of one password reset."""
+
+    __slots__ = ('username', 'building', 'status', 'display_name', 'password', 'error')
+
+    def __init__(self, username, building=None, status='Failed', display_name=None, password=None, error=None):
+        self.username = username
+        self.building = building
+        self.status = status
+        self.display_name = display_name
+        self.password = password
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.status == 'success'
+
+
+class PowerShellSession(object):
+    """One long running reset_password.ps1 -serve process.
+
+    Args:
+      command: Command line of the worker. Defaults to reset_password.ps1 in serve
+        mode; a stub script speaking the same protocol can be used in its place.
+      timeout: Seconds to wait for an answer before the session is killed and the
+        reset reported as failed.
+    """
+
+    def __init__(self, command=None, timeout=120):
+        self.command = list(command or DEFAULT_COMMAND)
+        self.timeout = timeout
+        self.process = None
+        self._lines = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            text=True, encoding='utf-8', bufsize=1)
+            # stdout is read on its own thread so a hung session can't block reset() forever
+            self._lines = queue.Queue()
+            threading.Thread(target=self._read, args=(self.process.stdout, self._lines),
+                             name='powershell-reader', daemon=True).start()
+        return self
+
+    @staticmethod
+    def _read(stdout, lines):
+        try:
+            for line in stdout:
+                lines.put(line)
+        except (OSError, ValueError):
+            pass
+        lines.put('')
+
+    def reset(self, username, building=None, password=None):
+        """Reset one password and return a ResetResult. Never raises for a failed reset."""
+        with self._lock:
+            try:
+                self.start()
+                self._next_id += 1
+                request = {'id': self._next_id, 'username': username}
+                if password:
+                    request['password'] = password
+                self.process.stdin.write(json.dumps(request) + '\n')
+                self.process.stdin.flush()
+                try:
+                    line = self._lines.get(timeout=self.timeout)
+                except queue.Empty:
+                    self.close(kill=True)
+                    raise RuntimeError(f"PowerShell session did not answer within {self.timeout}s")
+                if not line:
+                    raise RuntimeError(f"PowerShell session exited with code {self.process.wait(timeout=self.timeout)}")
+                response = json.loads(line)
+                if response.get('id') != request['id']:
+                    raise RuntimeError(f"Out of order response from PowerShell session: {line.strip()}")
+            except Exception as e:
+                # The session is in an unknown state, start a new one on the next request
+                self.close()
+                return ResetResult(username, building, error=str(e))
+
+        # The password that was sent is the one set in AD, the answer only echoes it
+        return ResetResult(username, building, status=response.get('status', 'Failed'),
+                           display_name=(response.get('displayName') or '').strip(),
+                           password=password or (response.get('password') or '').strip(),
+                           error=response.get('error'))
+
+    def close(self, kill=False):
+        if self.process is not None:
+            try:
+                if not kill:
+                    self.process.stdin.close()
+                    self.process.wait(timeout=self.timeout)
+            except Exception:
+                pass
+            if self.process.poll() is None:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+            self._lines = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SessionPool(object):
+    """A small pool of PowerShellSession workers sharing a queue of resets."""
+
+    def __init__(self, size=2, command=None):
+        self.sessions = [PowerShellSession(command) for _ in range(max(1, size))]
+        self._idle = queue.Queue()
+        for session in self.sessions:
+            self._idle.put(session)
+
+    def start(self):
+        """Start every session now, so the first resets don't wait for PowerShell to load."""
+        for session in self.sessions:
+            session.start()
+        return self
+
+    def reset(self, username, building=None, password=None):
+        session = self._idle.get()
+        try:
+            return session.reset(username, building, password)
+        finally:
+            self._idle.put(session)
+
+    def reset_many(self, students):
+        """Reset every (username, building) or (username, building, password) tuple and return
+        the ResetResults in the same order."""
+        with ThreadPoolExecutor(max_workers=len(self.sessions)) as pool:
+            return list(pool.map(lambda student: self.reset(*student), students))
+
+    def close(self):
+        for session in self.sessions:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,60 +1,224 @@
 import base64
-from email.mime.audio import MIMEAudio
-from email.mime.base import MIMEBase
-from email.mime.image import MIMEImage
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 import mimetypes
-import os, sys, logging
+import os, sys, logging, time, datetime, threading
 #from __future__ import print_function
 import pickle
 import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.errors import HttpError
+import io, tempfile, uuid
+
+from lib import lazy_import, metrics
+
+# The Google client libraries and MIME classes are only imported once a message is
+# actually built or sent, so runs with nothing to send never load them.
+mime_audio = lazy_import.module('email.mime.audio')
+mime_base = lazy_import.module('email.mime.base')
+mime_image = lazy_import.module('email.mime.image')
+mime_multipart = lazy_import.module('email.mime.multipart')
+mime_text = lazy_import.module('email.mime.text')
+email_utils = lazy_import.module('email.utils')
+email_policy = lazy_import.module('email.policy')
+discovery = lazy_import.module('googleapiclient.discovery')
+api_http = lazy_import.module('googleapiclient.http')
+errors = lazy_import.module('googleapiclient.errors')
+oauth_flow = lazy_import.module('google_auth_oauthlib.flow')
+auth_requests = lazy_import.module('google.auth.transport.requests')
+auth_httplib2 = lazy_import.module('google_auth_httplib2')
+httplib2 = lazy_import.module('httplib2')
 
 
-from apiclient import errors
-
 # If modifying these scopes, delete the file token.pickle.
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 
 
 
-def sendMessage(user_id, message):
-    """Shows basic usage of the Gmail API.
-    Lists the user's Gmail labels.
+class GmailClient(object):
+    """Long lived Gmail API client.
+
+    Credentials are loaded from the token file once and only refreshed when they
+    are about to expire, and the Gmail service (discovery document and HTTP
+    transport) is built once and reused for every message sent during a run.
+
+    Args:
+      token_file: Pickled credentials created by the authorization flow.
+      credentials_file: OAuth client secrets used when no usable token exists.
+      refresh_margin: Refresh the access token when it expires within this many seconds.
+      http: Optional httplib2 compatible transport (e.g. googleapiclient.http.HttpMock).
+        When given it is used as is and no credentials are loaded, which allows
+        the client to be exercised against a fake Gmail transport.
+      http_factory: Optional callable returning a new transport. It is called once per
+        sending thread, which is needed when messages are sent concurrently.
+      root_url: Optional API endpoint, e.g. a local fake Gmail server.
+
+    The client can be shared between threads; each thread sends over its own
+    transport because httplib2 connections are not thread safe.
+    """
+
+    def __init__(self, token_file=os.path.join('config', 'token.pickle'), credentials_file=os.path.join('config', 'credentials.json'),
+                 refresh_margin=300, http=None, http_factory=None, root_url=None):
+        self.token_file = token_file
+        self.credentials_file = credentials_file
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self.http = http
+        self.http_factory = http_factory
+        self.root_url = root_url
+        self.creds = None
+        self.sent = 0
+        # Accumulated seconds spent on each stage of sending
+        self.timings = {'auth': 0.0, 'discovery': 0.0, 'send': 0.0}
+        self._service = None
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def _expiring(self):
+        if not self.creds.expiry:
+            return False
+        return self.creds.expiry - datetime.datetime.utcnow() < self.refresh_margin
+
+    def credentials(self):
+        """Return valid credentials, loading or refreshing them only when needed."""
+        if self.http is not None or self.http_factory is not None:
+            return None
+        if self.creds and self.creds.valid and not self._expiring():
+            return self.creds
+
+        with self._lock:
+            if self.creds and self.creds.valid and not self._expiring():
+                return self.creds
+            return self._load_credentials()
+
+    def _load_credentials(self):
+        start = time.perf_counter()
+        try:
+            # The file token.pickle stores the user's access and refresh tokens, and is
+            # created automatically when the authorization flow completes for the first
+            # time.
+            if self.creds is None and os.path.exists(self.token_file):
+                with open(self.token_file, 'rb') as token:
+                    self.creds = pickle.load(token)
+            if not self.creds or not self.creds.valid or self._expiring():
+                if self.creds and self.creds.refresh_token:
+                    # Refresh in place so a transport that is already built picks up the new token
+                    self.creds.refresh(auth_requests.Request())
+                else:
+                    # If there are no (valid) credentials available, let the user log in.
+                    flow = oauth_flow.InstalledAppFlow.from_client_secrets_file(self.credentials_file, SCOPES)
+                    self.creds = flow.run_local_server(port=0)
+                    # Drop the service and per thread transports bound to the old credentials
+                    self._service = None
+                    self._local = threading.local()
+                # Save the credentials for the next run
+                with open(self.token_file, 'wb') as token:
+                    pickle.dump(self.creds, token)
+        finally:
+            self._record('auth', time.perf_counter() - start)
+        return self.creds
+
+    def service(self):
+        """Return the Gmail service, building it on first use."""
+        creds = self.credentials()
+        if self._service is None:
+            with self._lock:
+                if self._service is None:
+                    start = time.perf_counter()
+                    options = {'api_endpoint': self.root_url} if self.root_url else None
+                    try:
+                        if creds is None:
+                            self._service = discovery.build('gmail', 'v1', http=self._transport(), client_options=options)
+                        else:
+                            self._service = discovery.build('gmail', 'v1', credentials=creds, cache_discovery=False,
+                                                  client_options=options)
+                    finally:
+                        self._record('discovery', time.perf_counter() - start)
+        return self._service
+
+    def _transport(self):
+        """Return the HTTP transport for the calling thread, creating it on first use."""
+        if self.http is not None:
+            return self.http
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            # httplib2 silently resends a request whose connection dropped, which can deliver a
+            # message twice; failed sends are retried by dispatch and the outbox instead
+            httplib2.RETRIES = 1
+            if self.http_factory is not None:
+                http = self.http_factory()
+            else:
+                http = auth_httplib2.AuthorizedHttp(self.credentials(), http=httplib2.Http())
+            self._local.http = http
+        return http
+
+    def send(self, user_id, message):
+        """Send a message created by CreateMessage, CreateMessageWithAttachment or CreateMessageFile.
+
+        A MessageFile larger than its upload threshold is sent through Gmail's resumable
+        media upload instead of an inline base64url 'raw' string.
+
+        Returns:
+          ('success', response) or ('failed', error)
+        """
+        try:
+            service = self.service()
+        except Exception as e:
+            metrics.incr('emails_failed')
+            return ('failed', f"Email notification failed, {str(e)}")
+
+        start = time.perf_counter()
+        try:
+            if isinstance(message, MessageFile):
+                if message.size > message.upload_threshold:
+                    request = service.users().messages().send(userId=user_id, body={}, media_body=message.media())
+                else:
+                    request = service.users().messages().send(userId=user_id, body=message.raw())
+            else:
+                request = service.users().messages().send(userId=user_id, body=message)
+            message = request.execute(http=self._transport())
+            with self._lock:
+                self.sent += 1
+            metrics.incr('emails_sent')
+            return ('success', message)
+        except errors.HttpError as error:
+            metrics.incr('emails_failed')
+            return ('failed', error)
+        except Exception as e:
+            metrics.incr('emails_failed')
+            return ('failed', f"Email notification failed, {str(e)}")
+        finally:
+            self._record('send', time.perf_counter() - start)
+
+    def _record(self, stage, seconds):
+        with self._lock:
+            self.timings[stage] += seconds
+        metrics.metrics.observe(f"gmail.{stage}", seconds)
+
+    def timing_report(self):
+        """Return a one line summary of where the time went while sending."""
+        return (f"{self.sent} message(s) sent, auth {self.timings['auth']:.3f}s, "
+                f"discovery {self.timings['discovery']:.3f}s, send {self.timings['send']:.3f}s")
+
+
+# Shared client used by sendMessage so every send in a run reuses one service
+_client = None
+_client_lock = threading.Lock()
+
+
+def getClient():
+    """Return the process wide GmailClient, creating it on first use."""
+    global _client
+    if _client is None:
+        # Threads sending their first message at the same time must share one client
+        with _client_lock:
+            if _client is None:
+                _client = GmailClient()
+    return _client
+
+
+def sendMessage(user_id, message, client=None):
+    """Send a message through the shared GmailClient (or the one provided).
+
+    Returns:
+      ('success', response) or ('failed', error)
     """
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists(r'config\token.pickle'):
-        with open(r'config\token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(r'config\credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open(r'config\token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-
-    service = build('gmail', 'v1', credentials=creds)
-
-    try:
-        message = (service.users().messages().send(userId=user_id, body=message).execute())
-        #print 'Message Id: %s' % message['id']
-        return ('success', message)
-    except errors.HttpError as error:
-        #return "error"
-        return ('failed', error)
-    except Exception as e:
-      return ('failed', f"Email notification failed, {str(e)}")
+    return (client or getClient()).send(user_id, message)
 
 
 
@@ -72,7 +236,7 @@ def CreateMessage(sender, to, subject, message_text,cc=None):
   Returns:
     An object containing a base64url encoded email object.
   """
-  message = MIMEText(message_text)
+  message = mime_text.MIMEText(message_text)
   message['to'] = to
   message['cc'] = cc
   message['from'] = sender
@@ -84,7 +248,7 @@ def CreateMessage(sender, to, subject, message_text,cc=None):
   return {'raw': b64_string}
 
 
-def CreateMessageWithAttachment(sender, to, subject, message_text, file_dir=None, filename=None, cc=None, bcc=None):
+def CreateMessageWithAttachment(sender, to, subject, message_text, file_dir=None, filename=None, cc=None, bcc=None, attachments=None):
   """Create a message for an email.
 
   Args:
@@ -94,24 +258,45 @@ def CreateMessageWithAttachment(sender, to, subject, message_text, file_dir=None
     message_text: The text of the email message.
     file_dir: The directory containing the file to be attached.
     filename: The name of the file to be attached.
+    attachments: Optional list of additional files to attach, as (file_dir, filename)
+      or (file_dir, filename, attachment_name) tuples.
 
   Returns:
     An object containing a base64url encoded email object.
   """
-  message = MIMEMultipart()
+  message = mime_multipart.MIMEMultipart()
   message['to'] = to
   message['from'] = sender
   message['cc'] = cc
   message['bcc'] = bcc
   message['subject'] = subject
 
-  msg = MIMEText(message_text, "html")
+  msg = mime_text.MIMEText(message_text, "html")
   message.attach(msg)
 
-  # If no file_dir or filename is provided, return the message without attachment
-  if file_dir is None or filename is None: return {'raw': base64.urlsafe_b64encode(message.as_bytes()).decode()}
+  files = []
+  if file_dir is not None and filename is not None:
+    files.append((file_dir, filename))
+  files.extend(attachments or [])
+
+  with metrics.span('mime.encode'):
+    for attachment in files:
+      attachFile(message, *attachment)
+
+    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
+  metrics.incr('bytes_encoded', len(raw))
+  return {'raw': raw}
 
 
+def attachFile(message, file_dir, filename, attachment_name=None):
+  """Attach a file to a multipart message.
+
+  Args:
+    message: The MIMEMultipart message.
+    file_dir: The directory containing the file to be attached.
+    filename: The name of the file to be attached.
+    attachment_name: The file name shown to the recipient, defaults to filename.
+  """
   path = os.path.join(file_dir, filename)
   content_type, encoding = mimetypes.guess_type(path)
 
@@ -123,27 +308,142 @@ def CreateMessageWithAttachment(sender, to, subject, message_text, file_dir=None
 
   if main_type == 'text/csv':
     fp = open(path, 'rb')
-    msg = MIMEText(fp.read(), _subtype=sub_type)
+    msg = mime_text.MIMEText(fp.read(), _subtype=sub_type)
     fp.close()
   elif main_type == 'image':
     fp = open(path, 'rb')
-    msg = MIMEImage(fp.read(), _subtype=sub_type)
+    msg = mime_image.MIMEImage(fp.read(), _subtype=sub_type)
     fp.close()
   elif main_type == 'audio':
     fp = open(path, 'rb')
-    msg = MIMEAudio(fp.read(), _subtype=sub_type)
+    msg = mime_audio.MIMEAudio(fp.read(), _subtype=sub_type)
     fp.close()
   else:
     fp = open(path, 'rb')
-    msg = MIMEBase(main_type, sub_type)
+    msg = mime_base.MIMEBase(main_type, sub_type)
     msg.set_payload(fp.read())
     fp.close()
 
-  msg.add_header('Content-Disposition', 'attachment', filename=filename)
+  msg.add_header('Content-Disposition', 'attachment', filename=attachment_name or filename)
   message.attach(msg)
 
-  return {'raw': base64.urlsafe_b64encode(message.as_bytes()).decode()}
 
+# Messages up to this size are sent inline as a base64url 'raw' string, larger ones
+# through the resumable media upload
+UPLOAD_THRESHOLD = 5 * 1024 * 1024
+# Size of the base64 input blocks; a multiple of 57 bytes gives complete 76 character lines
+_B64_BLOCK = 57 * 16 * 1024
+
+
+class MessageFile(object):
+  """An RFC 822 message written to a spooled temporary file by CreateMessageFile.
+
+  The message stays in memory up to spool_size bytes and is moved to disk after that,
+  so large attachments never exist as several full copies in memory.
+  """
+
+  def __init__(self, spool_size=1024 * 1024, upload_threshold=UPLOAD_THRESHOLD):
+    self.file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    self.upload_threshold = upload_threshold
+
+  @classmethod
+  def load(cls, path, upload_threshold=UPLOAD_THRESHOLD):
+    """Return a MessageFile reading a message already saved on disk, e.g. in the outbox."""
+    message = cls.__new__(cls)
+    message.file = open(path, 'rb')
+    message.upload_threshold = upload_threshold
+    return message
 
+  @property
+  def size(self):
+    return self.file.seek(0, os.SEEK_END)
 
-            
\ No newline at end of file
+  def raw(self):
+    """Return the message as the {'raw': ...} body used for inline sends."""
+    self.file.seek(0)
+    return {'raw': base64.urlsafe_b64encode(self.file.read()).decode()}
+
+  def media(self, chunk_size=1024 * 1024):
+    """Return a resumable media upload reading the message from the spooled file."""
+    self.file.seek(0)
+    return api_http.MediaIoBaseUpload(self.file, mimetype='message/rfc822', chunksize=chunk_size, resumable=True)
+
+  def close(self):
+    self.file.close()
+
+
+def _headerBlock(headers):
+  """Return the encoded header block (ending with the blank line) for a list of (name, value) pairs."""
+  policy = email_policy.SMTP
+  return b''.join(policy.fold_binary(*policy.header_store_parse(name, value)) for name, value in headers if value) + b'\r\n'
+
+
+def _attachmentDisposition(filename):
+  """Return the Content-Disposition value for an attachment, RFC 2231 encoding non ASCII names."""
+  try:
+    filename.encode('ascii')
+  except UnicodeEncodeError:
+    return f"attachment; filename*={email_utils.encode_rfc2231(filename, 'utf-8')}"
+  escaped = filename.replace('\\', '\\\\').replace('"', '\\"')
+  return f'attachment; filename="{escaped}"'
+
+
+def _writeBase64(source, out):
+  """Base64 encode source into out in 76 character CRLF terminated lines, one block at a time."""
+  for block in iter(lambda: source.read(_B64_BLOCK), b''):
+    encoded = base64.b64encode(block)
+    out.write(b'\r\n'.join([encoded[i:i + 76] for i in range(0, len(encoded), 76)]) + b'\r\n')
+
+
+def CreateMessageFile(sender, to, subject, message_text, attachments=None, cc=None, bcc=None, spool_size=1024 * 1024,
+                      upload_threshold=UPLOAD_THRESHOLD):
+  """Create a message for an email, streaming the attachments into a spooled temporary file.
+
+  Args:
+    sender: Email address of the sender.
+    to: Email address of the receiver.
+    subject: The subject of the email message.
+    message_text: The HTML text of the email message.
+    attachments: List of files to attach, as (file_dir, filename) or
+      (file_dir, filename, attachment_name) tuples.
+    spool_size: Bytes kept in memory before the message is moved to disk.
+    upload_threshold: Messages larger than this are sent with a resumable upload.
+
+  Returns:
+    A MessageFile that can be passed to sendMessage.
+  """
+  with metrics.span('mime.encode'):
+    message = _writeMessageFile(sender, to, subject, message_text, attachments, cc, bcc,
+                                MessageFile(spool_size, upload_threshold))
+  metrics.incr('bytes_encoded', message.size)
+  return message
+
+
+def _writeMessageFile(sender, to, subject, message_text, attachments, cc, bcc, message):
+  boundary = f"===============_{uuid.uuid4().hex}=="
+  out = message.file
+
+  out.write(_headerBlock([('To', to), ('From', sender), ('Cc', cc), ('Bcc', bcc), ('Subject', subject),
+                          ('MIME-Version', '1.0'), ('Content-Type', f'multipart/mixed; boundary="{boundary}"')]))
+
+  out.write(f"--{boundary}\r\n".encode())
+  out.write(_headerBlock([('Content-Type', 'text/html; charset="utf-8"'), ('Content-Transfer-Encoding', 'base64')]))
+  _writeBase64(io.BytesIO(message_text.encode('utf-8')), out)
+
+  for attachment in attachments or []:
+    file_dir, filename = attachment[0], attachment[1]
+    attachment_name = attachment[2] if len(attachment) > 2 else filename
+    path = os.path.join(file_dir, filename)
+    content_type, encoding = mimetypes.guess_type(path)
+    if content_type is None or encoding is not None:
+      content_type = 'application/octet-stream'
+
+    out.write(f"--{boundary}\r\n".encode())
+    out.write(_headerBlock([('Content-Type', content_type), ('Content-Transfer-Encoding', 'base64'),
+                            ('Content-Disposition', _attachmentDisposition(attachment_name))]))
+    with open(path, 'rb') as fp:
+      _writeBase64(fp, out)
+
+  out.write(f"--{boundary}--\r\n".encode())
+  out.flush()
+  return message
@@ -0,0 +1,112 @@
+#
+#   Description: Indexed store (SQLite) of students already sent to the buildings, used to
+#                reduce each day's export to the students that are new or changed
+#
+
+import hashlib, sqlite3, datetime, os, threading
+from itertools import islice
+
+
+# Column added to delta exports, holding NEW or CHANGED
+CHANGE_COLUMN = 'Change'
+
+
+class StudentIndex(object):
+    """Students already notified, keyed on Student ID with a hash of their row.
+
+    Diffing an export costs one primary key lookup per row, so it only depends on the size
+    of today's file and not on how many students were processed earlier in the year.
+    Rows found by diff() are staged on disk under their export date and building, and only
+    become part of the index once that building's notification has been delivered (see
+    commit_building), which may happen in a later run that drains the outbox.
+
+    Args:
+      path: SQLite database file, created with its tables on first use.
+      headers: Columns included in the row hash.
+      key: Column identifying a student.
+    """
+
+    def __init__(self, path: str, headers: list, key: str = 'Student ID', chunk_size: int = 500):
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.headers = [header for header in headers if header != CHANGE_COLUMN]
+        self.key = key
+        self.chunk_size = chunk_size
+        # One connection shared by the worker threads of a run, writes are serialized by the lock
+        self._lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS students (
+                student_id TEXT PRIMARY KEY,
+                row_hash TEXT NOT NULL,
+                building TEXT,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS staged (
+                date TEXT NOT NULL,
+                building TEXT NOT NULL,
+                student_id TEXT NOT NULL,
+                row_hash TEXT NOT NULL,
+                PRIMARY KEY (date, building, student_id)
+            ) WITHOUT ROWID;
+        ''')
+        self.db.commit()
+
+    def row_hash(self, row: dict) -> str:
+        values = '\x1f'.join((row.get(header) or '').strip() for header in self.headers)
+        return hashlib.blake2b(values.encode('utf-8'), digest_size=16).hexdigest()
+
+    def diff(self, rows, date: str, building_key: str = 'School Name'):
+        """
+        Yield only the rows that are new or changed since they were last notified, with the
+        CHANGE_COLUMN set to NEW or CHANGED, and stage them under date. Rows are looked up in
+        chunks, so the input is still streamed.
+        """
+        rows = iter(rows)
+        # Student ID -> hash of the row already sent from this file, across chunks
+        sent = {}
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            ids = [(row.get(self.key) or '').strip() for row in chunk]
+            placeholders = ','.join('?' * len(ids))
+            with self._lock:
+                known = dict(self.db.execute(f'SELECT student_id, row_hash FROM students WHERE student_id IN ({placeholders})', ids))
+
+            staged = []
+            for student_id, row in zip(ids, chunk):
+                row_hash = self.row_hash(row)
+                previous = sent.get(student_id, known.get(student_id))
+                if previous == row_hash:
+                    continue
+                row[CHANGE_COLUMN] = 'NEW' if previous is None else 'CHANGED'
+                # Later rows for the same student in the same file win
+                sent[student_id] = row_hash
+                staged.append((date, (row.get(building_key) or '').strip(), student_id, row_hash))
+                yield row
+
+            with self._lock, self.db:
+                self.db.executemany('INSERT OR REPLACE INTO staged (date, building, student_id, row_hash) VALUES (?, ?, ?, ?)', staged)
+
+    def commit_building(self, date: str, building: str):
+        """Move the students staged for a building's export of date into the index once its notification was delivered."""
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock, self.db:
+            self.db.execute('''
+                INSERT INTO students (student_id, row_hash, building, first_seen, last_seen)
+                SELECT student_id, row_hash, building, ?, ? FROM staged WHERE date = ? AND building = ?
+                ON CONFLICT(student_id) DO UPDATE SET row_hash = excluded.row_hash,
+                                                      building = excluded.building,
+                                                      last_seen = excluded.last_seen
+            ''', (now, now, date, building))
+            self.db.execute('DELETE FROM staged WHERE date = ? AND building = ?', (date, building))
+
+    def __len__(self):
+        with self._lock:
+            return self.db.execute('SELECT COUNT(*) FROM students').fetchone()[0]
+
+    def close(self):
+        self.db.close()
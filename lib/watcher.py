@@ -0,0 +1,175 @@
+#
+#   Description: Polls the data folder for new or modified <MM-DD-YYYY>/StudentCreated.csv exports
+#                so a long running process can handle each one as soon as it is completely written
+#
+
+import os, re, json, time, signal, logging, datetime, threading
+
+
+logger = logging.getLogger(__name__)
+
+_DATE_FOLDER = re.compile(r'^\d{2}-\d{2}-\d{4}$')
+
+
+class ExportWatcher(object):
+    """Watches dataFolder for export files with a few stat calls per poll.
+
+    The data folder is only listed again when its own modification time changes (a new
+    dated folder was created). Otherwise only the dated folders of the last lookback_days
+    days and their export file are stat'ed. A file is ready once its size and modification
+    time have not changed for settle seconds, so a file that is still being written is
+    not picked up half way. A ready file is handed out once per version: it is handed out
+    again only if it is modified afterwards.
+
+    Args:
+      data_folder: Folder holding one MM-DD-YYYY folder per export day.
+      file_name: Name of the export file inside each dated folder.
+      settle: Seconds a file must stay unchanged before it is ready.
+      lookback_days: Number of past days, besides today, whose folders are watched.
+      clock: Time source, time.monotonic by default.
+    """
+
+    def __init__(self, data_folder, file_name='StudentCreated.csv', settle=10.0, lookback_days=1, clock=time.monotonic):
+        self.data_folder = data_folder
+        self.file_name = file_name
+        self.settle = settle
+        self.lookback_days = lookback_days
+        self.clock = clock
+        self.folders = set()
+        self._folder_mtime = None
+        # date -> (size, mtime_ns) of the file, and when that signature was first seen
+        self._seen = {}
+        # date -> signature of the last version handed out
+        self.handled = {}
+
+    def _watched_dates(self):
+        today = datetime.date.today()
+        return {(today - datetime.timedelta(days=offset)).strftime("%m-%d-%Y") for offset in range(self.lookback_days + 1)}
+
+    def _refresh_folders(self):
+        # Only list the data folder when a dated folder was added or removed
+        mtime = os.stat(self.data_folder).st_mtime_ns
+        if mtime != self._folder_mtime:
+            with os.scandir(self.data_folder) as entries:
+                self.folders = {entry.name for entry in entries if _DATE_FOLDER.match(entry.name) and entry.is_dir()}
+            self._folder_mtime = mtime
+
+    def poll(self):
+        """Return the dates whose export file is new or modified and has settled, oldest first."""
+        self._refresh_folders()
+        now = self.clock()
+        ready = []
+        for date in sorted(self.folders & self._watched_dates(), key=lambda date: (date[6:], date[:5])):
+            try:
+                stat = os.stat(os.path.join(self.data_folder, date, self.file_name))
+            except FileNotFoundError:
+                self._seen.pop(date, None)
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if stat.st_size == 0 or self.handled.get(date) == signature:
+                continue
+            previous = self._seen.get(date)
+            if previous is None or previous[0] != signature:
+                # New or still being written, wait for it to settle
+                self._seen[date] = (signature, now)
+                if self.settle > 0:
+                    continue
+                previous = self._seen[date]
+            if now - previous[1] >= self.settle:
+                ready.append(date)
+        return ready
+
+    def mark_handled(self, date):
+        """Remember the version of a date's export that was just processed."""
+        seen = self._seen.pop(date, None)
+        if seen is not None:
+            self.handled[date] = seen[0]
+
+    @property
+    def pending(self):
+        return sorted(self._seen)
+
+
+class Heartbeat(object):
+    """Health file of a long running process, rewritten atomically on every beat."""
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {'pid': os.getpid(), 'started': _now(), 'status': 'starting',
+                      'last_poll': None, 'last_processed': None, 'last_error': None, 'processed': 0}
+
+    def beat(self, **state):
+        self.state.update(state)
+        self.state['last_poll'] = _now()
+        if not self.path:
+            return
+        try:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write heartbeat file {self.path}: {e}")
+
+
+def stop_on_signals(stop_event):
+    """Set stop_event on Ctrl+C, SIGTERM and (on Windows) Ctrl+Break so the watcher stops between files."""
+    def handler(signum, frame):
+        logger.info(f"Received signal {signum}, stopping after the current file ...")
+        stop_event.set()
+
+    for name in ('SIGINT', 'SIGTERM', 'SIGBREAK'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), handler)
+
+
+def watch(watcher, handle, stop_event=None, poll_interval=5.0, heartbeat=None, on_idle=None):
+    """
+    Poll watcher until stop_event is set and call handle(date) for every export that is ready.
+    A failing handle is logged and its file is not retried until it is modified again.
+    on_idle, if given, is called after every poll that found nothing to process.
+    """
+    stop_event = stop_event or threading.Event()
+    heartbeat = heartbeat or Heartbeat(None)
+    heartbeat.beat(status='watching')
+    while not stop_event.is_set():
+        try:
+            ready = watcher.poll()
+        except OSError as e:
+            logger.error(f"Could not poll {watcher.data_folder}: {e}")
+            heartbeat.beat(status='error', last_error=str(e))
+            stop_event.wait(poll_interval)
+            continue
+
+        if not ready and on_idle is not None:
+            try:
+                on_idle()
+            except Exception as e:
+                logger.exception(f"Idle task failed: {e}")
+
+        for date in ready:
+            if stop_event.is_set():
+                break
+            logger.info(f"New export for {date} in {watcher.data_folder}, processing ...")
+            heartbeat.beat(status='processing', current=date)
+            try:
+                handle(date)
+                heartbeat.state['last_error'] = None
+            except Exception as e:
+                logger.exception(f"Failed to process export for {date}: {e}")
+                heartbeat.state['last_error'] = f"{date}: {e}"
+            watcher.mark_handled(date)
+            heartbeat.state['processed'] += 1
+            heartbeat.state['last_processed'] = date
+
+        heartbeat.beat(status='watching', current=None, pending=watcher.pending)
+        stop_event.wait(poll_interval)
+
+    heartbeat.beat(status='stopped', current=None)
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
@@ -0,0 +1,109 @@
+#
+#   Description: Runs update-students.py for the end to end tests in a temporary workspace, with Gmail
+#                replaced by benchmarks/fakes.FakeGmail and PowerShell by the stub reset script. Every
+#                message sent is recorded (To, Cc, Subject and attachment names) in a JSON file the tests
+#                read back.
+#
+#   Usage: python tests/run_script.py WORKSPACE RECORD_FILE [GMAIL_LATENCY] -- <update-students arguments>
+#
+
+import os, sys, json, email, base64, runpy, shutil, threading, subprocess
+from email import policy
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TESTS)
+BENCH = os.path.join(ROOT, 'benchmarks')
+
+
+def make_workspace(folder, settings=()):
+    """Set up folder like the script's directory: the INI with every path inside folder, and the templates."""
+    sys.path.insert(0, BENCH)
+    import suite
+    from configparser import ConfigParser
+
+    suite.write_config(folder)
+    shutil.copytree(os.path.join(ROOT, 'templates'), os.path.join(folder, 'templates'),
+                    ignore=shutil.ignore_patterns('.cache'))
+    config_file = os.path.join(folder, 'config', 'update-students.ini')
+    config = ConfigParser(interpolation=None)
+    config.optionxform = str
+    config.read(config_file)
+    for section, key, value in settings:
+        config.set(section, key, value)
+    with open(config_file, 'w') as f:
+        config.write(f)
+    os.makedirs(os.path.join(folder, 'data'), exist_ok=True)
+    return folder
+
+
+def start(workspace, *script_args, latency=0):
+    """Start the script in workspace, each Gmail send taking latency seconds, without waiting for it."""
+    record_file = os.path.join(workspace, 'sent.json')
+    # The output goes to a file, a long running --watch would fill a pipe nobody reads
+    with open(os.path.join(workspace, 'output.log'), 'w') as output:
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), workspace, record_file, str(latency), '--'] +
+                                list(script_args), cwd=workspace, stdout=output, stderr=subprocess.STDOUT)
+
+
+def finish(workspace, process, timeout=120):
+    """Wait for a started script and return (exit code, output, messages sent)."""
+    process.wait(timeout)
+    with open(os.path.join(workspace, 'output.log')) as f:
+        output = f.read()
+    with open(os.path.join(workspace, 'sent.json')) as f:
+        return process.returncode, output, json.load(f)
+
+
+def run(workspace, *script_args, latency=0):
+    """Run the script in workspace and return (exit code, output, messages sent)."""
+    return finish(workspace, start(workspace, *script_args, latency=latency))
+
+
+def describe(message):
+    """Return the To, Cc, Subject and attachment names of a message built by lib/send_email."""
+    if hasattr(message, 'file'):
+        message.file.seek(0)
+        data = message.file.read()
+    else:
+        data = base64.urlsafe_b64decode(message['raw'])
+    parsed = email.message_from_bytes(data, policy=policy.default)
+    return {'to': str(parsed['To'] or '').strip(), 'cc': str(parsed['Cc'] or '').strip(),
+            'subject': str(parsed['Subject'] or '').strip(),
+            'attachments': [part.get_filename() for part in parsed.iter_attachments()]}
+
+
+def main():
+    workspace, record_file = sys.argv[1:3]
+    latency = float(sys.argv[3]) if sys.argv[3] != '--' else 0
+    script_args = sys.argv[sys.argv.index('--') + 1:]
+    sys.path[:0] = [ROOT, BENCH]
+    os.chdir(workspace)
+    import fakes
+
+    sent = []
+    lock = threading.Lock()
+
+    class RecordingGmail(fakes.FakeGmail):
+        def send(self, user_id, message):
+            result = super().send(user_id, message)
+            if result[0] == 'success':
+                with lock:
+                    sent.append(describe(message))
+            return result
+
+    RecordingGmail(latency=latency).install()
+    fakes.stub_powershell(startup_delay=0, reset_delay=0)
+    sys.argv = [os.path.join(ROOT, 'update-students.py')] + script_args
+    exit_code = 0
+    try:
+        runpy.run_path(sys.argv[0], run_name='__main__')
+    except SystemExit as e:
+        exit_code = e.code or 0
+    finally:
+        with open(record_file, 'w') as f:
+            json.dump(sent, f)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
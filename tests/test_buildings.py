@@ -0,0 +1,128 @@
+#
+#   Description: Tests of the building directory (lib/buildings.py): recipient parsing, lookups and
+#                the pickled cache rebuilt whenever the INI file changes
+#
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import buildings
+
+
+INI = """
+[BuildingShortNames]
+TDS = Test Dummy School
+OHHS = Oak Hills High School
+ELC = Early Learning Center
+
+[BuildingSecretariesEmails]
+Test Dummy School = Jane Doe <Doe_J@ohlsd.org>, smith_a@ohlsd.org
+Oak Hills High School = office@ohlsd.org, not an address, Broken <broken@ohlsd.org
+"""
+
+
+class ParseRecipientsTest(unittest.TestCase):
+
+    def test_valid_and_invalid_entries(self):
+        recipients, errors = buildings.parse_recipients("Jane Doe <Doe_J@ohlsd.org>, smith_a@ohlsd.org,, bad@, x <y@z")
+        self.assertEqual(recipients, ['Jane Doe <Doe_J@ohlsd.org>', 'smith_a@ohlsd.org'])
+        self.assertEqual(errors, ['bad@', 'x <y@z'])
+        self.assertEqual(buildings.parse_recipients(None), ([], []))
+
+    def test_address_of(self):
+        self.assertEqual(buildings.address_of('Jane Doe <Doe_J@OHLSD.org>'), 'doe_j@ohlsd.org')
+
+
+class BuildingDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='buildings-test-')
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.ini_file = os.path.join(self.folder, 'update-students.ini')
+        self.cache_file = os.path.join(self.folder, 'buildings.cache')
+        self.write(INI)
+
+    def write(self, text):
+        with open(self.ini_file, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def load(self):
+        return buildings.BuildingDirectory.load(self.ini_file, self.cache_file)
+
+    def test_lookups(self):
+        directory = self.load()
+        building = directory.get('TDS')
+        self.assertEqual(building.name, 'Test Dummy School')
+        for key in ('tds', 'Test Dummy School', '  test dummy SCHOOL ', 'Test-Dummy  School.'):
+            self.assertIs(directory.get(key), building, key)
+        self.assertIsNone(directory.get('Nowhere Academy'))
+        self.assertIsNone(directory.get(''))
+        self.assertEqual(directory.recipients('TDS'), 'Jane Doe <Doe_J@ohlsd.org>,smith_a@ohlsd.org')
+        self.assertEqual(directory.short_codes, ['ELC', 'OHHS', 'TDS'])
+
+    def test_building_without_secretaries_uses_the_fallback(self):
+        directory = self.load()
+        self.assertEqual(directory.get('ELC').name, 'Early Learning Center')
+        self.assertEqual(directory.recipients('ELC', fallback='admin@ohlsd.org'), 'admin@ohlsd.org')
+        self.assertEqual(directory.recipients('Nowhere', fallback='admin@ohlsd.org'), 'admin@ohlsd.org')
+
+    def test_malformed_recipients_are_reported(self):
+        directory = self.load()
+        self.assertEqual(directory.recipients('OHHS'), 'office@ohlsd.org')
+        self.assertEqual(directory.validate(), ["Oak Hills High School: invalid recipient 'not an address'",
+                                                "Oak Hills High School: invalid recipient 'Broken <broken@ohlsd.org'"])
+
+    def test_cache_is_reused_while_the_ini_is_unchanged(self):
+        self.load()
+        self.assertTrue(os.path.exists(self.cache_file))
+
+        from_config = buildings.BuildingDirectory.from_config
+        buildings.BuildingDirectory.from_config = classmethod(lambda cls, config: self.fail("INI parsed again"))
+        try:
+            directory = self.load()
+        finally:
+            buildings.BuildingDirectory.from_config = from_config
+        self.assertEqual(directory.get('TDS').recipients, ['Jane Doe <Doe_J@ohlsd.org>', 'smith_a@ohlsd.org'])
+
+    def test_cache_is_rebuilt_when_the_ini_changes(self):
+        self.assertEqual(self.load().recipients('TDS'), 'Jane Doe <Doe_J@ohlsd.org>,smith_a@ohlsd.org')
+        stat = os.stat(self.ini_file)
+
+        # Same size and a later modification time
+        self.write(INI.replace('smith_a@', 'jones_a@'))
+        os.utime(self.ini_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(self.load().recipients('TDS'), 'Jane Doe <Doe_J@ohlsd.org>,jones_a@ohlsd.org')
+
+        # Same modification time and a different size
+        stat = os.stat(self.ini_file)
+        self.write(INI.replace('smith_a@', 'smithers_a@'))
+        os.utime(self.ini_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(self.load().recipients('TDS'), 'Jane Doe <Doe_J@ohlsd.org>,smithers_a@ohlsd.org')
+
+    def test_cache_of_another_version_is_rebuilt(self):
+        self.load()
+        version = buildings.CACHE_VERSION
+        buildings.CACHE_VERSION = version + 1
+        try:
+            with open(self.cache_file, 'rb') as f:
+                before = f.read()
+            self.load()
+            with open(self.cache_file, 'rb') as f:
+                self.assertNotEqual(f.read(), before)
+        finally:
+            buildings.CACHE_VERSION = version
+
+    def test_unreadable_cache_is_ignored(self):
+        with open(self.cache_file, 'wb') as f:
+            f.write(b'not a pickle')
+        self.assertEqual(self.load().get('OHHS').name, 'Oak Hills High School')
+
+    def test_no_cache_file(self):
+        directory = buildings.BuildingDirectory.load(self.ini_file)
+        self.assertEqual(len(directory.buildings), 3)
+        self.assertFalse(os.path.exists(self.cache_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+#
+#   Description: End to end tests of the --from/--to catch-up mode on a temporary data folder of dated
+#                exports, per day and with --merge_days
+#
+
+import os, sys, csv, json, shutil, tempfile, unittest
+from collections import Counter
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(TESTS), os.path.join(os.path.dirname(TESTS), 'benchmarks'), TESTS]
+
+import roster, run_script
+from lib import partition
+
+
+# 10-03-2026 has no export folder, the catch-up must skip it
+DAYS = {'10-01-2026': 40, '10-02-2026': 25, '10-04-2026': 30}
+FROM, TO = '10-01-2026', '10-04-2026'
+
+
+class CatchUpTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = self.make_workspace(workers=4)
+        self.building_names = set(roster.configured_buildings()[0])
+        # date -> building -> students expected in that building's file
+        self.expected = {}
+        for date in DAYS:
+            path = os.path.join(self.workspace, 'data', date, 'StudentCreated.csv')
+            with open(path, newline='', encoding='utf-8') as f:
+                self.expected[date] = Counter(row['School Name'] for row in csv.DictReader(f)
+                                              if row['School Name'] in self.building_names)
+
+    def make_workspace(self, workers, settings=()):
+        workspace = tempfile.mkdtemp(prefix='catch-up-test-')
+        self.addCleanup(shutil.rmtree, workspace, ignore_errors=True)
+        # With several workers the days are processed, and their notifications sent, concurrently
+        run_script.make_workspace(workspace, [('general', 'catchUpWorkers', str(workers)), ('email', 'digest', 'no')] +
+                                  list(settings))
+        for seed, (date, rows) in enumerate(DAYS.items()):
+            roster.write_roster(os.path.join(workspace, 'data', date, 'StudentCreated.csv'), rows, seed=seed)
+        return workspace
+
+    def send_seconds(self, workspace):
+        with open(os.path.join(workspace, 'logs', 'metrics.json'), encoding='utf-8') as f:
+            return json.load(f)['spans']['email.send']['seconds']
+
+    def assert_day_outputs(self):
+        for date, counts in self.expected.items():
+            folder = os.path.join(self.workspace, 'data', date)
+            for building_name, count in counts.items():
+                with open(os.path.join(folder, partition.output_file_name(building_name)), newline='', encoding='utf-8') as f:
+                    rows = list(csv.DictReader(f))
+                self.assertEqual(len(rows), count, f"{building_name} on {date}")
+                self.assertTrue(all(row['School Name'] == building_name for row in rows))
+        self.assertFalse(os.path.exists(os.path.join(self.workspace, 'data', '10-03-2026')))
+
+    def test_every_day_is_exported_and_notified(self):
+        exit_code, output, sent = run_script.run(self.workspace, '--from', FROM, '--to', TO)
+        self.assertEqual(exit_code, 0, output)
+        self.assert_day_outputs()
+
+        expected_subjects = sorted(f"New Students Created for {building_name} on {date}"
+                                   for date, counts in self.expected.items() for building_name in counts)
+        self.assertEqual(sorted(message['subject'] for message in sent), expected_subjects)
+        for message in sent:
+            self.assertEqual(len(message['attachments']), 1)
+        self.assertIn(f"Catch up finished, {len(DAYS)} day(s) with new students", output)
+
+        # Everything was delivered: a second catch-up has nothing to do
+        exit_code, output, sent = run_script.run(self.workspace, '--from', FROM, '--to', TO)
+        self.assertEqual(exit_code, 0, output)
+        self.assertEqual(sent, [])
+
+    def test_merge_days_sends_one_digest_per_building(self):
+        exit_code, output, sent = run_script.run(self.workspace, '--from', FROM, '--to', TO, '--merge_days')
+        self.assertEqual(exit_code, 0, output)
+        self.assert_day_outputs()
+
+        buildings = {building_name for counts in self.expected.values() for building_name in counts}
+        self.assertEqual(len(sent), len(buildings))
+        for building_name in buildings:
+            dates = [date for date, counts in self.expected.items() if building_name in counts]
+            span = dates[0] if len(dates) == 1 else f"{dates[0]} to {dates[-1]}"
+            message, = [message for message in sent if message['subject'] == f"New Students Created for {building_name} on {span}"]
+            self.assertEqual(message['attachments'],
+                             [f"{date}_{partition.output_file_name(building_name)}" for date in dates])
+
+    def test_workers_send_the_notifications_concurrently(self):
+        # Gmail sends take 100 ms and the rate limit is out of the way: only the send threads matter
+        settings = [('email', 'sendRate', '1000')]
+        timings = {}
+        for workers in (1, 4):
+            workspace = self.make_workspace(workers, settings)
+            exit_code, output, sent = run_script.run(workspace, '--from', FROM, '--to', TO, latency=0.1)
+            self.assertEqual(exit_code, 0, output)
+            self.assertEqual(len(sent), sum(len(counts) for counts in self.expected.values()))
+            timings[workers] = self.send_seconds(workspace)
+        self.assertLess(timings[4], timings[1] / 2, timings)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+#
+#   Description: Tests of digest mode (--digest): the grouping of building notifications by recipient
+#                (group_by_recipients) and an end to end run checking who receives which building file
+#
+
+import os, sys, csv, runpy, shutil, datetime, tempfile, unittest
+from collections import Counter
+from configparser import ConfigParser
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TESTS)
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks'), TESTS]
+
+import roster, run_script
+from lib import buildings, partition
+
+# The script's functions, without running it
+script = runpy.run_path(os.path.join(ROOT, 'update-students.py'), run_name='update_students')
+group_by_recipients = script['group_by_recipients']
+
+DATE = '10-03-2026'
+
+
+def notification(building, recipient, cc='admin@ohlsd.org'):
+    return {"date": DATE, "building": building, "recipient": recipient, "cc": cc}
+
+
+def addresses(value):
+    return sorted(buildings.address_of(recipient) for recipient in buildings.parse_recipients(value)[0])
+
+
+class GroupByRecipientsTest(unittest.TestCase):
+
+    def assert_emails(self, notifications, expected):
+        self.assertCountEqual(self.group(notifications), expected)
+
+    def group(self, notifications):
+        return [(addresses(to), addresses(cc), [notification["building"] for notification in group])
+                for to, cc, group in group_by_recipients(notifications)]
+
+    def test_shared_staff_get_one_email(self):
+        self.assert_emails([notification('A', 'a@ohlsd.org, Shared <shared@ohlsd.org>'),
+                            notification('B', 'b@ohlsd.org, SHARED@ohlsd.org')],
+                           [(['shared@ohlsd.org'], ['admin@ohlsd.org'], ['A', 'B']),
+                            (['a@ohlsd.org'], [], ['A']),
+                            (['b@ohlsd.org'], [], ['B'])])
+
+    def test_cc_only_group_is_sent_to_its_cc(self):
+        self.assert_emails([notification('A', 'a@ohlsd.org'), notification('B', 'b@ohlsd.org')],
+                           [(['admin@ohlsd.org'], [], ['A', 'B']),
+                            (['a@ohlsd.org'], [], ['A']),
+                            (['b@ohlsd.org'], [], ['B'])])
+
+    def test_address_in_to_anywhere_stays_in_to(self):
+        # admin is To on A and Cc on B
+        self.assert_emails([notification('A', 'a@ohlsd.org, admin@ohlsd.org', cc=''), notification('B', 'a@ohlsd.org')],
+                           [(['a@ohlsd.org', 'admin@ohlsd.org'], [], ['A', 'B'])])
+
+    def test_single_building_is_one_email(self):
+        self.assert_emails([notification('A', 'a@ohlsd.org, a2@ohlsd.org')],
+                           [(['a2@ohlsd.org', 'a@ohlsd.org'], ['admin@ohlsd.org'], ['A'])])
+
+
+class DigestRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp(prefix='digest-test-')
+        self.addCleanup(shutil.rmtree, self.workspace, ignore_errors=True)
+        run_script.make_workspace(self.workspace, [('email', 'digest', 'no')])
+        # A plain run exports today's folder
+        today = datetime.date.today().strftime("%m-%d-%Y")
+        path = roster.write_roster(os.path.join(self.workspace, 'data', today, 'StudentCreated.csv'), 300, seed=3)
+
+        config_file = os.path.join(self.workspace, 'config', 'update-students.ini')
+        directory = buildings.BuildingDirectory.load(config_file)
+        config = ConfigParser(interpolation=None)
+        config.read(config_file)
+        admins = addresses(config.get('admin', 'adminEmail'))
+        with open(path, newline='', encoding='utf-8') as f:
+            self.buildings = {row['School Name'] for row in csv.DictReader(f) if directory.get(row['School Name'])}
+        # Address -> building files it must receive, each exactly once
+        self.expected = {}
+        for name in self.buildings:
+            for address in set(addresses(directory.recipients(name)) + admins):
+                self.expected.setdefault(address, Counter())[partition.output_file_name(name)] += 1
+
+    def run_script(self, *args):
+        exit_code, output, sent = run_script.run(self.workspace, '--force', *args)
+        self.assertEqual(exit_code, 0, output)
+        return [message for message in sent if message['subject'].startswith('New Students')]
+
+    def received(self, sent):
+        received = {}
+        for message in sent:
+            for address in addresses(f"{message['to']},{message['cc']}"):
+                received.setdefault(address, Counter()).update(message['attachments'])
+        return received
+
+    def test_every_recipient_gets_each_of_their_buildings_once(self):
+        per_building = self.run_script()
+        self.assertEqual(len(per_building), len(self.buildings))
+        self.assertEqual(self.received(per_building), self.expected)
+
+        digests = self.run_script('--digest')
+        self.assertEqual(self.received(digests), self.expected)
+        # One email per distinct set of buildings received
+        self.assertEqual(len(digests), len({frozenset(files) for files in self.expected.values()}))
+        self.assertLess(sum(len(addresses(f"{message['to']},{message['cc']}")) for message in digests),
+                        sum(len(addresses(f"{message['to']},{message['cc']}")) for message in per_building))
+
+
+if __name__ == "__main__":
+    unittest.main()
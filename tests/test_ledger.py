@@ -0,0 +1,107 @@
+#
+#   Description: Tests of the run ledger (lib/ledger.py) and of reruns skipping what was already
+#                delivered
+#
+
+import os, csv, sys, shutil, datetime, tempfile, unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(TESTS), os.path.join(os.path.dirname(TESTS), 'benchmarks'), TESTS]
+
+import roster, run_script
+from lib import ledger
+
+
+DATE = '10-03-2026'
+
+
+class RunLedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='ledger-test-')
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.ledger = self.open()
+
+    def open(self):
+        run_ledger = ledger.RunLedger(os.path.join(self.folder, 'logs', 'update-students.db'))
+        self.addCleanup(run_ledger.close)
+        return run_ledger
+
+    def test_file_hash(self):
+        path = os.path.join(self.folder, 'StudentCreated.csv')
+        with open(path, 'wb') as f:
+            f.write(b'Student ID\n1001\n')
+        before = ledger.file_hash(path)
+        self.assertEqual(before, ledger.file_hash(path, chunk_size=3))
+        with open(path, 'ab') as f:
+            f.write(b'1002\n')
+        self.assertNotEqual(ledger.file_hash(path), before)
+
+    def test_unknown_export_is_processed(self):
+        self.assertFalse(self.ledger.source_unchanged(DATE, 'abc'))
+        self.assertFalse(self.ledger.already_sent(DATE, 'Test Dummy School', 'h1'))
+
+    def test_export_is_skipped_once_every_building_was_sent(self):
+        self.ledger.record_source(DATE, 'StudentCreated.csv', 'abc')
+        self.ledger.record_notification(DATE, 'Test Dummy School', 'h1', 'sent')
+        self.ledger.record_notification(DATE, 'Oak Hills High School', 'h2', 'failed', 'HttpError 503')
+        self.assertFalse(self.ledger.source_unchanged(DATE, 'abc'))
+
+        self.ledger.record_notification(DATE, 'Oak Hills High School', 'h2', 'sent')
+        self.assertTrue(self.ledger.source_unchanged(DATE, 'abc'))
+        # A changed export is processed again
+        self.assertFalse(self.ledger.source_unchanged(DATE, 'abd'))
+        self.assertFalse(self.ledger.source_unchanged('10-04-2026', 'abc'))
+
+    def test_building_is_skipped_only_when_sent_with_the_same_file(self):
+        self.ledger.record_notification(DATE, 'Test Dummy School', 'h1', 'failed', 'timed out')
+        self.assertFalse(self.ledger.already_sent(DATE, 'Test Dummy School', 'h1'))
+        self.ledger.record_notification(DATE, 'Test Dummy School', 'h1', 'sent')
+        self.assertTrue(self.ledger.already_sent(DATE, 'Test Dummy School', 'h1'))
+        self.assertFalse(self.ledger.already_sent(DATE, 'Test Dummy School', 'h2'))
+        self.assertFalse(self.ledger.already_sent('10-04-2026', 'Test Dummy School', 'h1'))
+
+    def test_ledger_is_kept_between_runs(self):
+        self.ledger.record_source(DATE, 'StudentCreated.csv', 'abc')
+        self.ledger.record_notification(DATE, 'Test Dummy School', 'h1', 'sent')
+        self.ledger.close()
+        self.ledger = self.open()
+        self.assertTrue(self.ledger.source_unchanged(DATE, 'abc'))
+        self.assertTrue(self.ledger.already_sent(DATE, 'Test Dummy School', 'h1'))
+
+
+class RerunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp(prefix='ledger-test-')
+        self.addCleanup(shutil.rmtree, self.workspace, ignore_errors=True)
+        run_script.make_workspace(self.workspace, [('email', 'digest', 'no')])
+        today = datetime.date.today().strftime("%m-%d-%Y")
+        self.export = roster.write_roster(os.path.join(self.workspace, 'data', today, 'StudentCreated.csv'), 60, seed=5)
+
+    def subjects(self, *args):
+        exit_code, output, sent = run_script.run(self.workspace, *args)
+        self.assertEqual(exit_code, 0, output)
+        return sorted(message['subject'] for message in sent if message['subject'].startswith('New Students'))
+
+    def test_rerun_only_sends_changed_buildings(self):
+        first = self.subjects()
+        self.assertTrue(first)
+        self.assertEqual(self.subjects(), [])
+
+        # One more student for the first row's building: only that building is sent again
+        with open(self.export, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        extra = dict(rows[0], **{'Student ID': '999999', 'UserName': '36newstudent', 'Email': '36newstudent@ohlsd.org'})
+        with open(self.export, 'a', newline='', encoding='utf-8') as f:
+            csv.DictWriter(f, list(rows[0])).writerow(extra)
+        changed = [subject for subject in first if f" for {rows[0]['School Name']} on " in subject]
+        self.assertEqual(len(changed), 1)
+        self.assertEqual(self.subjects(), changed)
+
+        # --force ignores the ledger
+        self.assertEqual(self.subjects('--force'), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
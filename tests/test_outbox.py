@@ -0,0 +1,211 @@
+#
+#   Description: Tests of lib/outbox.py against a scripted Gmail stand-in that, like the real client
+#                with the gmail.send scope, can only send
+#
+
+import os, re, sys, base64, shutil, tempfile, threading, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import outbox
+
+
+class Response(object):
+    def __init__(self, status):
+        self.status = status
+
+
+class HttpError(Exception):
+    """Has the resp.status of googleapiclient.errors.HttpError."""
+
+    def __init__(self, status):
+        super().__init__(f"<HttpError {status}>")
+        self.resp = Response(status)
+
+
+TIMEOUT = 'timeout'
+
+
+class ScriptedGmail(object):
+    """Answers each send with the next outcome of a script: 'ok', TIMEOUT (delivered, answer lost),
+    'drop' (not delivered, no answer) or an HTTP status. Sends past the end of the script succeed."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = []
+        self.delivered = []
+        self._lock = threading.Lock()
+
+    def outcome(self, message_id):
+        return self.script.pop(0) if self.script else 'ok'
+
+    def send(self, user_id, message):
+        data = base64.urlsafe_b64decode(message.raw()['raw'])
+        message_id = re.search(rb'^Message-ID: (\S+)', data, re.MULTILINE).group(1).decode()
+        with self._lock:
+            outcome = self.outcome(message_id)
+            self.calls.append(message_id)
+            if outcome in ('ok', TIMEOUT):
+                self.delivered.append(message_id)
+        if outcome == 'ok':
+            return ('success', {'id': f"gmail{len(self.calls)}"})
+        if outcome in (TIMEOUT, 'drop'):
+            return ('failed', "Email notification failed, timed out")
+        return ('failed', HttpError(outcome))
+
+
+class FirstAttemptFails(ScriptedGmail):
+    """Answers the first send of each Message-ID with a 503 and every later one with 'ok'."""
+
+    def outcome(self, message_id):
+        return 'ok' if message_id in self.calls else 503
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+class OutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='outbox-test-')
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.clock = Clock()
+        self.outbox = self.open()
+
+    def open(self):
+        box = outbox.Outbox(os.path.join(self.folder, 'outbox.db'))
+        self.addCleanup(box.close)
+        return box
+
+    def put(self, key='notify/10-03-2026/TDS/abc'):
+        body = f"To: secretary@example.org\r\nSubject: {key}\r\n\r\nNew students\r\n".encode()
+        return self.outbox.put(key, {'raw': base64.urlsafe_b64encode(body).decode()}, meta={'key': key})
+
+    def drain(self, client, **options):
+        options = dict(dict(retries=2, backoff=0, rate=0, max_attempts=3, retry_delay=60, clock=self.clock), **options)
+        return self.outbox.drain(client=client, **options)
+
+    def status(self, key='notify/10-03-2026/TDS/abc'):
+        return self.outbox.entry(key)['status']
+
+    def test_server_errors_are_retried_in_place(self):
+        self.put()
+        gmail = ScriptedGmail(503, 429, 'ok')
+        results = self.drain(gmail)
+        self.assertEqual(results['notify/10-03-2026/TDS/abc'][0], 'success')
+        self.assertEqual(len(gmail.calls), 3)
+        self.assertEqual(self.status(), outbox.SENT)
+        self.assertEqual(self.outbox.counts(), {outbox.SENT: 1})
+
+    def test_failed_message_is_rescheduled_with_backoff(self):
+        self.put()
+        gmail = ScriptedGmail(503, 503, 503)
+        self.assertEqual(self.drain(gmail)['notify/10-03-2026/TDS/abc'][0], 'failed')
+        self.assertEqual(self.status(), outbox.PENDING)
+
+        # Not due before the retry delay, due after it
+        self.assertEqual(self.outbox.due(self.clock.now), 0)
+        self.assertEqual(self.drain(gmail), {})
+        self.clock.now += 60 * 1.5
+        self.assertEqual(self.outbox.due(self.clock.now), 1)
+
+        results = self.drain(gmail)
+        self.assertEqual(results['notify/10-03-2026/TDS/abc'][0], 'success')
+        self.assertEqual(results['notify/10-03-2026/TDS/abc'][2], 2)
+        self.assertEqual(self.status(), outbox.SENT)
+        self.assertEqual(len(gmail.delivered), 1)
+
+    def test_message_is_dead_after_max_attempts(self):
+        self.put()
+        gmail = ScriptedGmail(*[503] * 9)
+        for attempt in range(3):
+            self.drain(gmail)
+            self.clock.now += 10 ** 6
+        self.assertEqual(self.status(), outbox.DEAD)
+        self.assertEqual(self.outbox.entry('notify/10-03-2026/TDS/abc')['attempts'], 3)
+        self.assertEqual(self.drain(gmail), {})
+        self.assertEqual(len(gmail.calls), 9)
+        # Only the row is kept, the message and its building file are not
+        self.assertEqual(os.listdir(self.outbox.folder), [])
+
+    def test_rejected_message_is_dead_at_once(self):
+        self.put()
+        gmail = ScriptedGmail(400)
+        self.drain(gmail)
+        self.assertEqual(self.status(), outbox.DEAD)
+        self.assertEqual(len(gmail.calls), 1)
+        self.assertEqual(os.listdir(self.outbox.folder), [])
+        self.assertIn('400', self.outbox.entry('notify/10-03-2026/TDS/abc')['last_error'])
+
+    @unittest.skipIf(os.name == 'nt', "POSIX permissions")
+    def test_spooled_messages_are_private(self):
+        self.put()
+        self.assertEqual(os.stat(self.outbox.folder).st_mode & 0o777, 0o700)
+        spooled, = os.listdir(self.outbox.folder)
+        self.assertEqual(os.stat(os.path.join(self.outbox.folder, spooled)).st_mode & 0o777, 0o600)
+
+    def test_unanswered_send_is_resent_with_the_same_message_id(self):
+        self.put()
+        gmail = ScriptedGmail(TIMEOUT, 'ok')
+        self.drain(gmail)
+        self.assertEqual(self.status(), outbox.UNCONFIRMED)
+        self.clock.now += 10 ** 6
+        self.drain(gmail)
+        self.assertEqual(self.status(), outbox.SENT)
+        self.assertEqual(len(gmail.calls), 2)
+        self.assertEqual(gmail.calls[0], gmail.calls[1])
+
+    def test_unanswered_sends_are_given_up_after_max_attempts(self):
+        self.put()
+        gmail = ScriptedGmail(*['drop'] * 5)
+        for attempt in range(5):
+            self.drain(gmail)
+            self.clock.now += 10 ** 6
+        self.assertEqual(self.status(), outbox.DEAD)
+        self.assertEqual(len(gmail.calls), 3)
+
+    def test_crash_mid_send_is_resent_once(self):
+        self.put()
+        claimed = self.outbox._claim(self.clock.now)
+        self.assertEqual(self.status(), outbox.SENDING)
+        self.outbox.close()
+
+        # The next run finds the message it was sending when it stopped
+        self.outbox = self.open()
+        self.assertEqual(self.status(), outbox.UNCONFIRMED)
+        gmail = ScriptedGmail()
+        self.drain(gmail)
+        self.assertEqual(self.status(), outbox.SENT)
+        self.assertEqual(gmail.calls, [claimed[0]['message_id']])
+
+    def test_same_key_is_never_sent_twice(self):
+        self.assertIsNone(self.put())
+        self.assertEqual(self.put(), outbox.PENDING)
+        gmail = ScriptedGmail()
+        self.drain(gmail)
+        self.assertEqual(self.put(), outbox.SENT)
+        self.clock.now += 10 ** 6
+        self.assertEqual(self.drain(gmail), {})
+        self.assertEqual(len(gmail.delivered), 1)
+        self.assertEqual(os.listdir(self.outbox.folder), [])
+
+    def test_several_workers_send_each_message_once(self):
+        keys = [f"notify/10-03-2026/B{index}/abc" for index in range(20)]
+        for key in keys:
+            self.put(key)
+        gmail = FirstAttemptFails()
+        results = self.drain(gmail, workers=4)
+        self.assertEqual(sorted(results), sorted(keys))
+        self.assertTrue(all(result[0] == 'success' for result in results.values()))
+        self.assertEqual(len(gmail.calls), 40)
+        self.assertEqual(len(set(gmail.calls)), 20)
+        self.assertEqual(sorted(gmail.delivered), sorted(set(gmail.calls)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+#
+#   Description: Tests of the memory mapped word list and the password generator (lib/passwords.py),
+#                and of a bulk reset whose word list has no word the password policy accepts
+#
+
+import os, sys, shutil, tempfile, unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(TESTS), os.path.join(os.path.dirname(TESTS), 'benchmarks'), TESTS]
+
+import run_script
+from lib import passwords
+
+
+class WordListTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='passwords-test-')
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.path = os.path.join(self.folder, 'WL.txt')
+
+    def write(self, data: bytes):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def open(self, index_file=None):
+        word_list = passwords.WordList(self.path, index_file)
+        self.addCleanup(word_list.close)
+        return word_list
+
+    def test_words_are_read_through_the_index(self):
+        self.write(b'\xef\xbb\xbfmaple\r\n\r\ncedar\n  birch  \nwillow')
+        word_list = self.open()
+        self.assertEqual([word_list.word(index) for index in range(len(word_list))], ['maple', 'cedar', 'birch', 'willow'])
+        self.assertIn(word_list.random_word(), {'maple', 'cedar', 'birch', 'willow'})
+
+    def test_index_is_cached_until_the_word_list_changes(self):
+        self.write(b'maple\ncedar\n')
+        self.assertEqual(len(self.open()), 2)
+        self.assertTrue(os.path.exists(f"{self.path}.idx"))
+
+        # A cached index is used as is, without scanning the file again
+        cached = passwords.WordList.build_index
+        passwords.WordList.build_index = lambda word_list: self.fail("index rebuilt")
+        try:
+            self.assertEqual(len(self.open()), 2)
+        finally:
+            passwords.WordList.build_index = cached
+
+        self.write(b'maple\ncedar\nbirch\n')
+        os.utime(self.path, ns=(os.stat(self.path).st_mtime_ns + 10 ** 9,) * 2)
+        self.assertEqual(len(self.open()), 3)
+
+    def test_index_can_stay_in_memory(self):
+        self.write(b'maple\n')
+        self.assertEqual(len(self.open(index_file=False)), 1)
+        self.assertFalse(os.path.exists(f"{self.path}.idx"))
+
+    def test_unusable_word_lists_are_refused(self):
+        for data, message in ((b'', 'is empty'), (b'\n\r\n\n', 'has no words'),
+                              ('maple\n'.encode('utf-16'), 'UTF-16')):
+            self.write(data)
+            with self.assertRaisesRegex(ValueError, message):
+                passwords.WordList(self.path, index_file=False)
+
+
+class PasswordGeneratorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='passwords-test-')
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+
+    def generator(self, words, **policy):
+        path = os.path.join(self.folder, 'WL.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(words))
+        generator = passwords.PasswordGenerator(passwords.WordList(path, False), passwords.PasswordPolicy(**policy))
+        self.addCleanup(generator.close)
+        return generator
+
+    def test_password_is_an_accepted_word_and_digits(self):
+        generator = self.generator(['ox', 'maple', 'extraordinarily', 'dumbbell', 'o-k'], banned=['dumb'], capitalize=True)
+        for _ in range(50):
+            password = generator.generate()
+            self.assertRegex(password, r'^Maple[1-9]\d\d$')
+
+    def test_no_accepted_word_raises(self):
+        generator = self.generator(['extraordinarily', 'incomprehensible'], max_word_length=10)
+        with self.assertRaisesRegex(ValueError, 'matches the password policy'):
+            generator.generate()
+
+    def test_no_word_list_gives_random_passwords(self):
+        generator = passwords.get_generator(os.path.join(self.folder, 'missing.txt'), passwords.PasswordPolicy(fallback_length=16))
+        password = generator.generate()
+        self.assertEqual(len(password), 16)
+        self.assertTrue(set(password) <= set(passwords.FALLBACK_CHARACTERS))
+
+
+class BulkResetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp(prefix='bulk-reset-test-')
+        self.addCleanup(shutil.rmtree, self.workspace, ignore_errors=True)
+        word_list = os.path.join(self.workspace, 'WL.txt')
+        with open(word_list, 'w', encoding='utf-8') as f:
+            f.write('extraordinarily\nincomprehensible\n')
+        run_script.make_workspace(self.workspace, [('general', 'wordListFile', word_list)])
+        self.reset_file = os.path.join(self.workspace, 'resets.csv')
+        with open(self.reset_file, 'w', encoding='utf-8') as f:
+            f.write('username,building\n36janedoe,TDS\n36johnroe,TDS\n')
+
+    def test_policy_that_no_word_meets_is_reported(self):
+        exit_code, output, sent = run_script.run(self.workspace, '--bulk_reset', self.reset_file)
+        self.assertEqual(exit_code, 0, output)
+        self.assertEqual([message['subject'] for message in sent], ["Bulk Password Reset Failed for 2 student(s)"])
+        self.assertIn("Bulk password reset finished, 0 succeeded, 2 failed", output)
+
+    def test_passwords_are_reset_when_the_policy_allows(self):
+        with open(os.path.join(self.workspace, 'WL.txt'), 'a', encoding='utf-8') as f:
+            f.write('maple\n')
+        exit_code, output, sent = run_script.run(self.workspace, '--bulk_reset', self.reset_file)
+        self.assertEqual(exit_code, 0, output)
+        self.assertEqual([message['subject'] for message in sent],
+                         ["Password Reset Notification for 2 student(s) at Test Dummy School"])
+
+
+if __name__ == "__main__":
+    unittest.main()
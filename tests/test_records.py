@@ -0,0 +1,109 @@
+#
+#   Description: Tests of the export records and of the validation stage that sets aside the rows
+#                that must not reach a building file (lib/records.py)
+#
+
+import os, csv, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import records
+from lib.buildings import Building, BuildingDirectory
+
+
+DIRECTORY = BuildingDirectory([Building('Test Dummy School', 'TDS', ['secretary@ohlsd.org']),
+                               Building('Oak Hills High School', 'OHHS', ['office@ohlsd.org'])])
+
+
+def student(student_id='1001', first='Jane', last='Doe', email='36janedoe@ohlsd.org', school='Test Dummy School',
+            grade='09', username='36janedoe', password='Word123', middle=''):
+    return {'Student ID': student_id, 'First Name': first, 'Middle Name': middle, 'Last Name': last,
+            'Email': email, 'School Name': school, 'Current Grade': grade, 'Status': 'A',
+            'UserName': username, 'Password': password}
+
+
+class RecordValidatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='records-test-')
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+
+    def validate(self, rows, **options):
+        path = os.path.join(self.folder, 'StudentCreated.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, records.HEADERS)
+            writer.writeheader()
+            writer.writerows(rows)
+        rejects = records.RejectReport(os.path.join(self.folder, 'rejects.csv'), records.HEADERS)
+        self.addCleanup(rejects.close)
+        kept = list(records.RecordValidator(DIRECTORY, **options).validate(records.read_records(path), rejects))
+        return kept, rejects
+
+    def test_fields_are_normalized(self):
+        kept, rejects = self.validate([student(first='  Mary  Ann ', middle=' ', email=' 36JaneDoe@OHLSD.org ',
+                                               school='test dummy  school', grade='k', password=' Word123 ')])
+        record, = kept
+        self.assertEqual(record.first_name, 'Mary Ann')
+        self.assertEqual(record.middle_name, '')
+        self.assertEqual(record.email, '36janedoe@ohlsd.org')
+        self.assertEqual(record.school, 'Test Dummy School')
+        self.assertEqual(record.grade, 'K')
+        # The password is kept exactly as exported
+        self.assertEqual(record.password, ' Word123 ')
+        self.assertEqual(rejects.count, 0)
+
+    def test_invalid_rows_are_rejected(self):
+        kept, rejects = self.validate([
+            student(student_id=''),
+            student(student_id='1002', email='not-an-email'),
+            student(student_id='1003', email='someone@ohlsd.org'),
+            student(student_id='1004', school='Nowhere Academy'),
+            student(student_id='1005', grade=''),
+            student(student_id='1006'),
+        ], require_grade=True)
+        self.assertEqual([record.student_id for record in kept], ['1006'])
+        self.assertEqual(rejects.reasons, {'missing Student ID': 1, 'invalid email': 1,
+                                           'email does not match UserName': 1, 'unknown building': 1,
+                                           'missing grade': 1})
+
+    def test_duplicate_student_id_keeps_the_first_row(self):
+        kept, rejects = self.validate([student(), student(), student(first='Janet')])
+        self.assertEqual([record.line for record in kept], [2])
+        self.assertEqual(rejects.reasons, {'duplicate Student ID': 2})
+        self.assertEqual(rejects.examples, ["line 3: duplicate Student ID (1001 first on line 2, same row)",
+                                            "line 4: duplicate Student ID (1001 first on line 2, different data)"])
+
+    def test_rejected_row_does_not_hold_its_student_id(self):
+        # The first row for the student is invalid, the corrected one after it must be kept
+        kept, rejects = self.validate([student(email='36janedoe@ohlsd'), student(), student()])
+        self.assertEqual([record.line for record in kept], [3])
+        self.assertEqual(rejects.reasons, {'invalid email': 1, 'duplicate Student ID': 1})
+        self.assertIn("line 4: duplicate Student ID (1001 first on line 3, same row)", rejects.examples)
+
+    def test_unknown_buildings_can_be_kept(self):
+        kept, rejects = self.validate([student(school=' Nowhere   Academy ')], reject_unknown_buildings=False)
+        self.assertEqual(kept[0].school, 'Nowhere Academy')
+        self.assertEqual(rejects.count, 0)
+
+    def test_rejects_are_written_to_the_report(self):
+        kept, rejects = self.validate([student(), student(student_id='1002', email='bad')], batch_size=1)
+        rejects.close()
+        with open(rejects.path, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['Line'], rows[0]['Reason'], rows[0]['Detail']), ('3', 'invalid email', 'bad'))
+        self.assertEqual(rows[0]['Student ID'], '1002')
+        self.assertEqual(rejects.summary(), "1 invalid email")
+
+    def test_row_with_extra_fields_is_rejected(self):
+        path = os.path.join(self.folder, 'StudentCreated.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            f.write(','.join(records.HEADERS) + '\n')
+            f.write(','.join(student().values()) + ',Smith\n')
+        validator = records.RecordValidator(DIRECTORY)
+        record, = records.read_records(path)
+        self.assertEqual(validator.check(record), ("extra fields", "1 value(s) after the last column"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+#
+#   Description: Tests of the reset queue's duplicate merging (lib/reset_service.py) and of the
+#                PowerShell session timeout (lib/reset_session.py), with the stub reset script
+#
+
+import os, sys, time, unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib import reset_service, reset_session
+
+
+STUB = [sys.executable, os.path.join(ROOT, 'benchmarks', 'stub_reset_password.py'), '-serve', '--startup-delay', '0']
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ResetQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.handled = []
+
+    def start(self, handle):
+        reset_queue = reset_service.ResetQueue(handle, workers=1, dedupe_window=60.0, clock=self.clock).start()
+        self.addCleanup(reset_queue.stop, 5)
+        return reset_queue
+
+    def reset(self, username, building):
+        self.handled.append(username)
+        status = 'Failed' if username.startswith('missing') else 'success'
+        return reset_session.ResetResult(username, building, status=status)
+
+    def finish(self, job):
+        self.assertTrue(job.done.wait(5))
+        return job
+
+    def test_successful_job_answers_repeats_within_the_window(self):
+        reset_queue = self.start(self.reset)
+        job, duplicate = reset_queue.submit('36luicrooks', 'TDS')
+        self.assertFalse(duplicate)
+        self.assertEqual(self.finish(job).status, reset_service.SUCCESS)
+
+        again, duplicate = reset_queue.submit('36LuiCrooks', 'TDS')
+        self.assertTrue(duplicate)
+        self.assertIs(again, job)
+
+        self.clock.now += 61
+        later, duplicate = reset_queue.submit('36luicrooks', 'TDS')
+        self.assertFalse(duplicate)
+        self.finish(later)
+        self.assertEqual(self.handled, ['36luicrooks', '36luicrooks'])
+
+    def test_failed_job_is_retried_at_once(self):
+        reset_queue = self.start(self.reset)
+        job, _ = reset_queue.submit('missing01', 'TDS')
+        self.assertEqual(self.finish(job).status, reset_service.FAILED)
+
+        retry, duplicate = reset_queue.submit('missing01', 'TDS')
+        self.assertFalse(duplicate)
+        self.assertIsNot(retry, job)
+        self.finish(retry)
+        self.assertEqual(self.handled, ['missing01', 'missing01'])
+
+    def test_queued_job_answers_repeats(self):
+        release = reset_service.threading.Event()
+
+        def slow_reset(username, building):
+            release.wait(5)
+            return self.reset(username, building)
+
+        reset_queue = self.start(slow_reset)
+        job, _ = reset_queue.submit('36luicrooks', 'TDS')
+        again, duplicate = reset_queue.submit('36luicrooks', 'TDS')
+        self.assertTrue(duplicate)
+        self.assertIs(again, job)
+        release.set()
+        self.finish(job)
+        self.assertEqual(self.handled, ['36luicrooks'])
+
+
+class PowerShellSessionTest(unittest.TestCase):
+
+    def test_answers_keep_display_name_and_password_apart(self):
+        with reset_session.PowerShellSession(STUB, timeout=10) as session:
+            result = session.reset('36luicrooks', 'TDS')
+            self.assertTrue(result.ok, result.error)
+            self.assertEqual(result.display_name, 'Student, 36Luicrooks')
+            self.assertEqual(session.reset('36luicrooks', 'TDS', password='Given123').password, 'Given123')
+
+    def test_session_that_does_not_answer_is_killed(self):
+        session = reset_session.PowerShellSession(STUB + ['--reset-delay', '30'], timeout=0.5)
+        started = time.monotonic()
+        result = session.reset('36luicrooks', 'TDS')
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertFalse(result.ok)
+        self.assertIn('did not answer', result.error)
+        self.assertIsNone(session.process)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+#
+#   Description: Tests of the long lived GmailClient (lib/send_email.py) over googleapiclient's
+#                HttpMockSequence: one client serving many sends, per thread transports and root_url
+#
+
+import os, sys, json, threading, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import send_email
+
+try:
+    from googleapiclient.http import HttpMockSequence
+except ImportError:
+    HttpMockSequence = None
+
+
+def answers(*statuses):
+    return [({'status': str(status)}, json.dumps({'id': f"gmail{index}"} if status == 200 else
+                                                 {'error': {'code': status, 'message': 'Backend Error'}}))
+            for index, status in enumerate(statuses)]
+
+
+class RecordingHttp(HttpMockSequence or object):
+    """HttpMockSequence that also records the URI of every request."""
+
+    def __init__(self, iterable):
+        super().__init__(iterable)
+        self.uris = []
+        self.threads = set()
+
+    def request(self, uri, *args, **kwargs):
+        self.uris.append(uri)
+        self.threads.add(threading.get_ident())
+        return super().request(uri, *args, **kwargs)
+
+
+@unittest.skipIf(HttpMockSequence is None, "googleapiclient is not installed")
+class GmailClientTest(unittest.TestCase):
+
+    def message(self, index=0):
+        return send_email.CreateMessage('uasa@ohlsd.org', 'secretary@ohlsd.org', f"Test {index}", 'New students')
+
+    def test_one_client_serves_several_sends(self):
+        http = RecordingHttp(answers(200, 200, 200))
+        client = send_email.GmailClient(http=http)
+        service = client.service()
+
+        results = [client.send('me', self.message(index)) for index in range(3)]
+        self.assertEqual([result[0] for result in results], ['success'] * 3)
+        self.assertEqual([result[1]['id'] for result in results], ['gmail0', 'gmail1', 'gmail2'])
+        # The service is built once and no credentials are loaded for a given transport
+        self.assertIs(client.service(), service)
+        self.assertIsNone(client.creds)
+        self.assertEqual(client.sent, 3)
+        self.assertEqual(len(http.uris), 3)
+        self.assertTrue(all(uri.startswith('https://gmail.googleapis.com/gmail/v1/users/me/messages/send')
+                            for uri in http.uris))
+
+    def test_http_error_is_returned(self):
+        client = send_email.GmailClient(http=RecordingHttp(answers(503)))
+        status, error = client.send('me', self.message())
+        self.assertEqual(status, 'failed')
+        self.assertEqual(error.resp.status, 503)
+        self.assertEqual(client.sent, 0)
+
+    def test_each_thread_sends_over_its_own_transport(self):
+        transports = []
+        lock = threading.Lock()
+
+        def http_factory():
+            http = RecordingHttp(answers(200, 200))
+            with lock:
+                transports.append(http)
+            return http
+
+        client = send_email.GmailClient(http_factory=http_factory)
+        barrier = threading.Barrier(3)
+        results = []
+
+        def send_two():
+            barrier.wait()
+            for index in range(2):
+                results.append(client.send('me', self.message(index)))
+
+        threads = [threading.Thread(target=send_two) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([result[0] for result in results], ['success'] * 6)
+        self.assertEqual(client.sent, 6)
+        # The service is shared; one transport per sending thread, each only used by that thread
+        self.assertEqual(len(transports), 3)
+        for http in transports:
+            self.assertEqual(len(http.uris), 2)
+            self.assertEqual(len(http.threads), 1)
+
+    def test_root_url_points_the_client_at_another_endpoint(self):
+        http = RecordingHttp(answers(200))
+        client = send_email.GmailClient(http=http, root_url='http://127.0.0.1:8089/')
+        self.assertEqual(client.send('me', self.message())[0], 'success')
+        self.assertTrue(http.uris[0].startswith('http://127.0.0.1:8089/gmail/v1/users/me/messages/send'), http.uris[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+#
+#   Description: Tests of the delta student index (lib/student_index.py): which students of an
+#                export are NEW or CHANGED across runs, and when they become part of the index
+#
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import records, student_index
+
+
+DATE, NEXT_DATE = '10-03-2026', '10-04-2026'
+
+
+def student(student_id, school='Test Dummy School', grade='09', last='Doe'):
+    return {'Student ID': student_id, 'First Name': 'Jane', 'Middle Name': '', 'Last Name': last,
+            'Email': f"{student_id}@ohlsd.org", 'School Name': school, 'Current Grade': grade, 'Status': 'A',
+            'UserName': student_id, 'Password': 'Word123'}
+
+
+class StudentIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='student-index-test-')
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.index = self.open()
+
+    def open(self):
+        index = student_index.StudentIndex(os.path.join(self.folder, 'students.db'), records.HEADERS, chunk_size=2)
+        self.addCleanup(index.close)
+        return index
+
+    def diff(self, rows, date=DATE):
+        return {row['Student ID']: row[student_index.CHANGE_COLUMN] for row in self.index.diff(rows, date)}
+
+    def test_first_run_sends_everyone_as_new(self):
+        changes = self.diff([student('1001'), student('1002'), student('1003', school='Oak Hills High School')])
+        self.assertEqual(changes, {'1001': 'NEW', '1002': 'NEW', '1003': 'NEW'})
+        # Nothing is in the index until a notification is delivered
+        self.assertEqual(len(self.index), 0)
+
+    def test_delivered_students_are_only_sent_again_when_changed(self):
+        self.diff([student('1001'), student('1002'), student('1003')])
+        self.index.commit_building(DATE, 'Test Dummy School')
+        self.assertEqual(len(self.index), 3)
+
+        changes = self.diff([student('1001'), student('1002', grade='10'), student('1003', last=' Doe '),
+                             student('1004')], NEXT_DATE)
+        # Surrounding whitespace is not a change
+        self.assertEqual(changes, {'1002': 'CHANGED', '1004': 'NEW'})
+
+    def test_undelivered_building_is_sent_again(self):
+        self.diff([student('1001'), student('1002', school='Oak Hills High School')])
+        # Only Test Dummy School's notification went out
+        self.index.commit_building(DATE, 'Test Dummy School')
+
+        changes = self.diff([student('1001'), student('1002', school='Oak Hills High School')], NEXT_DATE)
+        self.assertEqual(changes, {'1002': 'NEW'})
+
+    def test_staged_students_survive_a_restart(self):
+        self.diff([student('1001'), student('1002')])
+        self.index.close()
+
+        # The notification is delivered by a later run draining the outbox
+        self.index = self.open()
+        self.index.commit_building(DATE, 'Test Dummy School')
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.diff([student('1001'), student('1002')], NEXT_DATE), {})
+
+    def test_commit_is_per_date(self):
+        self.diff([student('1001')])
+        self.index.commit_building(NEXT_DATE, 'Test Dummy School')
+        self.assertEqual(len(self.index), 0)
+        self.index.commit_building(DATE, 'Test Dummy School')
+        self.assertEqual(len(self.index), 1)
+
+    def test_student_moving_building_is_changed(self):
+        self.diff([student('1001')])
+        self.index.commit_building(DATE, 'Test Dummy School')
+        changes = self.diff([student('1001', school='Oak Hills High School')], NEXT_DATE)
+        self.assertEqual(changes, {'1001': 'CHANGED'})
+        self.index.commit_building(NEXT_DATE, 'Oak Hills High School')
+        self.assertEqual(self.diff([student('1001', school='Oak Hills High School')], '10-05-2026'), {})
+
+    def test_last_row_of_a_student_in_a_file_wins(self):
+        # The repeated row falls in the next chunk, it is still recognized as already sent
+        rows = list(self.index.diff([student('1001'), student('1001', grade='10'), student('1001', grade='10')], DATE))
+        self.assertEqual([(row['Current Grade'], row[student_index.CHANGE_COLUMN]) for row in rows],
+                         [('09', 'NEW'), ('10', 'CHANGED')])
+        self.index.commit_building(DATE, 'Test Dummy School')
+        self.assertEqual(self.diff([student('1001', grade='10')], NEXT_DATE), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
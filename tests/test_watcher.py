@@ -0,0 +1,244 @@
+#
+#   Description: Tests of lib/watcher.py against a temporary data folder, with an injected clock
+#
+
+import os, sys, json, time, shutil, signal, datetime, tempfile, threading, unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(TESTS), os.path.join(os.path.dirname(TESTS), 'benchmarks'), TESTS]
+
+import roster, run_script
+from lib import watcher
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class ExportWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_folder = tempfile.mkdtemp(prefix='watcher-test-')
+        self.addCleanup(shutil.rmtree, self.data_folder, ignore_errors=True)
+        self.clock = FakeClock()
+        self.today = datetime.date.today().strftime("%m-%d-%Y")
+        self.mtime = 1_700_000_000 * 10 ** 9
+        self.watcher = watcher.ExportWatcher(self.data_folder, settle=10.0, lookback_days=1, clock=self.clock)
+
+    def touch(self, path):
+        # Every write gets a later modification time, even on file systems with a coarse clock
+        self.mtime += 10 ** 9
+        os.utime(path, ns=(self.mtime, self.mtime))
+
+    def write_export(self, date, rows, mode='w'):
+        folder = os.path.join(self.data_folder, date)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+            self.touch(self.data_folder)
+        path = os.path.join(folder, 'StudentCreated.csv')
+        with open(path, mode, encoding='utf-8') as f:
+            if mode == 'w':
+                f.write('Student ID,First Name\n')
+            f.writelines(f"{row},Student{row}\n" for row in rows)
+        self.touch(path)
+        return path
+
+    def test_new_folder_is_found_once_settled(self):
+        self.assertEqual(self.watcher.poll(), [])
+        self.write_export(self.today, range(3))
+
+        self.assertEqual(self.watcher.poll(), [])
+        self.assertEqual(self.watcher.pending, [self.today])
+        self.clock.advance(10)
+        self.assertEqual(self.watcher.poll(), [self.today])
+
+    def test_folders_outside_lookback_are_ignored(self):
+        old = (datetime.date.today() - datetime.timedelta(days=5)).strftime("%m-%d-%Y")
+        self.write_export(old, range(3))
+        os.makedirs(os.path.join(self.data_folder, 'not-a-date'))
+        self.clock.advance(60)
+        self.assertEqual(self.watcher.poll(), [])
+        self.clock.advance(60)
+        self.assertEqual(self.watcher.poll(), [])
+
+    def test_half_written_file_is_held_until_it_settles(self):
+        path = self.write_export(self.today, range(3))
+        self.watcher.poll()
+        for batch in (range(3, 6), range(6, 9)):
+            self.clock.advance(6)
+            self.write_export(self.today, batch, mode='a')
+            # Still growing: every change restarts the settle time
+            self.assertEqual(self.watcher.poll(), [])
+
+        self.clock.advance(9)
+        self.assertEqual(self.watcher.poll(), [])
+        self.clock.advance(1)
+        self.assertEqual(self.watcher.poll(), [self.today])
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 10)
+
+    def test_empty_file_is_not_ready(self):
+        folder = os.path.join(self.data_folder, self.today)
+        os.makedirs(folder)
+        open(os.path.join(folder, 'StudentCreated.csv'), 'w').close()
+        self.watcher.poll()
+        self.clock.advance(60)
+        self.assertEqual(self.watcher.poll(), [])
+
+    def test_handled_file_is_processed_again_only_when_modified(self):
+        self.write_export(self.today, range(3))
+        self.watcher.poll()
+        self.clock.advance(10)
+        self.assertEqual(self.watcher.poll(), [self.today])
+        self.watcher.mark_handled(self.today)
+
+        self.clock.advance(60)
+        self.assertEqual(self.watcher.poll(), [])
+
+        self.write_export(self.today, range(5))
+        self.assertEqual(self.watcher.poll(), [])
+        self.clock.advance(10)
+        self.assertEqual(self.watcher.poll(), [self.today])
+
+    def test_no_settle_hands_out_at_once(self):
+        self.watcher.settle = 0
+        self.write_export(self.today, range(3))
+        self.assertEqual(self.watcher.poll(), [self.today])
+
+
+class WatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_folder = tempfile.mkdtemp(prefix='watcher-test-')
+        self.addCleanup(shutil.rmtree, self.data_folder, ignore_errors=True)
+        self.today = datetime.date.today().strftime("%m-%d-%Y")
+        os.makedirs(os.path.join(self.data_folder, self.today))
+        with open(os.path.join(self.data_folder, self.today, 'StudentCreated.csv'), 'w') as f:
+            f.write('Student ID\n1\n')
+        self.heartbeat_file = os.path.join(self.data_folder, 'logs', 'heartbeat.json')
+
+    def read_heartbeat(self):
+        with open(self.heartbeat_file, encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_heartbeat_records_processed_exports(self):
+        stop_event = threading.Event()
+        handled = []
+
+        def handle(date):
+            handled.append(date)
+            stop_event.set()
+
+        export_watcher = watcher.ExportWatcher(self.data_folder, settle=0)
+        watcher.watch(export_watcher, handle, stop_event=stop_event, poll_interval=0,
+                      heartbeat=watcher.Heartbeat(self.heartbeat_file))
+
+        self.assertEqual(handled, [self.today])
+        state = self.read_heartbeat()
+        self.assertEqual(state['status'], 'stopped')
+        self.assertEqual(state['pid'], os.getpid())
+        self.assertEqual(state['processed'], 1)
+        self.assertEqual(state['last_processed'], self.today)
+        self.assertIsNone(state['last_error'])
+        self.assertIsNone(state['current'])
+        self.assertEqual(state['pending'], [])
+        self.assertIsNotNone(state['last_poll'])
+
+    def test_heartbeat_records_failures(self):
+        stop_event = threading.Event()
+
+        def handle(date):
+            stop_event.set()
+            raise RuntimeError("export folder is locked")
+
+        export_watcher = watcher.ExportWatcher(self.data_folder, settle=0)
+        watcher.watch(export_watcher, handle, stop_event=stop_event, poll_interval=0,
+                      heartbeat=watcher.Heartbeat(self.heartbeat_file))
+
+        state = self.read_heartbeat()
+        self.assertEqual(state['processed'], 1)
+        self.assertEqual(state['last_error'], f"{self.today}: export folder is locked")
+        # A failed file is not retried until it changes
+        self.assertIn(self.today, export_watcher.handled)
+
+    def test_idle_polls_call_on_idle(self):
+        stop_event = threading.Event()
+        idle = []
+
+        def on_idle():
+            idle.append(True)
+            if len(idle) == 2:
+                stop_event.set()
+
+        export_watcher = watcher.ExportWatcher(self.data_folder, settle=0)
+        os.remove(os.path.join(self.data_folder, self.today, 'StudentCreated.csv'))
+        watcher.watch(export_watcher, lambda date: self.fail(date), stop_event=stop_event, poll_interval=0,
+                      heartbeat=watcher.Heartbeat(self.heartbeat_file), on_idle=on_idle)
+        self.assertEqual(len(idle), 2)
+        self.assertEqual(self.read_heartbeat()['processed'], 0)
+
+
+@unittest.skipIf(os.name == 'nt', "stops the watcher with SIGTERM")
+class WatchExportsTest(unittest.TestCase):
+    """update-students.py --watch must outlive an export it can't process."""
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp(prefix='watch-test-')
+        self.addCleanup(shutil.rmtree, self.workspace, ignore_errors=True)
+        self.today = datetime.date.today().strftime("%m-%d-%Y")
+        self.yesterday = (datetime.date.today() - datetime.timedelta(days=1)).strftime("%m-%d-%Y")
+        self.heartbeat_file = os.path.join(self.workspace, 'logs', 'heartbeat.json')
+
+    def watch(self, settings=()):
+        run_script.make_workspace(self.workspace, [('watch', 'pollInterval', '0.1'), ('watch', 'settleSeconds', '0'),
+                                                   ('watch', 'heartbeatFile', self.heartbeat_file),
+                                                   ('email', 'digest', 'no')] + list(settings))
+        # Yesterday's export is not UTF-8
+        os.makedirs(os.path.join(self.workspace, 'data', self.yesterday))
+        with open(os.path.join(self.workspace, 'data', self.yesterday, 'StudentCreated.csv'), 'wb') as f:
+            f.write('Student ID,First Name\n1001,Zoë\n'.encode('utf-16'))
+        roster.write_roster(os.path.join(self.workspace, 'data', self.today, 'StudentCreated.csv'), 20, seed=1)
+
+        process = run_script.start(self.workspace, '--watch')
+        try:
+            deadline = time.monotonic() + 60
+            while time.monotonic() < deadline and process.poll() is None:
+                try:
+                    with open(self.heartbeat_file, encoding='utf-8') as f:
+                        state = json.load(f)
+                except (OSError, ValueError):
+                    state = {}
+                if state.get('processed') == 2 and state.get('status') == 'watching':
+                    break
+                time.sleep(0.1)
+            self.assertIsNone(process.poll(), "the watcher stopped")
+            self.assertEqual(state['processed'], 2)
+        finally:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        exit_code, output, sent = run_script.finish(self.workspace, process)
+        self.assertEqual(exit_code, 0, output)
+        return output, sent
+
+    def test_malformed_export_does_not_stop_the_watcher(self):
+        output, sent = self.watch()
+        self.assertIn(f"Failed to process export for {self.yesterday}", output)
+        self.assertTrue(sent)
+        self.assertTrue(all(message['subject'].endswith(f" on {self.today}") for message in sent))
+
+    def test_missing_configuration_does_not_stop_the_watcher(self):
+        output, sent = self.watch([('general', 'csvFileHeaders', '')])
+        self.assertIn("CSV file headers are not configured", output)
+        self.assertIn(f"Failed to process export for {self.today}", output)
+        self.assertEqual([message for message in sent if 'New Students' in message['subject']], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,39 +4,54 @@
 #   Description: This script updates send new students data to the building secretaries
 #
 
-import os, re, pdb
-import sys
+import time
+startup_time = time.perf_counter()
+
+import os, re, hashlib
+import sys, threading
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
-import logging, argparse, datetime, csv
-from jinja2 import Environment, FileSystemLoader
-from lib import send_email
+import logging, argparse, datetime, csv, atexit
+from lib import lazy_import, send_email, partition, buildings, metrics, records, log_pipeline
+
+# Modules only needed once there is something to export, send or reset are loaded on first use
+dispatch = lazy_import.module('lib.dispatch')
+reset_session = lazy_import.module('lib.reset_session')
+passwords = lazy_import.module('lib.passwords')
+watcher = lazy_import.module('lib.watcher')
+reset_service = lazy_import.module('lib.reset_service')
+ledger = lazy_import.module('lib.ledger')
+outbox = lazy_import.module('lib.outbox')
+student_index = lazy_import.module('lib.student_index')
+email_templates = lazy_import.module('lib.email_templates')
+
+import_time = time.perf_counter() - startup_time
+
+# Email templates, compiled on first use from the 'templates' directory
+templates = None
+
+# Run ledger and delta index, opened on first use and shared by the worker threads of a run
+run_ledger = None
+students_index = None
+mail_outbox = None
+state_lock = threading.Lock()
 
-# set up the Jinja2 environment to load templates from the 'templates' directory
-env = Environment(loader=FileSystemLoader('templates'))
+# Error notifications collected during a run, one per distinct failure
+error_reports = {}
+
+
+# Building directory (short codes, names and recipients), built once at startup
+directory = None
 
 
 # Function to reset student password
-def reset_student_password(username: str, building: str):
+def reset_student_password(username: str, building: str, sessions=None):
     """
     Function to reset a student's password.
-    This function calls the PowerShell script to reset the password.
-    """
-    building_short_names = {
-        'RRMS': 'Rapid Run Middle School', 
-        'TDS': 'Test Dummy School',
-        'SPG': 'Charles W. Springmyer Elementary',
-        'OHHS': 'Oak Hills High School',
-        'JFD': 'John Foster Dulles Elementary',
-        'COH': 'C.O. Harrison Elementary',
-        'DEL': 'Delshire Elementary',
-        'OAK': 'Oakdale Elementary',
-        'BMS': 'Bridgetown Middle School',
-        'DMS': 'Delhi Middle School'
-    }
-    
+    This function calls the PowerShell script to reset the password, through one of the warm
+    sessions of serve mode when sessions (a SessionPool) is given, and returns the ResetResult.
+    """
     try:
-        import subprocess
-
         cc = adminEmail
 
 
@@ -50,30 +65,25 @@ def reset_student_password(username: str, building: str):
 
         logger.info(f"Resetting password for student: {username}")
 
-        # Call the PowerShell script with the username as an argument
-        result = subprocess.Popen(['powershell.exe', '-ExecutionPolicy', 
-                                   'Bypass', '-File', r'lib\\reset_password.ps1', 
-                                   '-username', username], stdout=subprocess.PIPE)
-        
-        # Read Information from Powershell
-        message = str(result.communicate()[0][:-2], 'utf-8')
-        logger.debug(f"PowerShell script output: {message}")
-        status, update = message.split('\r\n')
-        logger.debug(f"Status: {status}, Update: {update}")
-
-        # get building secretary email from config
-        building_name = building_short_names.get(building.upper(), None)
-        secretary_email = config.get('BuildingSecretariesEmails', building_name, fallback=adminEmail)
-
-        # remove any new line characters from the email address
-        secretary_email = [email.strip() for email in secretary_email.split(',')]
-        # join the emails back with comma separator
-        secretary_email = ','.join(secretary_email)
-        
+        # get building secretary email from the building directory
+        building_name = directory.get(building).name
+        secretary_email = directory.recipients(building_name, fallback=adminEmail)
+
+        # Call the PowerShell script with the new password on stdin, so it never shows in the process list
+        with metrics.span('reset.powershell'):
+            if sessions is not None:
+                result = sessions.reset(username, building_name, get_password_generator().generate())
+            else:
+                with reset_session.PowerShellSession() as session:
+                    result = session.reset(username, building_name, get_password_generator().generate())
+        metrics.incr('resets_ok' if result.ok else 'resets_failed')
+        update = result.error
+        logger.debug(f"Status: {result.status}, Update: {update}")
+
         # Check if the status is success
-        if status == "success":
+        if result.ok:
             logger.info(f"Password reset successfully for student: {username}")
-            displayName, password = update.split(',')
+            displayName, password = result.display_name, result.password
 
 
             # Send email notification to the building secretary
@@ -90,6 +100,7 @@ def reset_student_password(username: str, building: str):
                                     recipient=sysadmin,
                                     subject=f"Password Reset Failed for {username}",
                                     template_name='error_email_template.html')
+        return result
         
     except Exception as e:
         logger.error(f"An error occurred while resetting password: {e}")
@@ -99,167 +110,890 @@ def reset_student_password(username: str, building: str):
                                 recipient=sysadmin,
                                 subject=f"Error in Password Reset Function",
                                 template_name='error_email_template.html')
+        return reset_session.ResetResult(username, building, error=str(e))
+
+
+def serve_resets():
+    """
+    Run the local HTTP service for help-desk password resets until stopped (see lib/reset_service.py).
+    The PowerShell sessions, the word list and the Gmail client stay loaded between requests.
+    """
+    host = config.get('serve', 'host', fallback='127.0.0.1')
+    port = config.getint('serve', 'port', fallback=8765)
+    pool = reset_session.SessionPool(size=config.getint('serve', 'workers', fallback=2)).start()
+    get_password_generator()
+    # Authenticate now, so the first reset doesn't pay for it
+    try:
+        send_email.getClient().service()
+    except Exception as e:
+        logger.warning(f"Gmail client not ready, emails will be retried on the first reset: {e}")
+
+    def resolve_building(building):
+        building_record = directory.get(building)
+        return building_record.name if building_record is not None else None
+
+    def handle(username, building):
+        with log_pipeline.context(username=username, building=building):
+            return reset_student_password(username, building, pool)
+
+    reset_queue = reset_service.ResetQueue(handle, workers=len(pool.sessions),
+                                           dedupe_window=config.getfloat('serve', 'dedupeSeconds', fallback=60.0)).start()
+    server = reset_service.ResetServer((host, port), reset_queue, resolve_building,
+                                       token=config.get('serve', 'token', fallback=None),
+                                       wait_seconds=config.getfloat('serve', 'waitSeconds', fallback=30.0))
+    stop_event = threading.Event()
+    watcher.stop_on_signals(stop_event)
+    threading.Thread(target=server.serve_forever, name='reset-server', daemon=True).start()
+    logger.info(f"Serving password resets on http://{host}:{server.server_address[1]} with {len(pool.sessions)} PowerShell session(s) ...")
+
+    # Wake up every second so Ctrl+C is handled on Windows too
+    while not stop_event.wait(1.0):
+        pass
+
+    server.shutdown()
+    server.server_close()
+    reset_queue.stop()
+    pool.close()
+    logger.info(f"Stopped serving password resets, {reset_queue.counts()}")
+
+
+def get_password_generator():
+    """
+    Return the password generator for the configured word list and password policy.
+    """
+    banned = config.get('passwordReset', 'bannedWords', fallback='')
+    policy = passwords.PasswordPolicy(digits=config.getint('passwordReset', 'passwordDigits', fallback=3),
+                                      min_word_length=config.getint('passwordReset', 'minWordLength', fallback=3),
+                                      max_word_length=config.getint('passwordReset', 'maxWordLength', fallback=10),
+                                      banned=[word.strip() for word in banned.split(',')],
+                                      capitalize=config.getboolean('passwordReset', 'capitalizeWord', fallback=False))
+    return passwords.get_generator(config.get('general', 'wordListFile', fallback=None), policy,
+                                   config.get('passwordReset', 'wordListIndexFile', fallback=None) or None)
+
+
+def read_bulk_reset_file(file_path: str):
+    """
+    Read the students to reset from a CSV file.
+    The file needs a username column (username or UserName) and a building column
+    (building or School Name) holding either the building short code or its full name.
+    Returns a list of (username, building name) pairs.
+    """
+    students = []
+    with open(file_path, 'r', encoding='utf-8', newline='') as csv_file:
+        for line_number, row in enumerate(csv.DictReader(csv_file), start=2):
+            row = {str(key).strip().lower(): (value or '').strip() for key, value in row.items() if key}
+            username = row.get('username')
+            building = row.get('building') or row.get('school name') or ''
+            building_record = directory.get(building)
+            if not username or building_record is None:
+                logger.error(f"Skipping line {line_number} of {file_path}: missing username or unknown building '{building}'")
+                continue
+            students.append((username, building_record.name))
+    return students
+
+
+def bulk_reset_passwords(file_path: str):
+    """
+    Reset the passwords of every student listed in file_path through a small pool of
+    persistent PowerShell sessions, then send one notification per building listing every reset.
+    """
+    cc = adminEmail
+    students = read_bulk_reset_file(file_path)
+    if not students:
+        logger.info(f"No students to reset in {file_path}")
+        return
+
+    if args.testing:
+        # For testing purposes, simulate the bulk reset on the test user only, like a single reset
+        logger.debug(f"Simulating bulk password reset of {len(students)} student(s) on testuser")
+        students = [('testuser', directory.get('TDS').name)]
+        cc = sysadmin
+
+    logger.info(f"Resetting passwords for {len(students)} student(s) from {file_path}")
+    generator = get_password_generator()
+    resets, results = [], []
+    with metrics.span('password.generate'):
+        for username, building_name in students:
+            # A word list the policy can't draw from fails the student, not the whole run
+            try:
+                resets.append((username, building_name, generator.generate()))
+            except Exception as e:
+                results.append(reset_session.ResetResult(username, building_name, error=f"No password generated: {e}"))
+    if resets:
+        with reset_session.SessionPool(size=config.getint('passwordReset', 'sessions', fallback=2)) as pool:
+            with metrics.span('reset.powershell'):
+                results = pool.reset_many(resets) + results
+
+    resets_building = {}
+    failures = []
+    for result in results:
+        metrics.incr('resets_ok' if result.ok else 'resets_failed')
+        if result.ok:
+            logger.info(f"Password reset successfully for student: {result.username}")
+            resets_building.setdefault(result.building, []).append(
+                {"Fullname": result.display_name, "Username": result.username, "Password": result.password})
+        else:
+            logger.error(f"Failed to reset password for student {result.username}: {result.error}")
+            failures.append(f"{result.username} at {result.building}: {result.error}")
+
+    for building_name, resets in resets_building.items():
+        secretary_email = directory.recipients(building_name, fallback=adminEmail)
+        send_email_notification(data={"resets": resets, "building": building_name.upper()},
+                                recipient=secretary_email,
+                                subject=f"Password Reset Notification for {len(resets)} student(s) at {building_name}",
+                                template_name='bulk_password_reset_email_template.html',
+                                cc=cc)
+
+    if failures:
+        send_email_notification(data={"error_message": f"{len(failures)} of {len(results)} password reset(s) failed",
+                                      "error_file": "reset_password.ps1",
+                                      "other_info": failures,
+                                      "error_timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
+                                recipient=sysadmin,
+                                subject=f"Bulk Password Reset Failed for {len(failures)} student(s)",
+                                template_name='error_email_template.html')
+
+    logger.info(f"Bulk password reset finished, {len(results) - len(failures)} succeeded, {len(failures)} failed")
     
 
-def get_new_student_data():
+def get_run_ledger():
     """
-    Function to get new student data.
-    This function can be implemented to fetch new student data from a source.
+    Return the run ledger shared by every export of this run, or None when it is disabled.
+    """
+    global run_ledger
+    if args.testing or args.force:
+        return None
+    with state_lock:
+        if run_ledger is None:
+            run_ledger = ledger.RunLedger(config.get('general', 'ledgerFile', fallback=r'logs\update-students.db'))
+    return run_ledger
+
+
+def get_students_index(csv_headers: list, staged: bool = False):
+    """
+    Return the index of already notified students used in delta mode, or None when delta mode is off.
+    With staged set it is opened outside delta mode too, to commit the students of a notification
+    queued by an earlier delta run.
+    """
+    global students_index
+    if not (args.delta or staged):
+        return None
+    with state_lock:
+        if students_index is None:
+            students_index = student_index.StudentIndex(config.get('general', 'studentIndexFile', fallback=r'logs\students.db'), csv_headers)
+    return students_index
+
+
+def get_outbox():
+    """
+    Return the outbox notifications are queued in before being sent, or None when it is disabled.
+    """
+    global mail_outbox
+    outbox_file = config.get('email', 'outboxFile', fallback=None)
+    if not outbox_file or args.testing:
+        return None
+    with state_lock:
+        if mail_outbox is None:
+            mail_outbox = outbox.Outbox(outbox_file, config.get('email', 'outboxFolder', fallback=None))
+    return mail_outbox
+
+
+def queue_email(key: str, notifications: list = None, **email):
+    """
+    Build a message and put it in the outbox under an idempotency key, to be sent by drain_outbox.
+    notifications are the building notifications whose delivery is recorded once it is sent; when
+    the key was already sent (or given up) by an earlier run that outcome is recorded right away.
+    Returns False if the message could not be built.
+    """
+    queue = get_outbox()
+    # With --force notifications already sent are sent again
+    replace = args.force and bool(notifications)
+    entry = None if replace else queue.entry(key)
+    status = entry["status"] if entry is not None else None
+    if entry is None:
+        try:
+            message = create_email_message(**email)
+        except Exception as e:
+            logger.exception(f"Failed to build email notification {email.get('subject')}: {e}")
+            message = None
+        if message is None:
+            return False
+
+        try:
+            status = queue.put(key, message, meta={"notifications": notifications or []}, replace=replace)
+        finally:
+            close_message(message)
+
+    if status is None:
+        logger.info(f"Queued email notification subject: {email.get('subject')}")
+    elif status == outbox.SENT:
+        logger.info(f"Email notification {key} was already sent, skipping.")
+    elif status == outbox.DEAD:
+        entry = entry or queue.entry(key)
+        logger.error(f"Email notification {key} was given up after {entry['attempts']} attempt(s): {entry['last_error']}")
+        if notifications:
+            for notification in notifications:
+                report_error(reason="Email notification given up", error_file="outbox", context=f"{notification['building']} ({notification['date']})",
+                             error_message=f"Email notification {key} was given up after {entry['attempts']} attempt(s) and is not sent again, "
+                                           f"run with --force to resend it \n {entry['last_error']}",
+                             subject="Email Notification Not Sent")
+    else:
+        logger.info(f"Email notification {key} is already queued, skipping.")
+
+    for notification in notifications or []:
+        if status == outbox.SENT:
+            record_delivery(notification, ('success', None))
+        elif status == outbox.DEAD:
+            record_delivery(notification, ('failed', f"Given up in the outbox: {entry['last_error']}"))
+        else:
+            run_ledger = get_run_ledger()
+            if run_ledger is not None:
+                run_ledger.record_notification(notification["date"], notification["building"], notification["file_hash"], 'queued')
+    return True
+
+
+def drain_outbox(workers: int = 1):
+    """
+    Send the due messages of the outbox, including the backlog left by earlier runs, and record their delivery.
+    Messages are sent by workers threads, or by the [email] workers when that is more in batch mode.
+    """
+    outbox_file = config.get('email', 'outboxFile', fallback=None)
+    if mail_outbox is None and not (outbox_file and os.path.exists(outbox_file)):
+        return {}
+    queue = get_outbox()
+    if queue is None:
+        return {}
+    due = queue.due()
+    if not due:
+        return {}
+
+    logger.info(f"Sending {due} message(s) from the outbox ...")
+    with metrics.span('email.send'):
+        if args.batch:
+            workers = max(workers, config.getint('email', 'workers', fallback=4))
+        results = queue.drain(workers=workers,
+                              rate=config.getfloat('email', 'sendRate', fallback=5.0),
+                              retries=config.getint('email', 'maxRetries', fallback=3),
+                              backoff=config.getfloat('email', 'retryBackoff', fallback=1.0),
+                              max_attempts=config.getint('email', 'outboxMaxAttempts', fallback=8),
+                              retry_delay=config.getfloat('email', 'outboxRetryDelay', fallback=60.0),
+                              upload_threshold=config.getint('email', 'uploadThreshold', fallback=send_email.UPLOAD_THRESHOLD))
+
+    for key, (status, detail, attempts, meta) in results.items():
+        for notification in meta.get("notifications", []):
+            record_delivery(notification, (status, detail))
+
+    summary = "\n".join(dispatch.summarize({key: result[:3] for key, result in results.items()}))
+    counts = queue.counts()
+    waiting = counts.get(outbox.PENDING, 0) + counts.get(outbox.UNCONFIRMED, 0)
+    if any(result[0] != 'success' for result in results.values()):
+        logger.error(f"Outbox: {waiting} message(s) waiting to be retried, {counts.get(outbox.DEAD, 0)} given up:\n{summary}")
+    else:
+        logger.info(f"Outbox: {len(results)} message(s) sent:\n{summary}")
+    return results
+
+
+class ExportError(Exception):
+    """A day's export can't be processed at all, e.g. the data folder or the CSV headers are missing."""
+
+
+def export_new_students(date: str):
+    """
+    Export one day's StudentCreated.csv into one file per building.
+    Returns the export details with the building notifications still to be sent,
+    or None if there is nothing to send for that day.
+    Raises ExportError rather than exiting, so the watcher and the catch-up carry on with other days.
     """
-    # get yesterday's date
-    today = datetime.datetime.now()
-    date = today.strftime("%m-%d-%Y")
     cc = adminEmail
 
     if not args.testing:
         if not config.get('general', 'dataFolder'):
-            logger.critical("Data folder path is not configured in the config file.")
-            sys.exit(1)
+            raise ExportError("Data folder path is not configured in the config file.")
 
         # check if the folder exists
         base_folder = config.get('general', 'dataFolder')
         if not os.path.exists(base_folder):
-            logger.error(f"Folder does not exist: {base_folder}")
-            sys.exit(1)
+            raise ExportError(f"Folder does not exist: {base_folder}")
 
         
-        abs_folder_path = rf"{base_folder}\{date}\StudentCreated.csv"
-        # Check if the file exists
-        if not os.path.exists(abs_folder_path):
+        abs_folder_path = os.path.join(base_folder, date, 'StudentCreated.csv')
+        # Check if the file exists and has data before anything else is loaded
+        try:
+            empty = os.stat(abs_folder_path).st_size == 0
+        except FileNotFoundError:
+            empty = True
+        if empty:
             logger.info(f"No new Student Created {abs_folder_path}")
-            sys.exit(0)
+            return None
     else:
-        base_folder = r'config\sample_student_data'
-        if not os.path.exists(rf"{base_folder}\{date}"):
+        base_folder = os.path.join('config', 'sample_student_data')
+        if not os.path.exists(os.path.join(base_folder, date)):
             logger.debug(f"Creating folder for date: {date}")
-            os.mkdir(rf"{base_folder}\{date}")
+            os.makedirs(os.path.join(base_folder, date), exist_ok=True)
         # For testing purposes, use a sample file path
-        abs_folder_path = rf'{base_folder}\StudentCreated.csv'
+        abs_folder_path = os.path.join(base_folder, 'StudentCreated.csv')
         if not os.path.exists(abs_folder_path):
-            logger.CRITICAL(f"Sample file does not exist: {abs_folder_path}")
-            sys.exit(1)
+            raise ExportError(f"Sample file does not exist: {abs_folder_path}")
         cc = sysadmin
 
 
     csv_headers = config.get('general', 'csvFileHeaders')
     if not csv_headers:
-        logger.critical("CSV file headers are not configured in the config file.")
-        sys.exit(1)
+        raise ExportError("CSV file headers are not configured in the config file.")
 
     csv_headers = csv_headers.split(',')
     logger.debug(f"CSV Headers: {csv_headers}")
 
-    # Read the data from the file
-    with open(abs_folder_path, 'r', encoding='utf-8') as csv_file:
-        logger.debug(f"Reading data from {abs_folder_path}")
-        reader = csv.DictReader(csv_file)
-        data = [row for row in reader]
-
-    if not data:
-        logger.info(f"No new student data found in {abs_folder_path}")
-        sys.exit(0)
-
-    # Create a dictionary to hold students grouped by building
-    # The key will be the building name and the value will be a list of students in that building
-    students_building = {}
-    for student in data:
-        # Extract the building name from the row
-        building_name = student['School Name'].strip()
-        if building_name not in students_building:
-            students_building[building_name] = []
-        # Append the student data to the respective building list
-        students_building[building_name].append(student)
-
-    for building_name in students_building.keys():
-        # export students into a csv file
-        building_formatted_name = "".join(re.split('[^a-zA-Z0-9]+', building_name))
-        output_file_name = f"{building_formatted_name}_students.csv"
-        output_location = os.path.join(base_folder, date, output_file_name)
+    export = {"date": date, "source_path": abs_folder_path, "source_hash": None, "notifications": []}
+
+    # Skip the whole day if this export was already processed and every notification delivered
+    run_ledger = get_run_ledger()
+    if run_ledger is not None:
+        with metrics.span('export.hash'):
+            export["source_hash"] = ledger.file_hash(abs_folder_path)
+        if run_ledger.source_unchanged(date, export["source_hash"]):
+            logger.info(f"{abs_folder_path} is unchanged and every building was already notified, nothing to do.")
+            return None
+
+    # Stream the rows straight into one export file per building
+    logger.debug(f"Reading data from {abs_folder_path}")
+    output_folder = os.path.join(base_folder, date)
+    rows = records.read_records(abs_folder_path)
 
+    # Normalize the rows and set aside the ones that must not reach a building file
+    rejects = None
+    if config.getboolean('validation', 'enabled', fallback=True):
+        rejects = records.RejectReport(os.path.join(output_folder, config.get('validation', 'rejectsFileName', fallback='Rejected_students.csv')),
+                                       csv_headers)
+        validator = records.RecordValidator(directory,
+                                            require_grade=config.getboolean('validation', 'requireGrade', fallback=False),
+                                            reject_unknown_buildings=config.getboolean('validation', 'rejectUnknownBuildings', fallback=True),
+                                            match_email_username=config.getboolean('validation', 'matchEmailUsername', fallback=True))
+        rows = validator.validate(rows, rejects)
+
+    # In delta mode only students that are new or changed since they were last notified are exported
+    students_index = get_students_index(csv_headers)
+    if students_index is not None:
+        rows = students_index.diff(rows, date)
+        csv_headers = csv_headers + [student_index.CHANGE_COLUMN]
+
+    with metrics.span('export.partition'):
         try:
-            with open(output_location, 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=csv_headers)
-                writer.writeheader()
-                for student in students_building[building_name]:
-                    writer.writerow(student)
-            logger.info(f"Exported {len(students_building[building_name])} students to {output_location} successfully.")
-
-            secretary_email = config.get('BuildingSecretariesEmails', building_name, fallback=adminEmail)
-            logger.debug(f"Building: {building_name}, Secretary Email: {secretary_email}")
-            if not secretary_email:
-                logger.error(f"No email configured for building: {building_name}. Skipping email notification.")
+            partitions = partition.partition_rows(rows, output_folder, csv_headers,
+                                                  max_open=config.getint('general', 'maxOpenFiles', fallback=32))
+        finally:
+            if rejects is not None:
+                rejects.close()
+    metrics.incr('rows', sum(building.count for building in partitions.values()))
+    metrics.incr('buildings', len(partitions))
+
+    if rejects is not None and rejects.count:
+        metrics.incr('rows_rejected', rejects.count)
+        logger.warning(f"Rejected {rejects.count} row(s) of {abs_folder_path} ({rejects.summary()}), see {rejects.path}")
+        report_error(reason="Rejected student rows", error_file="get_new_student_data function", context=date,
+                     error_message=f"{rejects.count} row(s) of {abs_folder_path} were left out of the building files "
+                                   f"({rejects.summary()}). \n The rejected rows are listed in {rejects.path}",
+                     subject="Rejected Student Rows", other_info=rejects.examples, contexts_name="days")
+
+    if not partitions:
+        logger.info(f"No new {'or changed ' if args.delta else ''}student data found in {abs_folder_path}")
+        finish_export(export)
+        return None
+
+    for building_name, building in partitions.items():
+        with log_pipeline.context(building=building_name):
+            output_location = building.path
+            file_hash = ''
+
+            try:
+                if building.error is not None:
+                    raise building.error
+                logger.info(f"Exported {building.count} students to {output_location} successfully.")
+
+                if run_ledger is not None:
+                    with metrics.span('export.hash'):
+                        file_hash = ledger.file_hash(output_location)
+                    if run_ledger.already_sent(date, building_name, file_hash):
+                        logger.info(f"{building_name} was already notified for {date} and its students are unchanged, skipping.")
+                        continue
+
+                if directory.get(building_name) is None:
+                    logger.warning(f"Building {building_name} is not configured, notifying the admins instead.")
+                secretary_email = directory.recipients(building_name, fallback=adminEmail)
+                logger.debug(f"Building: {building_name}, Secretary Email: {secretary_email}")
+                if not secretary_email:
+                    logger.error(f"No email configured for building: {building_name}. Skipping email notification.")
+                    continue
+
+                export["notifications"].append({"date": date, "building": building_name, "students_count": building.count,
+                                                "file_path": output_folder, "file_name": building.file_name,
+                                                "file_hash": file_hash, "recipient": secretary_email, "cc": cc,
+                                                "delta": students_index is not None})
+            except Exception as e:
+                logger.exception(f"Error writing to CSV file {output_location}: {e}")
+                if run_ledger is not None:
+                    run_ledger.record_notification(date, building_name, file_hash, 'failed', e)
+                report_error(reason=error_reason(e), error_file="get_new_student_data function", context=f"{building_name} ({date})",
+                             error_message=f"Error writing to CSV file {output_location} \n {str(e)}",
+                             subject="Error in Student Data Export", other_info=building.failed_rows)
+
+    return export
+
+
+def record_delivery(notification: dict, result: tuple):
+    """
+    Record the outcome of a building notification in the run ledger and, once delivered,
+    add the building's students to the delta index.
+    """
+    sent = bool(result) and result[0] == 'success'
+    run_ledger = get_run_ledger()
+    if run_ledger is not None:
+        run_ledger.record_notification(notification["date"], notification["building"], notification["file_hash"],
+                                       'sent' if sent else 'failed', None if sent or not result else result[1])
+    if sent and notification.get("delta"):
+        index = get_students_index(config.get('general', 'csvFileHeaders').split(','), staged=True)
+        index.commit_building(notification["date"], notification["building"])
+
+
+def finish_export(export: dict):
+    """
+    Mark a day's export as processed in the run ledger.
+    """
+    run_ledger = get_run_ledger()
+    if run_ledger is not None and export["source_hash"]:
+        run_ledger.record_source(export["date"], export["source_path"], export["source_hash"])
+
+
+def notify_buildings(export: dict):
+    """
+    Send the new students notification of every building in a day's export.
+    """
+    batch_messages = {}
+    queue = get_outbox()
+    for notification in export["notifications"]:
+        with log_pipeline.context(building=notification["building"]):
+            building_name, date = notification["building"], notification["date"]
+            email = dict(data={"building": building_name.upper(), "date": date, "students_count": notification["students_count"]},
+                         recipient=notification["recipient"],
+                         subject=f"New Students Created for {building_name} on {date}",
+                         file_path=notification["file_path"],
+                         file_name=notification["file_name"],
+                         template_name='new_students_email_template.html',
+                         with_attachment=True,
+                         cc=notification["cc"])
+
+            # With the outbox the message is only queued here, drain_outbox sends it at the end of the run
+            if queue is not None:
+                file_hash = notification["file_hash"] or ledger.file_hash(os.path.join(notification["file_path"], notification["file_name"]))
+                if not queue_email(f"notify/{date}/{building_name}/{file_hash}", [notification], **email):
+                    record_delivery(notification, None)
+                continue
+
+            # In batch mode build the message now and send all buildings together at the end
+            if args.batch:
+                try:
+                    message = create_email_message(**email)
+                except Exception as e:
+                    logger.exception(f"Failed to build email notification for {building_name}: {e}")
+                    message = None
+                if message is None:
+                    record_delivery(notification, None)
+                else:
+                    batch_messages[building_name] = message
                 continue
 
-            # remove any new line characters from the email address
-            secretary_email = [email.strip() for email in secretary_email.split(',')]
-            # join the emails back with comma separator
-            secretary_email = ','.join(secretary_email)
-                
             # Send email notification to building secretaries with a summary of the students
-            send_email_notification(data={"building": building_name.upper(), "date": date, "students_count": len(students_building[building_name])},
-                                    recipient=secretary_email, 
-                                    subject=f"New Students Created for {building_name} on {date}",
-                                    file_path=os.path.join(base_folder, date),
-                                    file_name=output_file_name,
-                                    template_name='new_students_email_template.html',
-                                    with_attachment=True,
-                                    cc=cc)    
+            record_delivery(notification, send_email_notification(**email))
+
+    results = dispatch_notifications(batch_messages)
+    for notification in export["notifications"]:
+        if notification["building"] in results:
+            record_delivery(notification, results[notification["building"]][:2])
+
+    finish_export(export)
+
+
+def send_digests(exports: list):
+    """
+    Merge the exports of several days into one notification per building, with one attachment per day.
+    """
+    notifications_building = {}
+    for export in exports:
+        for notification in export["notifications"]:
+            notifications_building.setdefault(notification["building"], []).append(notification)
+
+    for building_name, notifications in notifications_building.items():
+        notifications.sort(key=lambda notification: datetime.datetime.strptime(notification["date"], "%m-%d-%Y"))
+        first, last = notifications[0]["date"], notifications[-1]["date"]
+        dates = first if first == last else f"{first} to {last}"
+        attachments = [(notification["file_path"], notification["file_name"], f"{notification['date']}_{notification['file_name']}")
+                       for notification in notifications]
+        email = dict(data={"building": building_name.upper(), "date": dates,
+                                               "students_count": sum(notification["students_count"] for notification in notifications)},
+                                         recipient=notifications[0]["recipient"],
+                                         subject=f"New Students Created for {building_name} on {dates}",
+                                         template_name='new_students_email_template.html',
+                                         attachments=attachments,
+                                         cc=notifications[0]["cc"])
+
+        if get_outbox() is not None:
+            files = "".join(notification["file_hash"] or ledger.file_hash(os.path.join(notification["file_path"], notification["file_name"]))
+                            for notification in notifications)
+            key = f"digest/{building_name}/{dates}/{hashlib.sha1(files.encode()).hexdigest()}"
+            if not queue_email(key, notifications, **email):
+                for notification in notifications:
+                    record_delivery(notification, None)
+            continue
+
+        result = send_email_notification(**email)
+        for notification in notifications:
+            record_delivery(notification, result)
+
+    for export in exports:
+        finish_export(export)
+
+
+def digest_mode() -> bool:
+    return args.digest or config.getboolean('email', 'digest', fallback=False)
+
+
+def group_by_recipients(notifications: list):
+    """
+    Work out who receives each building notification (To and Cc) and group the addresses that
+    receive exactly the same buildings. Returns one (to, cc, notifications) entry per email to send:
+    staff shared by several buildings get all of them in one email, while a building's own
+    secretaries only get that building.
+    """
+    address_indexes, formatted_address, to_addresses = {}, {}, set()
+    for index, notification in enumerate(notifications):
+        for field in ("recipient", "cc"):
+            for recipient in buildings.parse_recipients(notification[field] or '')[0]:
+                address = buildings.address_of(recipient)
+                formatted_address.setdefault(address, recipient)
+                address_indexes.setdefault(address, set()).add(index)
+                if field == "recipient":
+                    to_addresses.add(address)
+
+    groups = {}
+    for address, indexes in address_indexes.items():
+        groups.setdefault(frozenset(indexes), []).append(address)
+
+    emails = []
+    for indexes, addresses in sorted(groups.items(), key=lambda group: (min(group[0]), len(group[0]))):
+        to = [formatted_address[address] for address in addresses if address in to_addresses]
+        cc = [formatted_address[address] for address in addresses if address not in to_addresses]
+        if not to:
+            to, cc = cc, []
+        emails.append((','.join(to), ','.join(cc), [notifications[index] for index in sorted(indexes)]))
+    return emails
+
+
+def send_recipient_digests(exports: list):
+    """
+    Digest mode: send one email per group of recipients sharing the same buildings (see
+    group_by_recipients) with one attachment per building, instead of one email per building.
+    """
+    notifications = [notification for export in exports for notification in export["notifications"]]
+    emails = group_by_recipients(notifications)
+    deliveries = sum(len(buildings.parse_recipients(notification[field] or '')[0])
+                     for notification in notifications for field in ("recipient", "cc"))
+    logger.info(f"Digest mode: {len(emails)} email(s) to {sum(len(buildings.parse_recipients(f'{to},{cc}')[0]) for to, cc, _ in emails)} "
+                f"recipient(s) instead of {len(notifications)} email(s) to {deliveries} recipient(s)")
+
+    queue = get_outbox()
+    results = {}
+    for to, cc, group in emails:
+        group.sort(key=lambda notification: (datetime.datetime.strptime(notification["date"], "%m-%d-%Y"), notification["building"]))
+        first, last = group[0]["date"], group[-1]["date"]
+        dates = first if first == last else f"{first} to {last}"
+        several_days = first != last
+        attachments = [(notification["file_path"], notification["file_name"],
+                        f"{notification['date']}_{notification['file_name']}" if several_days else notification["file_name"])
+                       for notification in group]
+        students_count = sum(notification["students_count"] for notification in group)
+        building_names = sorted({notification["building"] for notification in group})
+        if len(building_names) == 1:
+            data = {"building": building_names[0].upper(), "date": dates, "students_count": students_count}
+            subject = f"New Students Created for {building_names[0]} on {dates}"
+            template_name = 'new_students_email_template.html'
+        else:
+            data = {"date": dates, "students_count": students_count,
+                    "buildings": [{"building": notification["building"], "date": notification["date"],
+                                   "students_count": notification["students_count"], "file_name": attachment[2]}
+                                  for notification, attachment in zip(group, attachments)]}
+            subject = f"New Students Created for {len(building_names)} buildings on {dates}"
+            template_name = 'new_students_digest_email_template.html'
+        email = dict(data=data, recipient=to, cc=cc or None, subject=subject, template_name=template_name, attachments=attachments)
+
+        if queue is not None:
+            files = [notification["file_hash"] or ledger.file_hash(os.path.join(notification["file_path"], notification["file_name"]))
+                     for notification in group]
+            key = f"group/{dates}/{hashlib.sha1(f'{to};{cc};{files}'.encode('utf-8')).hexdigest()}"
+            if not queue_email(key, group, **email):
+                for notification in group:
+                    record_delivery(notification, None)
+            continue
+
+        result = send_email_notification(**email)
+        for notification in group:
+            results.setdefault(id(notification), []).append(result)
+
+    if queue is None:
+        # A building is delivered once every email carrying its file was sent
+        for notification in notifications:
+            outcomes = results.get(id(notification), [])
+            failed = [result for result in outcomes if not result or result[0] != 'success']
+            record_delivery(notification, failed[0] if failed else outcomes[0] if outcomes else None)
+
+    for export in exports:
+        finish_export(export)
+
+
+def get_new_student_data():
+    """
+    Function to get new student data.
+    Exports today's StudentCreated.csv per building and notifies the building secretaries.
+    """
+    date = datetime.datetime.now().strftime("%m-%d-%Y")
+    with log_pipeline.context(date=date):
+        try:
+            export = export_new_students(date)
+        except ExportError as e:
+            logger.critical(str(e))
+            sys.exit(1)
+        if export is not None:
+            if digest_mode():
+                send_recipient_digests([export])
+            else:
+                notify_buildings(export)
+    finish_run()
+
+
+def catch_up(from_date: datetime.date, to_date: datetime.date):
+    """
+    Process every dated export folder between from_date and to_date (inclusive) concurrently.
+    Each day keeps its own per building files; with --merge_days every building receives a
+    single digest covering all the days instead of one email per day.
+    """
+    dates = [(from_date + datetime.timedelta(days=offset)).strftime("%m-%d-%Y")
+             for offset in range((to_date - from_date).days + 1)]
+    workers = send_workers = config.getint('general', 'catchUpWorkers', fallback=4)
+    if args.delta:
+        # The delta index must see the days in order, their notifications can still be sent concurrently
+        workers = 1
+    logger.info(f"Catching up {len(dates)} day(s) from {dates[0]} to {dates[-1]} with {workers} worker(s)")
+
+    def process_day(date):
+        try:
+            with log_pipeline.context(date=date):
+                export = export_new_students(date)
+                if export is not None and not (args.merge_days or digest_mode()):
+                    notify_buildings(export)
+            return export
         except Exception as e:
-            logger.exception(f"Error writing to CSV file {output_location}: {e}")
-            # Function to send email notification
-            send_email_notification(data={"error_message": f"Error writing to CSV file {output_location} \n {str(e)}",
-                                          "error_file": "get_new_student_data function",
-                                          "other_info": students_building[building_name],
-                                          "error_timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
-                                    recipient=sysadmin,
-                                    subject=f"Error in Student Data Export for {building_name}",
-                                    template_name='error_email_template.html')
+            logger.exception(f"Failed to process export for {date}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        exports = [export for export in pool.map(process_day, dates) if export is not None]
+
+    if digest_mode():
+        send_recipient_digests(exports)
+    elif args.merge_days:
+        send_digests(exports)
+
+    logger.info(f"Catch up finished, {len(exports)} day(s) with new students")
+    # The days only queued their notifications, sending them is most of the catch-up
+    finish_run(send_workers=max(1, send_workers))
+
+
+def watch_exports():
+    """
+    Run until stopped, processing every new or modified StudentCreated.csv as soon as it has been
+    completely written. Gmail credentials and the email templates stay loaded between files.
+    """
+    data_folder = config.get('general', 'dataFolder', fallback=None)
+    if not data_folder or not os.path.isdir(data_folder):
+        logger.critical(f"Data folder does not exist: {data_folder}")
+        sys.exit(1)
+
+    poll_interval = config.getfloat('watch', 'pollInterval', fallback=5.0)
+    export_watcher = watcher.ExportWatcher(data_folder,
+                                           settle=config.getfloat('watch', 'settleSeconds', fallback=10.0),
+                                           lookback_days=config.getint('watch', 'lookbackDays', fallback=1))
+    heartbeat = watcher.Heartbeat(config.get('watch', 'heartbeatFile', fallback=None))
+    stop_event = threading.Event()
+    watcher.stop_on_signals(stop_event)
+
+    def process_day(date):
+        try:
+            with log_pipeline.context(date=date):
+                export = export_new_students(date)
+                if export is not None:
+                    if digest_mode():
+                        send_recipient_digests([export])
+                    else:
+                        notify_buildings(export)
+        finally:
+            finish_run()
+            write_metrics()
+
+    logger.info(f"Watching {data_folder} for new exports every {poll_interval:g}s ...")
+    # Between files, keep retrying the outbox backlog
+    watcher.watch(export_watcher, process_day, stop_event=stop_event, poll_interval=poll_interval, heartbeat=heartbeat,
+                  on_idle=finish_run)
+    logger.info("Stopped watching for new exports")
+
+
+def error_reason(e: Exception) -> str:
+    """
+    Return what identifies a failure across buildings: the exception type and, for OS errors, the
+    errno and message without the file name, which is different for every building.
+    """
+    if isinstance(e, OSError) and (e.errno is not None or e.strerror):
+        return f"{type(e).__name__}: [Errno {e.errno}] {e.strerror}"
+    return f"{type(e).__name__}: {e}"
+
+
+def report_error(reason: str, error_file: str, context: str, error_message: str, subject: str, other_info: list = None,
+                 contexts_name: str = "buildings"):
+    """
+    Queue an error notification for the sysadmin. Errors with the same reason raised from the
+    same place are merged, so one systemic failure sends a single email listing every
+    building (or day, see contexts_name) it affected. The queued errors are sent by send_error_reports.
+    """
+    with state_lock:
+        report = error_reports.setdefault((error_file, reason), {"error_message": error_message, "subject": subject,
+                                                                 "contexts": [], "other_info": [],
+                                                                 "contexts_name": contexts_name})
+        report["contexts"].append(context)
+        report["other_info"].extend(other_info or [])
+
+
+def send_error_reports():
+    """
+    Send one error notification per distinct failure queued by report_error.
+    """
+    with state_lock:
+        reports = list(error_reports.items())
+        error_reports.clear()
+
+    for (error_file, reason), report in reports:
+        contexts = report["contexts"]
+        if len(contexts) == 1:
+            error_message, subject = report["error_message"], f"{report['subject']} for {contexts[0]}"
+        else:
+            error_message = f"{reason} \n Affected {len(contexts)} {report['contexts_name']}: {', '.join(contexts)} \n " \
+                            f"First error: {report['error_message']}"
+            subject = f"{report['subject']} for {len(contexts)} {report['contexts_name']}"
+        email = dict(data={"error_message": error_message,
+                           "error_file": error_file,
+                           "other_info": report["other_info"],
+                           "error_timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
+                     recipient=sysadmin,
+                     subject=subject,
+                     template_name='error_email_template.html')
+        if get_outbox() is not None:
+            # The same error is reported once a day, however many runs or watch cycles hit it
+            digest = hashlib.sha1(f"{subject}\n{error_message}".encode('utf-8')).hexdigest()
+            queue_email(f"error/{datetime.date.today().isoformat()}/{digest}", **email)
+        else:
+            send_email_notification(**email)
+
+
+def finish_run(send_workers: int = 1):
+    """
+    Send the queued error notifications and the outbox (with send_workers threads), then close the
+    run ledger, delta index and outbox opened during this run.
+    """
+    global run_ledger, students_index, mail_outbox
+    send_error_reports()
+    try:
+        drain_outbox(send_workers)
+    except Exception as e:
+        logger.exception(f"Failed to send the outbox: {e}")
+    with state_lock:
+        if mail_outbox is not None:
+            mail_outbox.close()
+            mail_outbox = None
+        if run_ledger is not None:
+            run_ledger.close()
+            run_ledger = None
+        if students_index is not None:
+            students_index.close()
+            students_index = None
 
         
-def send_email_notification(data: dict = None, recipient: str = None, subject: str = " ", file_path: str = None, file_name: str = None, template_name: str = None, with_attachment: bool = False, message: str = "TESTING EMAIL NOTIFICATION", cc: str = None):
+def get_templates():
+    """
+    Return the email templates, compiling them the first time a message is built.
+    """
+    global templates
+    with state_lock:
+        if templates is None:
+            templates = email_templates.TemplateCache('templates')
+    return templates
+
+
+def create_email_message(data: dict = None, recipient: str = None, subject: str = " ", file_path: str = None, file_name: str = None, template_name: str = None, with_attachment: bool = False, cc: str = None, attachments: list = None):
+    """
+    Render the email template and build the MIME message ready to be sent.
+    Returns None if the message could not be built.
+    """
+    if not template_name:
+        logger.critical("Email template name not provided for email notification")
+        return None
+
+    logger.debug(f"Using email template: {template_name}")
+    with metrics.span('email.render'):
+        rendered_email = get_templates().render(template_name, data)
+
+    attachments = list(attachments or [])
+    if with_attachment:
+        if not (file_path and file_name):
+            logger.critical("File path, file name or template name not provided for email notification with attachment")
+            return None
+        attachments.insert(0, (file_path, file_name))
+
+    if attachments:
+        # Attachments are streamed into a spooled file instead of being built in memory
+        return send_email.CreateMessageFile(serviceAccount, recipient, subject, rendered_email, attachments=attachments, cc=cc,
+                                            upload_threshold=config.getint('email', 'uploadThreshold', fallback=send_email.UPLOAD_THRESHOLD))
+
+    return send_email.CreateMessageWithAttachment(serviceAccount, recipient, subject, rendered_email, cc=cc)
+
+
+def close_message(message):
+    """
+    Release the spooled file behind a message built by send_email.CreateMessageFile.
+    """
+    if isinstance(message, send_email.MessageFile):
+        message.close()
+
+
+def send_email_notification(data: dict = None, recipient: str = None, subject: str = " ", file_path: str = None, file_name: str = None, template_name: str = None, with_attachment: bool = False, message: str = "TESTING EMAIL NOTIFICATION", cc: str = None, attachments: list = None):
     
     if recipient:
 
         send_email_message = None
-        
-        email_template = env.get_template(template_name)
-        logger.debug(f"Using email template: {template_name}")
-        rendered_email = email_template.render(data)
-
-        if with_attachment:
-
-            if file_path and file_name and template_name:
-               
-               
 
-                # Function to send email notification
-                logger.info(f"Sending email notification with attachment subject: {subject} ...")
-                logger.debug(f"Email subject: {subject}")
-                logger.debug(f"Email recipient: {recipient}")
-                try:
-                    send_email_message = send_email.sendMessage('me', send_email.CreateMessageWithAttachment(serviceAccount, recipient, 
-                                                                                subject, rendered_email, file_dir=file_path, filename=file_name, cc=cc))
-                  
-                except Exception as e:
-                    logger.exception(f"Failed to send email notification with attachment: {e}")
-            
-            else:
-                logger.critical("File path, file name or template name not provided for email notification with attachment")   
-        else:
-            if not template_name:
-                logger.critical("Email template name not provided for email notification without attachment")
-                return
-            
-           
-            # Function to send email notification
-            logger.info(f"Sending email notification without attachment subject: {subject} ...")
-            logger.debug(f"Email subject: {subject}")
-            logger.debug(f"Email recipient: {recipient}")
+        # Function to send email notification
+        logger.info(f"Sending email notification {'with' if with_attachment or attachments else 'without'} attachment subject: {subject} ...")
+        logger.debug(f"Email subject: {subject}")
+        logger.debug(f"Email recipient: {recipient}")
+        try:
+            email_message = create_email_message(data=data, recipient=recipient, subject=subject, file_path=file_path,
+                                                 file_name=file_name, template_name=template_name,
+                                                 with_attachment=with_attachment, cc=cc, attachments=attachments)
+            if email_message is None:
+                return None
             try:
-                send_email_message = send_email.sendMessage('me', send_email.CreateMessageWithAttachment(serviceAccount, recipient, 
-                                                                                    subject, rendered_email))
-            except Exception as e:
-                logger.exception(f"Failed to send email notification: {e}")
+                with metrics.span('email.send'):
+                    send_email_message = send_email.sendMessage('me', email_message)
+            finally:
+                close_message(email_message)
+        except Exception as e:
+            logger.exception(f"Failed to send email notification: {e}")
 
         # Check if the email was sent successfully
         if send_email_message:
@@ -268,28 +1002,107 @@ def send_email_notification(data: dict = None, recipient: str = None, subject: s
             else:
                 logger.error(f"Failed to send email notification: {send_email_message[1]}")
 
+        return send_email_message
+
     else:   
         logger.critical("No recipient email provided or email template, skipping email notification")
 
 
+def dispatch_notifications(messages: dict):
+    """
+    Send the prepared building notifications concurrently and log a per building summary.
+    """
+    if not messages:
+        return {}
+
+    logger.info(f"Sending {len(messages)} building notification(s) in batch mode ...")
+    try:
+        with metrics.span('email.send'):
+            results = dispatch.send_batch(messages,
+                                          workers=config.getint('email', 'workers', fallback=4),
+                                          rate=config.getfloat('email', 'sendRate', fallback=5.0),
+                                          retries=config.getint('email', 'maxRetries', fallback=3),
+                                          backoff=config.getfloat('email', 'retryBackoff', fallback=1.0))
+    finally:
+        for message in messages.values():
+            close_message(message)
+
+    failed = [key for key, result in results.items() if result[0] != 'success']
+    summary = "\n".join(dispatch.summarize(results))
+    if failed:
+        logger.error(f"Batch send finished, {len(results) - len(failed)} sent, {len(failed)} failed:\n{summary}")
+    else:
+        logger.info(f"Batch send finished, {len(results)} sent:\n{summary}")
+    return results
+
+
+
+def parse_date(value: str) -> datetime.date:
+    """
+    argparse type for the MM-DD-YYYY dates used to name the export folders.
+    """
+    try:
+        return datetime.datetime.strptime(value, "%m-%d-%Y").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid date '{value}', expected MM-DD-YYYY")
+
 
 def main():
 
-    if (args.reset_password):
+    if (args.bulk_reset):
+
+        bulk_reset_passwords(args.bulk_reset)
+
+    elif (args.reset_password):
         
-        reset_student_password(args.username, args.building.upper())
+        with log_pipeline.context(username=args.username):
+            reset_student_password(args.username, args.building.upper())
+
+    elif (args.from_date):
+
+        catch_up(args.from_date, args.to_date or datetime.date.today())
+
+    elif (args.watch):
+
+        watch_exports()
+
+    elif (args.serve):
+
+        serve_resets()
 
     else:
 
         get_new_student_data() 
 
+    logger.debug(f"Gmail client: {send_email.getClient().timing_report()}")
+    logger.debug(f"Startup: imports {import_time * 1000:.1f}ms, deferred imports: {lazy_import.report()}, "
+                 f"total run {(time.perf_counter() - startup_time) * 1000:.1f}ms")
+
+
+def write_metrics():
+    """
+    Write the run's stage timings and counters, called at exit so runs that end early are recorded too.
+    """
+    mode = ('bulk_reset' if args.bulk_reset else 'reset_password' if args.reset_password
+            else 'catch_up' if args.from_date else 'watch' if args.watch else 'serve' if args.serve else 'export')
+    try:
+        metrics_file = config.get('logs', 'metricsFile', fallback=None)
+        if metrics_file:
+            metrics.metrics.write_json(metrics_file, mode=mode, import_seconds=round(import_time, 6))
+        prometheus_file = config.get('logs', 'prometheusFile', fallback=None)
+        if prometheus_file:
+            metrics.metrics.write_prometheus(prometheus_file, mode=mode)
+    except Exception as e:
+        logger.error(f"Failed to write run metrics: {e}")
+
 
 
 
 if __name__ == "__main__":
     # Load Config file
     config = ConfigParser()
-    config.read(r'config\\update-students.ini')
+    config_file = os.path.join('config', 'update-students.ini')
+    config.read(config_file)
     if not config.sections():
         logging.CRITICAL("Configuration file is empty or not found.")
         sys.exit(1)
@@ -312,6 +1125,17 @@ if __name__ == "__main__":
     parser.add_argument('-rp', '--reset_password', action='store_true', help='Reset student passwords')
     parser.add_argument('-u', '--username', type=str, help='Username of the student to update')
     parser.add_argument('-b', '--building', type=str, help='Student building name for email notification use => [RRMS, TDS, SPG, OHHS, JFD, COH, DEL, OAK, BMS, DMS]')   
+    parser.add_argument('-br', '--bulk_reset', type=str, metavar='FILE', help='Reset the passwords of every student in a CSV file with username and building columns')
+    parser.add_argument('-f', '--force', action='store_true', help='Ignore the run ledger and export and notify every building again')
+    parser.add_argument('-d', '--delta', action='store_true', help='Only send students that are new or changed since they were last notified')
+    parser.add_argument('--from', dest='from_date', type=parse_date, metavar='MM-DD-YYYY', help='Catch up on every export folder from this date')
+    parser.add_argument('--to', dest='to_date', type=parse_date, metavar='MM-DD-YYYY', help='Last date to catch up on, defaults to today')
+    parser.add_argument('--merge_days', action='store_true', help='When catching up, send one digest per building covering all the days')
+    parser.add_argument('--profile', type=str, metavar='FILE', help='Run under cProfile and write the stats to FILE')
+    parser.add_argument('--watch', action='store_true', help='Keep running and process new export folders as soon as they appear')
+    parser.add_argument('--serve', action='store_true', help='Keep running and serve help-desk password resets over a local HTTP/JSON API')
+    parser.add_argument('--digest', action='store_true', help='Send one email per group of recipients sharing the same buildings, with one attachment per building')
+    parser.add_argument('--batch', action='store_true', help='Build every building notification first and send them concurrently')
     parser.add_argument('-t', '--testing', action='store_true', help='For testing purposes only, do not use in production')
 
     args = parser.parse_args()
@@ -324,19 +1148,52 @@ if __name__ == "__main__":
         logging.CRITICAL(f"Invalid log level: {logLevel}")
         sys.exit(1)
 
-    logging.basicConfig(level=numeric_level, 
-                        format="{asctime} - {levelname} - {message}", 
-                        style="{",
-                        datefmt="%Y-%m-%d %H:%M:%S",
-                        handlers=[ logging.FileHandler(filename=logFile, mode='a+', encoding='utf-8'),
-                                    logging.StreamHandler()
-                                ]
-                )
-        
+    # Records are queued and written by a background thread, the log file is rotated and old logs gzipped
+    text_formatter = logging.Formatter(log_pipeline.TEXT_FORMAT, style="{", datefmt=log_pipeline.DATE_FORMAT)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(text_formatter)
+    log_handlers = [console_handler]
+    if config.get('logs', 'logType', fallback='FILE').upper() != 'CONSOLE':
+        file_handler = log_pipeline.file_handler(logFile,
+                                                 max_bytes=config.getint('logs', 'rotateBytes', fallback=10 * 2 ** 20),
+                                                 when=config.get('logs', 'rotateWhen', fallback=None) or None,
+                                                 backup_count=config.getint('logs', 'backupCount', fallback=10),
+                                                 compress=config.getboolean('logs', 'compressRotated', fallback=True))
+        json_lines = config.get('logs', 'logFormat', fallback='text').lower() == 'json'
+        file_handler.setFormatter(log_pipeline.JsonFormatter() if json_lines else text_formatter)
+        log_handlers.insert(0, file_handler)
+    log_pipeline.setup(numeric_level, log_handlers)
+
     logger = logging.getLogger(__name__)
 
+    # Resolve buildings once; malformed recipients are reported now rather than when sending
+    directory = buildings.BuildingDirectory.load(config_file, config.get('general', 'buildingCacheFile', fallback=None))
+    for problem in directory.validate():
+        logger.error(f"Configuration problem in [BuildingSecretariesEmails] {problem}")
+    adminEmail = ','.join(buildings.parse_recipients(adminEmail)[0]) or adminEmail
+
     
-    if args.reset_password:
+    if args.to_date and not args.from_date:
+        logger.critical('--to can only be used together with --from.')
+        sys.exit(1)
+
+    if args.from_date and args.from_date > (args.to_date or datetime.date.today()):
+        logger.critical('--from must not be after --to.')
+        sys.exit(1)
+
+    if args.watch and (args.from_date or args.testing):
+        logger.critical('--watch cannot be combined with --from or --testing.')
+        sys.exit(1)
+
+    if args.serve and (args.watch or args.testing):
+        logger.critical('--serve cannot be combined with --watch or --testing.')
+        sys.exit(1)
+
+    if args.bulk_reset and not os.path.exists(args.bulk_reset):
+        logger.critical(f"Bulk reset file does not exist: {args.bulk_reset}")
+        sys.exit(1)
+
+    if args.reset_password and not args.bulk_reset:
         if not args.username:
             logger.critical('Username must be provided when resetting password.')
             sys.exit(1)
@@ -349,8 +1206,20 @@ if __name__ == "__main__":
             logger.critical('Building name must contain only letters')
             sys.exit(1)
         
-        if str(args.building).upper() not in ['RRMS', 'TDS', 'SPG', 'OHHS', 'JFD', 'COH', 'DEL', 'OAK', 'BMS', 'DMS']:
-            logger.critical(f"Invalid building name: {args.building}. Must be one of: RRMS, TDS, SPG, OHHS, JFD, COH, DEL, OAK, BMS, DMS")
+        if str(args.building).upper() not in directory.short_codes:
+            logger.critical(f"Invalid building name: {args.building}. Must be one of: {', '.join(directory.short_codes)}")
             sys.exit(1)
-        
-    main()
+
+    atexit.register(write_metrics)
+
+    if args.profile:
+        # Profile the whole run and save the stats for pstats/snakeviz
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(main)
+        finally:
+            profiler.dump_stats(args.profile)
+            logger.info(f"Profile written to {args.profile}")
+    else:
+        main()